@@ -7,23 +7,44 @@ from typing import Optional
 from models import User
 from database import get_db
 from config import settings
+from utils import TTLCache
 from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import asyncio
+import logging
+import time
 import pytz
 
 SECRET_KEY = settings.JWT_SECRET_KEY
 ALGORITHM = settings.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 
+logger = logging.getLogger(__name__)
+
 # Use bcrypt as the preferred backend
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=12)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.PASSWORD_HASH_ROUNDS)
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# Users resolved from a token, keyed by the token subject (email)
+_user_cache = TTLCache(maxsize=settings.USER_CACHE_MAX_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS)
+
+# bcrypt takes ~250 ms per call at 12 rounds, so it runs in a bounded worker pool
+_password_executor = None
+_password_jobs = 0
+password_hash_metrics = {
+    "hash": {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0},
+    "verify": {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0},
+    "rehash": 0,
+    "rejected": 0,
+}
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     try:
         return pwd_context.verify(plain_password, hashed_password)
     except Exception as e:
-        print(f"Password verification error: {e}")
+        logger.error("Password verification error: %s", e)
         return False
 
 
@@ -34,13 +55,125 @@ def get_password_hash(password: str) -> str:
             password = password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
         return pwd_context.hash(password)
     except Exception as e:
-        print(f"Password hashing error: {e}")
+        logger.error("Password hashing error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Password hashing error"
         )
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    """True when a stored hash uses a deprecated scheme or different bcrypt rounds than configured"""
+    try:
+        if pwd_context.needs_update(hashed_password):
+            return True
+        return int(hashed_password.split("$")[2]) != settings.PASSWORD_HASH_ROUNDS
+    except (ValueError, IndexError):
+        return False
+
+
+def _get_password_executor():
+    global _password_executor
+    if _password_executor is None:
+        if settings.PASSWORD_HASH_EXECUTOR == "process":
+            _password_executor = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS)
+        else:
+            _password_executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+            )
+    return _password_executor
+
+
+def shutdown_password_executor():
+    global _password_executor
+    if _password_executor is not None:
+        _password_executor.shutdown(wait=False)
+        _password_executor = None
+
+
+async def _run_password_job(kind: str, func, *args):
+    global _password_jobs
+    if _password_jobs >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE:
+        password_hash_metrics["rejected"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many concurrent password operations, please retry",
+            headers={"Retry-After": "1"},
+        )
+
+    _password_jobs += 1
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_password_executor(), func, *args)
+    finally:
+        _password_jobs -= 1
+        elapsed = time.perf_counter() - start
+        metric = password_hash_metrics[kind]
+        metric["count"] += 1
+        metric["total_seconds"] += elapsed
+        metric["max_seconds"] = max(metric["max_seconds"], elapsed)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_password_job("verify", verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_password_job("hash", get_password_hash, password)
+
+
+def password_hash_stats() -> dict:
+    stats = {"in_flight": _password_jobs, "rehash": password_hash_metrics["rehash"],
+             "rejected": password_hash_metrics["rejected"]}
+    for kind in ("hash", "verify"):
+        metric = password_hash_metrics[kind]
+        stats[kind] = dict(metric, avg_seconds=metric["total_seconds"] / metric["count"] if metric["count"] else 0.0)
+    return stats
+
+
+def invalidate_cached_user(email: str):
+    """Call after any write to a user document"""
+    _user_cache.pop(email)
+
+
+# changing any of these revokes the tokens issued so far
+REVOKING_FIELDS = {"email", "password", "role"}
+
+
+async def update_user(db, email: str, changes: dict) -> bool:
+    """Write to a user document; role, email and password changes also revoke the user's tokens"""
+    update = {"$set": changes}
+    if REVOKING_FIELDS & set(changes):
+        update["$inc"] = {"token_version": 1}
+    result = await db.users.update_one({"email": email}, update)
+    invalidate_cached_user(email)
+    return result.matched_count > 0
+
+
+async def revoke_tokens(db, email: str) -> bool:
+    """Invalidate every token issued to the user so far"""
+    result = await db.users.update_one({"email": email}, {"$inc": {"token_version": 1}})
+    invalidate_cached_user(email)
+    return result.matched_count > 0
+
+
+async def delete_user(db, email: str) -> bool:
+    result = await db.users.delete_one({"email": email})
+    invalidate_cached_user(email)
+    return result.deleted_count > 0
+
+
+def user_claims(user: User) -> Dict[str, Any]:
+    """Claims needed for authorization, embedded in the access token"""
+    return {
+        "sub": user.email,
+        "uid": str(user.id),
+        "role": user.role,
+        "ver": user.token_version,
+    }
+
+
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     
@@ -63,27 +196,106 @@ async def authenticate_user(email: str, password: str):
     # Changed from username to email for authentication
     db = await get_db()  # ensure db is connected
     user = await db.users.find_one({"email": email})
-    if not user or not verify_password(password, user["password"]):
+    if not user or not await verify_password_async(password, user["password"]):
         return False
+
+    # Upgrade hashes created with another rounds setting while we still have the plain password
+    if needs_rehash(user["password"]):
+        user["password"] = await get_password_hash_async(password)
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"password": user["password"]}})
+        invalidate_cached_user(email)
+        password_hash_metrics["rehash"] += 1
     return User(**user)
 
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    db = await get_db()
+    return await user_from_token(credentials.credentials)
+
+
+async def get_stream_user(
+    access_token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+):
+    """Bearer token, or ?access_token= for clients that cannot set headers (EventSource)"""
+    token = credentials.credentials if credentials else access_token
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return await user_from_token(token)
+
+
+async def user_from_token(token: str) -> User:
+    """
+    The user of a valid token, from the per-process cache when the token's version still
+    matches. Revocations made by this process apply at once, those made elsewhere once the
+    cached entry expires (USER_CACHE_TTL_SECONDS).
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(credentials.credentials, settings.JWT_SECRET_KEY, algorithms=[settings.ALGORITHM])
+        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
+
+    token_version = payload.get("ver", 0)
+
+    # Fast path: a recently seen user whose token version still matches
+    cached_user = _user_cache.get(email)
+    if cached_user is not None and cached_user.token_version == token_version:
+        return cached_user
+
+    db = await get_db()
     user = await db.users.find_one({"email": email})
     if user is None:
         raise credentials_exception
-    return User(**user)
\ No newline at end of file
+    user = User(**user)
+    if user.token_version != token_version:
+        # token issued before the version was bumped
+        raise credentials_exception
+
+    _user_cache.set(email, user)
+    return user
+
+
+async def require_admin(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+
+async def main(command: str, email: str, role: Optional[str]) -> int:
+    import database
+    from database import connect_to_mongo, close_mongo_connection
+
+    await connect_to_mongo()
+    try:
+        if command == "revoke":
+            found = await revoke_tokens(database.db, email)
+        elif command == "set-role":
+            found = await update_user(database.db, email, {"role": role})
+        else:
+            found = await delete_user(database.db, email)
+    finally:
+        await close_mongo_connection()
+    print(f"{command}: {email}" if found else f"No user {email}")
+    return 0 if found else 1
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Revoke, change the role of, or delete a user")
+    parser.add_argument("command", choices=["revoke", "set-role", "delete"])
+    parser.add_argument("email")
+    parser.add_argument("--role", help="new role for set-role")
+    args = parser.parse_args()
+    if args.command == "set-role" and not args.role:
+        parser.error("set-role needs --role")
+    sys.exit(asyncio.run(main(args.command, args.email, args.role)))
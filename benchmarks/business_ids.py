@@ -0,0 +1,129 @@
+"""
+Business ID generators: the old 8 hex characters of a UUID4 against the time ordered
+IDs of utils.generate_unique_id.
+
+For each generator it reports the cost per ID, duplicates among `--n` IDs, how many
+inserts land at the right edge of the index (key above every earlier key), insert
+throughput with `--concurrency` concurrent creates into a collection with a unique index
+on the ID, and the size of that index afterwards (a B-tree filled at random splits pages
+half empty).
+
+    python -m benchmarks.business_ids --n 100000 --concurrency 32
+    python -m benchmarks.business_ids --in-memory    # mongomock-motor, no index sizes
+
+Runs against MONGODB_URL in a throwaway `clinic_benchmark` database.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+
+from config import settings
+from utils import generate_unique_id
+
+BENCHMARK_DB = "clinic_benchmark"
+COLLECTION = "business_ids"
+
+
+def legacy_id(prefix: str) -> str:
+    """generate_unique_id before time ordered IDs"""
+    return f"{prefix}_{str(uuid.uuid4())[:8]}"
+
+
+GENERATORS = {"uuid4[:8]": legacy_id, "time ordered": generate_unique_id}
+
+
+def _collision_odds(bits: int, n: int) -> float:
+    """Birthday approximation: chance of at least one duplicate among n random IDs"""
+    return min(1.0, n * (n - 1) / 2 / 2 ** bits)
+
+
+def generation(generate, n: int) -> dict:
+    started = time.perf_counter()
+    ids = [generate("PAT") for _ in range(n)]
+    elapsed = time.perf_counter() - started
+    highest, right_edge = "", 0
+    for business_id in ids:
+        if business_id > highest:
+            highest, right_edge = business_id, right_edge + 1
+    return {
+        "ids": ids,
+        "us_per_id": elapsed / n * 1e6,
+        "duplicates": n - len(set(ids)),
+        "right_edge_inserts": right_edge / n,
+    }
+
+
+async def inserts(db, ids: list, concurrency: int, collect_stats: bool) -> dict:
+    collection = db[COLLECTION]
+    await collection.drop()
+    await collection.create_index("patient_id", name="patient_id_unique", unique=True)
+    queue = iter(ids)
+    duplicates = 0
+
+    async def worker():
+        nonlocal duplicates
+        for business_id in queue:
+            try:
+                await collection.insert_one({"patient_id": business_id, "full_name": "Benchmark Patient"})
+            except DuplicateKeyError:
+                duplicates += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    result = {"inserts_per_s": len(ids) / elapsed, "duplicate_key_errors": duplicates, "index_bytes": None}
+    if collect_stats:
+        stats = await db.command("collStats", COLLECTION)
+        result["index_bytes"] = stats["indexSizes"].get("patient_id_unique")
+    return result
+
+
+async def run(n: int, concurrency: int, in_memory: bool) -> dict:
+    if in_memory:
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient()
+    else:
+        client = AsyncIOMotorClient(settings.MONGODB_URL)
+    db = client[BENCHMARK_DB]
+    results = {}
+    try:
+        for name, generate in GENERATORS.items():
+            generated = generation(generate, n)
+            ids = generated.pop("ids")
+            results[name] = {**generated, **await inserts(db, ids, concurrency, not in_memory)}
+    finally:
+        await db[COLLECTION].drop()
+        client.close()
+    results["uuid4[:8]"]["collision_odds"] = {f"{size:,}": _collision_odds(32, size) for size in (n, 10 ** 6)}
+    results["time ordered"]["collision_odds"] = {f"{size:,}": 0.0 for size in (n, 10 ** 6)}  # ordered within a process
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000, help="IDs generated and inserted per generator")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent inserts")
+    parser.add_argument("--in-memory", action="store_true", help="use mongomock-motor instead of MONGODB_URL")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.n, args.concurrency, args.in_memory))
+    for name, summary in results.items():
+        index = f"{summary['index_bytes'] / 1024:.0f}KiB" if summary["index_bytes"] else "n/a"
+        odds = ", ".join(f"{size}: {p:.1%}" for size, p in summary["collision_odds"].items())
+        print(f"{name:<13} {summary['us_per_id']:.2f}us/id duplicates={summary['duplicates']} "
+              f"right-edge={summary['right_edge_inserts']:.1%} inserts/s={summary['inserts_per_s']:.0f} "
+              f"dup-key errors={summary['duplicate_key_errors']} index={index} collision odds ({odds})")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
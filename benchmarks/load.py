@@ -0,0 +1,247 @@
+"""
+Load test every router through the ASGI app with concurrent clients.
+
+Seeds (or reuses) a synthetic clinic, then runs each scenario with --concurrency
+clients sharing --requests requests and reports p50/p95/p99 latency, throughput and
+memory. Results are written as JSON; pass an earlier file to --compare to see the change.
+
+    python -m benchmarks.load --size 10k --concurrency 32 --requests 500 --json before.json
+    python -m benchmarks.load --size 10k --reuse --json after.json --compare before.json
+    python -m benchmarks.load --in-memory --size 1k     # mongomock-motor stand-in, no mongod
+
+The in-memory stand-in is for smoke-testing the suite itself: mongomock runs every
+query in Python and lacks some aggregation stages (the dashboard shows up as errors),
+so its numbers say nothing about production. Measure against a mongod.
+"""
+import argparse
+import asyncio
+import json
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from benchmarks.seed import BENCHMARK_DB, SIZES, counts, seed
+from config import settings
+
+BENCHMARK_USER = {"user_name": "benchmark", "email": "benchmark@example.com", "phone": "9800000000", "password": "benchmark-password"}
+
+
+def _rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def scenarios(sizes: dict, rng: random.Random) -> dict:
+    """name -> (method, path factory, json body factory or None, concurrency cap)"""
+    def pid():
+        return f"PAT_{rng.randrange(sizes['patients']):08x}"
+
+    def sid():
+        return f"STF_{rng.randrange(sizes['staff']):08x}"
+
+    def aid():
+        return f"APT_{rng.randrange(sizes['appointments']):08x}"
+
+    today = datetime.now(timezone.utc).date()
+    patient = {"full_name": "Load Test", "date_of_birth": "1990-01-01", "gender": "F", "contact_number": "9811111111",
+               "address": "Kathmandu", "emergency_contact": "9800000000"}
+    return {
+        "health": ("GET", lambda: "/health", None, None),
+        "auth.login": ("POST", lambda: "/api/auth/login", lambda: {"email": BENCHMARK_USER["email"], "password": BENCHMARK_USER["password"]}, 4),
+        "dashboard": ("GET", lambda: "/api/dashboard/", None, None),
+        "patients.get": ("GET", lambda: f"/api/patients/{pid()}", None, None),
+        "patients.list": ("GET", lambda: "/api/patients/?limit=50", None, None),
+        "patients.timeline": ("GET", lambda: f"/api/patients/{pid()}/timeline?limit=50", None, None),
+        "patients.search": ("GET", lambda: f"/api/patients/search?q={rng.choice(['ra', 'sita', 'sharma', 'gur', '4567'])}", None, None),
+        "patients.create": ("POST", lambda: "/api/patients/", lambda: patient, None),
+        "patients.update": ("PUT", lambda: f"/api/patients/{pid()}", lambda: {"address": f"Ward {rng.randrange(32)}"}, None),
+        "staff.get": ("GET", lambda: f"/api/staff/{sid()}", None, None),
+        "staff.list": ("GET", lambda: "/api/staff/?limit=50", None, None),
+        "appointments.get": ("GET", lambda: f"/api/appointments/{aid()}", None, None),
+        "appointments.list": ("GET", lambda: "/api/appointments/?limit=50", None, None),
+        "appointments.availability": ("GET", lambda: f"/api/appointments/availability?doctor_id={sid()}&from={today}&to={today}", None, None),
+        "medical_records.list": ("GET", lambda: "/api/medical-records/?limit=50", None, None),
+        "billing.list": ("GET", lambda: "/api/billing/?limit=50", None, None),
+        "billing.reports": ("GET", lambda: f"/api/billing/reports?from={today - timedelta(days=365)}&to={today}&granularity=month", None, None),
+    }
+
+
+def _summary(timings: list, statuses: Counter, elapsed: float, rss_before: float) -> dict:
+    ms = sorted(t * 1000 for t in timings)
+    cuts = statistics.quantiles(ms, n=100) if len(ms) > 1 else ms * 99
+    return {
+        "requests": len(ms),
+        "errors": sum(n for status, n in statuses.items() if status >= 500 or status == 0),
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "throughput_rps": round(len(ms) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(cuts[49], 2),
+        "p95_ms": round(cuts[94], 2),
+        "p99_ms": round(cuts[98], 2),
+        "max_ms": round(ms[-1], 2),
+        "rss_mb": _rss_mb(),
+        "rss_growth_mb": round(_rss_mb() - rss_before, 1),
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario, total: int, concurrency: int, headers: dict) -> dict:
+    method, path, body, cap = scenario
+    workers = min(concurrency, cap or concurrency)
+    remaining = iter(range(total))
+    timings = []
+    statuses = Counter()
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path(), json=body() if body else None, headers=headers)
+                statuses[response.status_code] += 1
+            except Exception:
+                statuses[0] += 1
+            timings.append(time.perf_counter() - start)
+
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(workers)])
+    return _summary(timings, statuses, time.perf_counter() - started, rss_before)
+
+
+def _patch_mongomock_bulk():
+    """pymongo >= 4.11 passes `sort` to bulk builders, which mongomock does not accept yet"""
+    import mongomock.collection
+
+    def drop_sort(method):
+        def add(self, *args, **kwargs):
+            kwargs.pop("sort", None)
+            return method(self, *args, **kwargs)
+        return add
+
+    for name in ("add_update", "add_replace"):
+        method = getattr(mongomock.collection.BulkOperationBuilder, name)
+        setattr(mongomock.collection.BulkOperationBuilder, name, drop_sort(method))
+
+
+async def _database(in_memory: bool):
+    import database
+    if in_memory:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("--in-memory needs mongomock-motor (pip install mongomock-motor)")
+        _patch_mongomock_bulk()
+        client = AsyncMongoMockClient()
+    else:
+        client = database.create_client()
+    database.client = client
+    database.db = client[BENCHMARK_DB]
+    return database.db
+
+
+async def run(args) -> dict:
+    from main import app
+    import database
+    import cache
+
+    db = await _database(args.in_memory)
+    sizes = counts(SIZES[args.size])
+    seeded = None
+    if not args.reuse or args.in_memory:
+        seeded = await seed(db, SIZES[args.size])
+        print(f"seeded {', '.join(f'{k}={v}' for k, v in seeded.items())}", file=sys.stderr)
+    if args.no_cache:
+        cache.response_cache.backend = cache.NullBackend()
+
+    async def get_db():
+        return db
+    app.dependency_overrides[database.get_db] = get_db
+
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "backend": "mongomock" if args.in_memory else settings.MONGODB_URL.split("@")[-1],
+            "size": args.size,
+            "counts": sizes,
+            "seed": seeded,
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "response_cache": not args.no_cache,
+        },
+        "scenarios": {},
+    }
+    rng = random.Random(7)
+    selected = scenarios(sizes, rng)
+    if args.only:
+        selected = {name: s for name, s in selected.items() if any(name.startswith(o) for o in args.only)}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+        await db.users.delete_many({"email": BENCHMARK_USER["email"]})
+        await client.post("/api/auth/register", json=BENCHMARK_USER)
+        login = await client.post("/api/auth/login", json={"email": BENCHMARK_USER["email"], "password": BENCHMARK_USER["password"]})
+        headers = {"Authorization": f"Bearer {login.json()['data']['access_token']}"}
+
+        for name, scenario in selected.items():
+            total = args.requests if scenario[3] is None else max(args.requests // 10, scenario[3])
+            results["scenarios"][name] = summary = await run_scenario(client, scenario, total, args.concurrency, headers)
+            print(f"{name:<27} p50={summary['p50_ms']:>8.2f}ms p95={summary['p95_ms']:>8.2f}ms "
+                  f"p99={summary['p99_ms']:>8.2f}ms {summary['throughput_rps']:>8.1f} req/s "
+                  f"errors={summary['errors']} rss={summary['rss_mb']}MB", file=sys.stderr)
+
+    app.dependency_overrides.pop(database.get_db, None)
+    return results
+
+
+def compare(current: dict, previous: dict):
+    print(f"\n{'scenario':<27} {'p50':>18} {'p95':>18} {'req/s':>18}")
+    for name, now in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        cells = []
+        for key in ("p50_ms", "p95_ms", "throughput_rps"):
+            old, new = before[key], now[key]
+            change = f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+            cells.append(f"{old:>7} -> {new:<7} {change:>5}")
+        print(f"{name:<27} " + " ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", choices=SIZES, default="10k", help="synthetic clinic size (patients)")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients per scenario")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--only", nargs="*", help="run scenarios whose name starts with these prefixes")
+    parser.add_argument("--reuse", action="store_true", help="keep the data seeded by a previous run")
+    parser.add_argument("--in-memory", action="store_true", help="use mongomock-motor instead of MONGODB_URL")
+    parser.add_argument("--no-cache", action="store_true", help="disable the response cache")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
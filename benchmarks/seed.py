@@ -0,0 +1,168 @@
+"""
+Seed a synthetic clinic for benchmarking.
+
+Documents are built through the same repositories the routers use, so they carry the
+derived search fields and typed dates, then written with insert_many in batches.
+Counters, doctor schedules and billing rollups are rebuilt at the end.
+
+    python -m benchmarks.seed --size 100k     # into MONGODB_URL / clinic_benchmark
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from config import settings
+from database import create_client, ensure_indexes
+from dates import combine
+import billing_reports
+import scheduling
+import stats
+
+BENCHMARK_DB = "clinic_benchmark"
+
+# patients per preset; every other collection is sized from it
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+FIRST_NAMES = ["Ram", "Sita", "Hari", "Gita", "Bikash", "Anita", "Suman", "Priya", "Rajesh", "Kamala",
+               "Dipak", "Sarita", "Nabin", "Manisha", "Prakash", "Sunita", "José", "Maria", "Arjun", "Laxmi"]
+LAST_NAMES = ["Sharma", "Thapa", "Rai", "Gurung", "Shrestha", "Karki", "Adhikari", "Tamang", "Magar",
+              "Bhandari", "Poudel", "Khadka", "Basnet", "Lama", "Ramírez", "Joshi"]
+STATUSES = ["Scheduled", "Scheduled", "Confirmed", "Completed", "Completed", "Cancelled", "No-Show"]
+
+
+def counts(patients: int) -> dict:
+    return {
+        "patients": patients,
+        "staff": max(patients // 100, 10),
+        "appointments": patients * 2,
+        "medical_records": patients,
+        "billing": patients,
+    }
+
+
+def _repositories():
+    # imported here so `--help` does not pay for the routers
+    from routers.appointments import appointments_repository
+    from routers.billing import billing_repository
+    from routers.medical_records import medical_records_repository
+    from routers.patients import patients_repository
+    from routers.staff import staff_repository
+    return {
+        "patients": patients_repository,
+        "staff": staff_repository,
+        "appointments": appointments_repository,
+        "medical_records": medical_records_repository,
+        "billing": billing_repository,
+    }
+
+
+def _name(rng: random.Random) -> str:
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _day(rng: random.Random, days_back: int = 365) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=rng.randrange(days_back))
+
+
+async def _insert(db, repository, docs):
+    await repository.collection(db).insert_many(docs, ordered=False)
+
+
+async def seed(db, patients: int, batch_size: int = 5000, seed_value: int = 42) -> dict:
+    """Fill `db` with a clinic of `patients` patients, returns the document counts"""
+    rng = random.Random(seed_value)
+    repositories = _repositories()
+    sizes = counts(patients)
+    started = time.perf_counter()
+
+    for name in sizes:
+        await db[name].drop()
+    for name in (stats.STATS_COLLECTION, scheduling.SCHEDULES_COLLECTION, billing_reports.ROLLUPS_COLLECTION):
+        await db[name].drop()
+    await ensure_indexes(db)
+
+    staff_ids = [f"STF_{i:08x}" for i in range(sizes["staff"])]
+    doctors = staff_ids[: max(len(staff_ids) // 2, 1)]
+    patient_ids = [f"PAT_{i:08x}" for i in range(patients)]
+    appointment_ids = [f"APT_{i:08x}" for i in range(sizes["appointments"])]
+
+    def staff(i):
+        return repositories["staff"].build({
+            "full_name": _name(rng), "role": "Doctor" if staff_ids[i] in doctors else "Nurse",
+            "specialization": None, "contact_number": f"98{i:08d}", "email": None,
+            "hire_date": _day(rng, 3650),
+        }, business_id=staff_ids[i])
+
+    def patient(i):
+        name = _name(rng)
+        return repositories["patients"].build({
+            "full_name": name, "date_of_birth": f"{rng.randrange(1940, 2020)}-01-01",
+            "gender": rng.choice("MF"), "contact_number": f"98{rng.randrange(10**8):08d}",
+            "email": f"{name.split()[0].lower()}.{i}@example.com", "address": "Kathmandu",
+            "emergency_contact": "9800000000", "created_at": _day(rng),
+        }, business_id=patient_ids[i])
+
+    slots_per_day = 8 * 60 // settings.APPOINTMENT_DEFAULT_DURATION_MINUTES
+
+    def appointment(i):
+        # doctor, day and slot are derived from i so no two appointments overlap
+        doctor = doctors[i % len(doctors)]
+        slot = (i // len(doctors)) % slots_per_day
+        day = datetime.now(timezone.utc).date() - timedelta(days=(i // len(doctors)) // slots_per_day - 30)
+        minutes = 9 * 60 + slot * settings.APPOINTMENT_DEFAULT_DURATION_MINUTES
+        start = combine(day, f"{minutes // 60:02d}:{minutes % 60:02d}")
+        return repositories["appointments"].build({
+            "patient_id": rng.choice(patient_ids), "doctor_id": doctor,
+            "appointment_date": start, "appointment_time": f"{minutes // 60:02d}:{minutes % 60:02d}",
+            "duration_minutes": None, "status": rng.choice(STATUSES), "reason_for_visit": "Checkup",
+            "room_number": None, "notes": None,
+        }, business_id=appointment_ids[i])
+
+    def medical_record(i):
+        return repositories["medical_records"].build({
+            "patient_id": rng.choice(patient_ids), "doctor_id": rng.choice(doctors),
+            "visit_date": _day(rng), "diagnosis": "Common cold", "treatment": "Rest",
+            "lab_results": None, "follow_up_required": False,
+        })
+
+    def bill(i):
+        total = float(rng.randrange(500, 5000))
+        status = rng.choice(["Paid", "Paid", "Pending", "Partial"])
+        return repositories["billing"].build({
+            "patient_id": rng.choice(patient_ids), "appointment_id": rng.choice(appointment_ids),
+            "total_amount": total, "paid_amount": total if status == "Paid" else 0.0,
+            "payment_method": rng.choice(["Cash", "Card", "Online"]), "payment_status": status,
+            "billing_date": _day(rng),
+        })
+
+    builders = {"staff": staff, "patients": patient, "appointments": appointment,
+                "medical_records": medical_record, "billing": bill}
+    for name, build in builders.items():
+        for start in range(0, sizes[name], batch_size):
+            docs = [build(i) for i in range(start, min(start + batch_size, sizes[name]))]
+            await _insert(db, repositories[name], docs)
+            if name == "appointments":
+                await scheduling.write_slots(db, docs)
+
+    await stats.reconcile(db, apply=True)
+    await billing_reports.reconcile(db, apply=True)
+    return {**sizes, "seconds": round(time.perf_counter() - started, 1)}
+
+
+async def main(size: str, batch_size: int):
+    client = create_client()
+    try:
+        result = await seed(client[BENCHMARK_DB], SIZES[size], batch_size)
+    finally:
+        client.close()
+    print(", ".join(f"{name}={value}" for name, value in result.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", choices=SIZES, default="10k", help="number of patients")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.size, args.batch_size))
@@ -0,0 +1,109 @@
+"""
+Response serialization cost for a page of documents: the StandardResponse path
+(response_model validation, jsonable_encoder, json.dumps) against standard_response
+(one orjson pass over the trusted documents). No database needed.
+
+    python -m benchmarks.serialization --docs 1000 --rounds 50
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from database import serialize_document
+from responses import standard_response
+from schemas import StandardResponse
+
+
+def _documents(n: int) -> list:
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "_id": ObjectId(),
+            "patient_id": f"PAT_{i:08x}",
+            "full_name": f"Benchmark Patient {i}",
+            "date_of_birth": "1990-01-01",
+            "gender": "F",
+            "contact_number": f"98{i:08d}",
+            "email": f"patient{i}@example.com",
+            "address": "Kathmandu",
+            "emergency_contact": "9800000000",
+            "created_at": now,
+        }
+        for i in range(n)
+    ]
+
+
+def build_app(n: int) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/standard", response_model=StandardResponse)
+    async def standard():
+        docs = [serialize_document(doc) for doc in _documents(n)]
+        return StandardResponse(success=True, message="ok", data={"patients": docs})
+
+    @app.get("/fast", response_model=StandardResponse)
+    async def fast():
+        docs = [serialize_document(doc) for doc in _documents(n)]
+        return standard_response("ok", {"patients": docs})
+
+    @app.get("/baseline")
+    async def baseline():
+        # building the documents alone, subtracted from both paths
+        [serialize_document(doc) for doc in _documents(n)]
+        return None
+
+    return app
+
+
+def _time(client: TestClient, path: str, rounds: int) -> list:
+    client.get(path)  # warm up
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        response = client.get(path)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    return timings
+
+
+def run(docs: int, rounds: int) -> dict:
+    client = TestClient(build_app(docs))
+    baseline = statistics.median(_time(client, "/baseline", rounds))
+    results = {}
+    for name in ("standard", "fast"):
+        timings = _time(client, f"/{name}", rounds)
+        median = statistics.median(timings)
+        results[name] = {
+            "median_ms": median * 1000,
+            "serialization_ms": max(median - baseline, 0) * 1000,
+            "bytes": len(client.get(f"/{name}").content),
+        }
+    results["speedup"] = results["standard"]["serialization_ms"] / max(results["fast"]["serialization_ms"], 1e-9)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=1000, help="documents per response")
+    parser.add_argument("--rounds", type=int, default=50, help="requests per path")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.docs, args.rounds)
+    for name in ("standard", "fast"):
+        r = results[name]
+        print(f"{name:<9} median={r['median_ms']:.2f}ms serialization={r['serialization_ms']:.2f}ms bytes={r['bytes']}")
+    print(f"speedup   {results['speedup']:.1f}x")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
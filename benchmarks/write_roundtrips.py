@@ -0,0 +1,128 @@
+"""
+Database round trips and latency per write: the old handlers
+(insert_one + find_one, update_one + find_one) against the Repository path.
+
+    python -m benchmarks.write_roundtrips --n 500
+
+Runs against MONGODB_URL in a throwaway `clinic_benchmark` database.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from collections import Counter
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from config import settings
+from models import Patient
+from repository import Repository
+from utils import generate_unique_id
+
+BENCHMARK_DB = "clinic_benchmark"
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = Counter()
+
+    def started(self, event):
+        self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _patient(i: int) -> dict:
+    return {
+        "full_name": f"Benchmark Patient {i}",
+        "date_of_birth": "1990-01-01",
+        "gender": "F",
+        "contact_number": f"98{i:08d}",
+        "address": "Kathmandu",
+        "emergency_contact": "9800000000",
+    }
+
+
+async def legacy_create(db, data: dict) -> dict:
+    new_patient = Patient(patient_id=generate_unique_id("PAT"), **data)
+    result = await db.patients.insert_one(new_patient.dict(by_alias=True))
+    return await db.patients.find_one({"_id": result.inserted_id})
+
+
+async def legacy_update(db, patient_id: str, data: dict) -> dict:
+    await db.patients.update_one({"patient_id": patient_id}, {"$set": data})
+    return await db.patients.find_one({"patient_id": patient_id})
+
+
+async def _timed(coro) -> float:
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+def _summary(timings: list, commands: int, n: int) -> dict:
+    return {
+        "round_trips_per_call": commands / n,
+        "mean_ms": statistics.mean(timings) * 1000,
+        "p95_ms": statistics.quantiles(timings, n=20)[-1] * 1000 if len(timings) > 1 else timings[0] * 1000,
+    }
+
+
+async def run(n: int) -> dict:
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(settings.MONGODB_URL, event_listeners=[counter])
+    db = client[BENCHMARK_DB]
+    await db.patients.drop()
+    await db.patients.create_index("patient_id", unique=True)
+    repository = Repository("patients", "patient_id", "PAT", Patient, "Patient not found")
+
+    results = {}
+    try:
+        for name, create, update in (
+            ("legacy", legacy_create, legacy_update),
+            ("repository", repository.create, repository.update),
+        ):
+            counter.commands.clear()
+            create_timings = [await _timed(create(db, _patient(i))) for i in range(n)]
+            create_commands = sum(counter.commands.values())
+
+            ids = [doc["patient_id"] async for doc in db.patients.find({}, {"patient_id": 1}).limit(n)]
+            counter.commands.clear()
+            update_timings = [await _timed(update(db, pid, {"address": "Lalitpur"})) for pid in ids]
+            update_commands = sum(counter.commands.values())
+
+            results[name] = {
+                "create": _summary(create_timings, create_commands, n),
+                "update": _summary(update_timings, update_commands, len(ids)),
+            }
+            await db.patients.delete_many({})
+    finally:
+        await db.patients.drop()
+        client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=500, help="writes per operation and path")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.n))
+    for path, operations in results.items():
+        for operation, summary in operations.items():
+            print(f"{path:<11} {operation:<7} round trips/call={summary['round_trips_per_call']:.1f} "
+                  f"mean={summary['mean_ms']:.2f}ms p95={summary['p95_ms']:.2f}ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
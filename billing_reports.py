@@ -0,0 +1,325 @@
+"""
+Billing rollups and revenue reports.
+
+`billing_rollups` holds one document per clinic day, keyed by the day, with the bills
+billed that day summed up:
+
+    {"_id": "2024-05-01", "bills": 12, "billed": 9400.0, "collected": 7100.0,
+     "outstanding": 2300.0, "outstanding_bills": 3,
+     "by_method": {"Cash": 4100.0, ...}, "by_doctor": {"STF_x": 2500.0, ...}, "by_status": {"Paid": 9, ...}}
+
+Billing writes keep it current through the `update_rollups` hook (same before/after
+deltas as stats.py), and moving an appointment to another doctor, or deleting it, moves
+its bills with `reattribute_bills`. Each bill records the doctor it is counted under in
+`rollup_doctor_id` (written with the bill by `attribute_bills`, never returned), so
+reversing a bill always subtracts from the bucket it was added to. A report over a year
+reads at most 366 small documents; weeks and months are summed from the days. Cancelled bills are counted but carry no amounts.
+
+    python billing_reports.py            # report drift between rollups and billing
+    python billing_reports.py --apply    # rebuild the rollups from scratch
+"""
+import argparse
+import asyncio
+import sys
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from pymongo import ReplaceOne, UpdateMany, UpdateOne
+
+from dates import local_date
+from stats import today
+
+ROLLUPS_COLLECTION = "billing_rollups"
+UNASSIGNED = "unassigned"
+ATTRIBUTION_FIELD = "rollup_doctor_id"  # stored on bills, the by_doctor bucket they are counted in
+GRANULARITIES = ("day", "week", "month")
+REPORT_MAX_DAYS = 3660
+RECONCILE_BATCH_SIZE = 1000  # bills per appointment lookup
+# (label, first day, last day) of age since billing, last bucket open-ended
+AGING_BUCKETS = [("0-30", 0, 30), ("31-60", 31, 60), ("61-90", 61, 90), ("90+", 91, None)]
+ROLLUP_FIELDS = {"billing_date": 1, "payment_status": 1, "payment_method": 1,
+                 "total_amount": 1, "paid_amount": 1, "appointment_id": 1, ATTRIBUTION_FIELD: 1}
+
+
+def _key(name) -> str:
+    # method/status/doctor values end up in field paths
+    return str(name).replace(".", "_").replace("$", "_")
+
+
+def _round(amount: float):
+    return int(amount) if float(amount).is_integer() else round(amount, 2)
+
+
+def contributions(doc: dict, doctor_id: Optional[str]) -> dict:
+    """{day: {counter: amount}} a single bill adds to the rollups"""
+    day = local_date(doc.get("billing_date"))
+    if day is None:
+        return {}
+    status = doc.get("payment_status") or "Pending"
+    counters = {"bills": 1, f"by_status.{_key(status)}": 1}
+    if status != "Cancelled":
+        billed = doc.get("total_amount") or 0.0
+        collected = doc.get("paid_amount") or 0.0
+        counters["billed"] = billed
+        counters["collected"] = collected
+        counters[f"by_method.{_key(doc.get('payment_method') or 'Unknown')}"] = collected
+        counters[f"by_doctor.{_key(doctor_id or UNASSIGNED)}"] = collected
+        balance = billed - collected
+        if balance > 0:
+            counters["outstanding"] = balance
+            counters["outstanding_bills"] = 1
+    return {day.isoformat(): counters}
+
+
+async def doctors_for(db, appointment_ids) -> Dict[str, str]:
+    """appointment_id -> doctor_id in one query"""
+    ids = list({i for i in appointment_ids if i})
+    if not ids:
+        return {}
+    cursor = db.appointments.find({"appointment_id": {"$in": ids}}, {"appointment_id": 1, "doctor_id": 1, "_id": 0})
+    return {doc["appointment_id"]: doc.get("doctor_id") async for doc in cursor}
+
+
+def _accumulate(deltas, doc: dict, doctor_id: Optional[str], sign: int):
+    for day, counters in contributions(doc, doctor_id).items():
+        for name, amount in counters.items():
+            deltas[day][name] += sign * amount
+
+
+async def _apply(db, deltas):
+    operations = []
+    for day, counters in deltas.items():
+        changed = {name: _round(amount) for name, amount in counters.items() if abs(amount) > 1e-9}
+        if changed:
+            operations.append(UpdateOne({"_id": day}, {"$inc": changed}, upsert=True))
+    if operations:
+        await db[ROLLUPS_COLLECTION].bulk_write(operations, ordered=False)
+
+
+async def attribute_bills(db, items: list):
+    """
+    Billing repository prepare step: new bills, and bills moved to another appointment,
+    get their doctor written in the same insert/update as the rest of the bill.
+    """
+    linked = [item for item in items if "appointment_id" in item]
+    doctors = await doctors_for(db, [item["appointment_id"] for item in linked])
+    for item in linked:
+        item[ATTRIBUTION_FIELD] = doctors.get(item["appointment_id"]) or UNASSIGNED
+
+
+async def update_rollups(db, collection: str, changes: list):
+    """
+    Billing repository write hook. Bills are counted under their stored doctor, bills
+    from before attribution (until reconcile --apply) under their appointment's doctor.
+    """
+    doctors = await doctors_for(db, [doc.get("appointment_id") for change in changes for doc in change
+                                     if doc is not None and ATTRIBUTION_FIELD not in doc])
+    deltas = defaultdict(lambda: defaultdict(float))
+    for before, after in changes:
+        for doc, sign in ((before, -1), (after, 1)):
+            if doc is not None:
+                doctor = doc.get(ATTRIBUTION_FIELD) or doctors.get(doc.get("appointment_id"))
+                _accumulate(deltas, doc, doctor, sign)
+    await _apply(db, deltas)
+
+
+async def reattribute_bills(db, collection: str, changes: list):
+    """
+    Appointments repository write hook: bills follow their appointment to a new doctor,
+    and go to `unassigned` when the appointment is deleted.
+    """
+    moved = {}
+    for before, after in changes:
+        if before is None:
+            continue
+        if after is None:
+            moved[before["appointment_id"]] = (before.get("doctor_id") or UNASSIGNED, UNASSIGNED)
+        elif before.get("doctor_id") != after.get("doctor_id"):
+            moved[after["appointment_id"]] = (before.get("doctor_id") or UNASSIGNED, after.get("doctor_id") or UNASSIGNED)
+    if not moved:
+        return
+    deltas = defaultdict(lambda: defaultdict(float))
+    async for bill in db.billing.find({"appointment_id": {"$in": list(moved)}}, ROLLUP_FIELDS):
+        old_doctor, new_doctor = moved[bill["appointment_id"]]
+        old_doctor = bill.get(ATTRIBUTION_FIELD) or old_doctor
+        if old_doctor != new_doctor:
+            _accumulate(deltas, bill, old_doctor, -1)
+            _accumulate(deltas, bill, new_doctor, 1)
+    await _apply(db, deltas)
+    await db.billing.bulk_write(
+        [UpdateMany({"appointment_id": appointment_id}, {"$set": {ATTRIBUTION_FIELD: new_doctor}})
+         for appointment_id, (_, new_doctor) in moved.items()],
+        ordered=False,
+    )
+
+
+def _period(day: date, granularity: str) -> str:
+    if granularity == "week":
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    if granularity == "month":
+        return day.strftime("%Y-%m")
+    return day.isoformat()
+
+
+def _sum_into(target: dict, source: dict):
+    for name, value in source.items():
+        target[name] = target.get(name, 0) + value
+
+
+async def build_report(db, date_from: date, date_to: date, granularity: str = "day") -> dict:
+    periods = {}
+    totals = {"bills": 0, "billed": 0, "collected": 0, "outstanding": 0}
+    by_method, by_doctor, by_status = {}, {}, {}
+
+    query = {"_id": {"$gte": date_from.isoformat(), "$lte": date_to.isoformat()}}
+    async for doc in db[ROLLUPS_COLLECTION].find(query).sort("_id", 1):
+        period = periods.setdefault(_period(date.fromisoformat(doc["_id"]), granularity),
+                                    {"bills": 0, "billed": 0, "collected": 0, "outstanding": 0})
+        for name in totals:
+            period[name] += doc.get(name, 0)
+            totals[name] += doc.get(name, 0)
+        _sum_into(by_method, doc.get("by_method", {}))
+        _sum_into(by_doctor, doc.get("by_doctor", {}))
+        _sum_into(by_status, doc.get("by_status", {}))
+
+    names = {}
+    doctor_ids = [d for d in by_doctor if d != UNASSIGNED]
+    if doctor_ids:
+        cursor = db.staff.find({"staff_id": {"$in": doctor_ids}}, {"staff_id": 1, "full_name": 1, "_id": 0})
+        names = {doc["staff_id"]: doc.get("full_name") async for doc in cursor}
+
+    return {
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "granularity": granularity,
+        "totals": {name: _round(value) for name, value in totals.items()},
+        "revenue": [{"period": period, **{name: _round(v) for name, v in values.items()}}
+                    for period, values in periods.items()],
+        # bills moved elsewhere leave zero counters behind
+        "by_payment_method": {method: _round(v) for method, v in sorted(by_method.items(), key=lambda i: -i[1]) if v},
+        "by_doctor": [{"doctor_id": doctor, "doctor_name": names.get(doctor), "collected": _round(v)}
+                      for doctor, v in sorted(by_doctor.items(), key=lambda i: -i[1]) if v],
+        "by_status": {status: n for status, n in by_status.items() if n},
+        "outstanding": await outstanding(db),
+    }
+
+
+async def outstanding(db, as_of: Optional[date] = None) -> dict:
+    """Unpaid balances of all time, by days since billing"""
+    as_of = as_of or today()
+    buckets = {label: {"bills": 0, "amount": 0} for label, _, _ in AGING_BUCKETS}
+    async for doc in db[ROLLUPS_COLLECTION].find({"outstanding": {"$gt": 0.005}}, {"outstanding": 1, "outstanding_bills": 1}):
+        age = (as_of - date.fromisoformat(doc["_id"])).days
+        for label, first, last in AGING_BUCKETS:
+            if age >= first and (last is None or age <= last):
+                buckets[label]["bills"] += doc.get("outstanding_bills", 0)
+                buckets[label]["amount"] += doc["outstanding"]
+                break
+    return {
+        "total": _round(sum(b["amount"] for b in buckets.values())),
+        "bills": sum(b["bills"] for b in buckets.values()),
+        "aging": {label: {"bills": b["bills"], "amount": _round(b["amount"])} for label, b in buckets.items()},
+    }
+
+
+def _flatten(doc: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in doc.items():
+        if key == "_id":
+            continue
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+async def reconcile(db, apply: bool = False) -> dict:
+    """
+    Recompute the rollups from billing, crediting each bill to its appointment's current
+    doctor. Returns {day: {counter: (stored, expected)}} for every counter that drifted;
+    apply=True rewrites the collection and the bills' rollup_doctor_id.
+    """
+    expected = defaultdict(lambda: defaultdict(float))
+
+    async def add(bills):
+        doctors = await doctors_for(db, [doc.get("appointment_id") for doc in bills])
+        attributions = []
+        for doc in bills:
+            doctor = doctors.get(doc.get("appointment_id")) or UNASSIGNED
+            _accumulate(expected, doc, doctor, 1)
+            if doc.get(ATTRIBUTION_FIELD) != doctor:
+                attributions.append(UpdateOne({"_id": doc["_id"]}, {"$set": {ATTRIBUTION_FIELD: doctor}}))
+        if apply and attributions:
+            await db.billing.bulk_write(attributions, ordered=False)
+
+    batch = []
+    async for doc in db.billing.find({}, ROLLUP_FIELDS):
+        batch.append(doc)
+        if len(batch) == RECONCILE_BATCH_SIZE:
+            await add(batch)
+            batch = []
+    await add(batch)
+    stored = {doc["_id"]: _flatten(doc) async for doc in db[ROLLUPS_COLLECTION].find()}
+
+    drift = {}
+    for day in set(expected) | set(stored):
+        want, have = expected.get(day, {}), stored.get(day, {})
+        changed = {name: (have.get(name, 0), _round(want.get(name, 0)))
+                   for name in set(want) | set(have) if abs(have.get(name, 0) - want.get(name, 0)) > 0.005}
+        if changed:
+            drift[day] = changed
+
+    if apply:
+        operations = []
+        for day, counters in expected.items():
+            doc = {}
+            for path, amount in counters.items():
+                if abs(amount) > 1e-9:
+                    group, _, leaf = path.rpartition(".")
+                    (doc.setdefault(group, {}) if group else doc)[leaf] = _round(amount)
+            operations.append(ReplaceOne({"_id": day}, doc, upsert=True))
+        if operations:
+            await db[ROLLUPS_COLLECTION].bulk_write(operations, ordered=False)
+        stale = [day for day in stored if day not in expected]
+        if stale:
+            await db[ROLLUPS_COLLECTION].delete_many({"_id": {"$in": stale}})
+    return drift
+
+
+def report_range(date_from: Optional[date], date_to: Optional[date]):
+    """Defaults to the last 30 days"""
+    date_to = date_to or today()
+    date_from = date_from or date_to - timedelta(days=30)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if (date_to - date_from).days > REPORT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {REPORT_MAX_DAYS} days per report")
+    return date_from, date_to
+
+
+async def main(apply: bool) -> int:
+    import database
+    from database import connect_to_mongo, close_mongo_connection
+
+    await connect_to_mongo()
+    try:
+        drift = await reconcile(database.db, apply=apply)
+    finally:
+        await close_mongo_connection()
+
+    for day in sorted(drift):
+        for name, (have, want) in sorted(drift[day].items()):
+            print(f"{day:<12} {name:<40} stored={have} expected={want}")
+    print(f"\n{len(drift)} rollup days drifted" + (", rebuilt" if apply and drift else ""))
+    return 1 if drift and not apply else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="rewrite the rollups with the recomputed values")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.apply)))
@@ -0,0 +1,208 @@
+"""
+Response cache for hot read endpoints.
+
+Rendered responses are cached per resource ("patients:PAT_x", "dashboard:2024-05-01")
+together with an ETag, so a client sending If-None-Match gets a 304 without the
+response being rebuilt. Entries are dropped by the repository write hook returned from
+`invalidation_hook`, which runs for single writes and bulk writes alike.
+
+Backends: "memory" (per-process LRU + TTL), "redis" (shared, needs the `redis`
+package) or "none". Pick one with CACHE_BACKEND.
+
+Every invalidation bumps a generation counter kept by the backend (in redis for the
+redis backend, so it is shared by all workers). A response rendered while a write was in
+flight may already be stale: it is served but only stored if the generation has not
+moved since the render started.
+"""
+import hashlib
+from typing import Awaitable, Callable, Optional
+
+from fastapi import Request, Response
+
+import stats
+from config import settings
+from utils import TTLCache
+
+
+class MemoryBackend:
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generation = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._cache.get(key)
+
+    async def generation(self) -> int:
+        return self._generation
+
+    async def set(self, key: str, value: bytes, generation: int):
+        if generation == self._generation:
+            self._cache.set(key, value)
+
+    async def invalidate(self, *keys: str):
+        self._generation += 1
+        for key in keys:
+            self._cache.pop(key)
+
+    async def clear(self):
+        self._cache.clear()
+
+    def size(self) -> Optional[int]:
+        return len(self._cache)
+
+
+# SET KEYS[1] only while the generation in KEYS[2] is still ARGV[2], atomically
+SET_IF_GENERATION = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[2] then
+    return redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+end
+return nil
+"""
+
+
+class RedisBackend:
+    """Any Redis-protocol server (Redis, Valkey, KeyDB, ...)"""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "clinic:cache:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis needs the redis package (pip install redis)")
+        self._redis = redis.from_url(url)
+        self._ttl = int(ttl)
+        self._prefix = prefix
+        # outside the prefix so clear() does not reset it
+        self._generation_key = prefix.rstrip(":") + "-generation"
+        self._set_if_generation = self._redis.register_script(SET_IF_GENERATION)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._redis.get(self._prefix + key)
+
+    async def generation(self) -> int:
+        return int(await self._redis.get(self._generation_key) or 0)
+
+    async def set(self, key: str, value: bytes, generation: int):
+        await self._set_if_generation(keys=[self._prefix + key, self._generation_key],
+                                      args=[value, generation, self._ttl])
+
+    async def invalidate(self, *keys: str):
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.incr(self._generation_key)
+            if keys:
+                pipe.delete(*[self._prefix + key for key in keys])
+            await pipe.execute()
+
+    async def clear(self):
+        async for key in self._redis.scan_iter(match=self._prefix + "*"):
+            await self._redis.delete(key)
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class NullBackend:
+    async def get(self, key: str) -> Optional[bytes]:
+        return None
+
+    async def generation(self) -> int:
+        return 0
+
+    async def set(self, key: str, value: bytes, generation: int):
+        pass
+
+    async def invalidate(self, *keys: str):
+        pass
+
+    async def clear(self):
+        pass
+
+    def size(self) -> Optional[int]:
+        return 0
+
+
+def create_backend():
+    if settings.CACHE_BACKEND == "redis":
+        return RedisBackend(settings.CACHE_REDIS_URL, settings.CACHE_TTL_SECONDS)
+    if settings.CACHE_BACKEND == "none":
+        return NullBackend()
+    return MemoryBackend(settings.CACHE_MAX_SIZE, settings.CACHE_TTL_SECONDS)
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    async def invalidate(self, *keys: str):
+        self.invalidations += len(keys)
+        await self.backend.invalidate(*keys)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": settings.CACHE_BACKEND,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "not_modified": self.not_modified,
+            "invalidations": self.invalidations,
+            "size": self.backend.size(),
+        }
+
+
+response_cache = ResponseCache(create_backend())
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def _respond(request: Request, body: bytes, etag: str, cache_status: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "X-Cache": cache_status}
+    if etag in request.headers.get("if-none-match", ""):
+        response_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def cached_response(request: Request, key: str, render: Callable[[], Awaitable[Response]]) -> Response:
+    """Serve `key` from the cache, or render it, store it and serve it"""
+    # stored as b"<etag>\n<json body>"
+    entry = await response_cache.backend.get(key)
+    if entry is not None:
+        response_cache.hits += 1
+        etag, body = entry.split(b"\n", 1)
+        return _respond(request, body, etag.decode(), "HIT")
+
+    response_cache.misses += 1
+    generation = await response_cache.backend.generation()
+    body = (await render()).body
+    etag = _etag(body)
+    await response_cache.backend.set(key, etag.encode() + b"\n" + body, generation)
+    return _respond(request, body, etag, "MISS")
+
+
+def resource_key(collection: str, business_id: str) -> str:
+    return f"{collection}:{business_id}"
+
+
+def dashboard_key() -> str:
+    return f"dashboard:{stats.today().isoformat()}"
+
+
+def invalidation_hook(id_field: str):
+    """
+    Repository write hook dropping the cached responses of every written document,
+    and the dashboard, which summarizes all of them.
+    """
+    async def invalidate(db, collection: str, changes: list):
+        keys = {
+            resource_key(collection, doc[id_field])
+            for change in changes for doc in change if doc and doc.get(id_field)
+        }
+        await response_cache.invalidate(*keys, dashboard_key())
+
+    return invalidate
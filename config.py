@@ -20,10 +20,86 @@ class Settings(BaseSettings):
     REFRESH_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 days
     ALGORITHM: str
 
+    # Password hashing: bcrypt runs in a worker pool so it never blocks the event loop.
+    # Hashes with a different number of rounds are upgraded on the next successful login.
+    PASSWORD_HASH_ROUNDS: int = 12
+    PASSWORD_HASH_EXECUTOR: str = "thread"  # thread or process
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_QUEUE: int = 64  # jobs waiting for a worker before returning 429
+
+    # Authenticated users are cached per process so a valid token needs no database lookup
+    USER_CACHE_TTL_SECONDS: int = 60
+    USER_CACHE_MAX_SIZE: int = 1024
+
+    # Response cache for hot reads (cache.py): memory, redis or none
+    CACHE_BACKEND: str = "memory"
+    CACHE_TTL_SECONDS: int = 30
+    CACHE_MAX_SIZE: int = 10000
+    CACHE_REDIS_URL: str = "redis://localhost:6379/0"
+
+    # Appointment booking: doctor schedules are tracked in slots of APPOINTMENT_SLOT_MINUTES
+    CLINIC_OPENING_TIME: str = "09:00"
+    CLINIC_CLOSING_TIME: str = "17:00"
+    APPOINTMENT_SLOT_MINUTES: int = 5
+    APPOINTMENT_DEFAULT_DURATION_MINUTES: int = 15
+
+    # Convert legacy string dates to BSON datetimes in the background at startup (migrate_dates.py)
+    DATE_MIGRATION_ON_STARTUP: bool = True
+    DATE_MIGRATION_BATCH_SIZE: int = 500
+
+    # Request metrics (metrics.py): requests slower than this are logged as warnings, and a request
+    # repeating one query shape N_PLUS_ONE_THRESHOLD times is flagged as an N+1
+    SLOW_REQUEST_MS: int = 500
+    N_PLUS_ONE_THRESHOLD: int = 10
+
+    # Query profiler (profiler.py), also switchable at runtime via PUT /api/admin/profiler.
+    # Commands slower than SLOW_QUERY_MS are logged whether or not it is on.
+    PROFILER_ENABLED: bool = False
+    SLOW_QUERY_MS: int = 100
+    PROFILER_MAX_SHAPES: int = 1000
+    PROFILER_EXPLAIN_INTERVAL_SECONDS: int = 300  # re-explain a shape at most this often
+    PROFILER_REPORT_PATH: str = "logs/query_profile.json"  # empty to skip writing the report
+
+    # List filters on fields no index leads with (query.py): warn, reject or allow
+    UNINDEXED_QUERIES: str = "warn"
+
+    # Background exports (exports.py): files are written under EXPORT_DIR in parts of EXPORT_PART_ROWS rows,
+    # and a job whose worker stops renewing its lease is resumed by another one
+    EXPORT_DIR: str = "exports"
+    EXPORT_BATCH_SIZE: int = 1000
+    EXPORT_PART_ROWS: int = 100000
+    EXPORT_MAX_CONCURRENT: int = 2
+    EXPORT_LEASE_SECONDS: int = 60
+
+    # CSV/NDJSON imports (imports.py): rows per insert_many, per-row errors kept in the report,
+    # and the longest row in characters (a CSV quote left open would otherwise buffer the rest of the file)
+    IMPORT_BATCH_SIZE: int = 1000
+    IMPORT_MAX_ERRORS: int = 1000
+    IMPORT_MAX_ROW_SIZE: int = 1048576
+
+    # Live change events (events.py): change_stream, in_process, auto (change streams when
+    # replicated) or none. Clients resume from the last EVENTS_BUFFER_SIZE events.
+    EVENTS_SOURCE: str = "auto"
+    EVENTS_BUFFER_SIZE: int = 1000
+    EVENTS_QUEUE_SIZE: int = 1000  # undelivered events per client before it is reset
+    EVENTS_KEEPALIVE_SECONDS: int = 15
+
+    # Maximum operations accepted by one POST /<resource>/bulk call
+    BULK_MAX_OPERATIONS: int = 10000
+
     # MongoDB settings
     MONGODB_URL: str 
     MONGODB_DB_NAME: str 
 
+    # MongoDB connection pool
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 10  # opened at startup so the first requests don't pay for them
+    MONGO_MAX_IDLE_TIME_MS: int = 300000
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: int = 2000  # fail fast instead of queueing forever for a connection
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 5000
+    MONGO_COMPRESSORS: str = ""  # e.g. "zstd,snappy,zlib"
+    MONGO_READ_PREFERENCE: str = "primary"
+
 
 
 settings = Settings()
\ No newline at end of file
@@ -1,43 +1,223 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
 from typing import Optional
+from datetime import datetime, timezone
+import asyncio
+import logging
 import os
 from dotenv import load_dotenv
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import ServerSelectionTimeoutError
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, monitoring
+from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
+from config import settings
+from dates import to_clinic
+from metrics import command_tracer
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 
-MONGODB_URL = "mongodb://localhost:27017/clinic_db"
 client = None
 db = None
+_connect_lock = asyncio.Lock()
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Keeps live connection pool counters for /health"""
+
+    def __init__(self):
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checked_in = 0
+        self.checkout_failed = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "open": self.created - self.closed,
+            "in_use": self.checked_out - self.checked_in,
+            "created": self.created,
+            "closed": self.closed,
+            "checkout_failed": self.checkout_failed,
+            "max_pool_size": settings.MONGO_MAX_POOL_SIZE,
+            "min_pool_size": settings.MONGO_MIN_POOL_SIZE,
+        }
+
+    def connection_created(self, event):
+        self.created += 1
+
+    def connection_closed(self, event):
+        self.closed += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_in += 1
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failed += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+pool_stats = PoolStatsListener()
+
+# Index registry: every query shape the routers issue must be backed by one of these.
+# Business IDs are unique so a duplicate generate_unique_id() can never be stored twice.
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "patients": [
+        IndexModel([("patient_id", ASCENDING)], name="patient_id_unique", unique=True),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+        # patient search, see search.py
+        IndexModel([("name_prefixes", ASCENDING)], name="name_prefixes"),
+        IndexModel([("phone_rev", ASCENDING)], name="phone_rev"),
+        IndexModel([("email_lc", ASCENDING)], name="email_lc"),
+        IndexModel([("full_name", TEXT), ("email", TEXT)], name="patient_text",
+                   weights={"full_name": 10, "email": 2}, default_language="none"),
+    ],
+    "staff": [
+        IndexModel([("staff_id", ASCENDING)], name="staff_id_unique", unique=True),
+        IndexModel([("hire_date", ASCENDING)], name="hire_date"),
+    ],
+    "appointments": [
+        IndexModel([("appointment_id", ASCENDING)], name="appointment_id_unique", unique=True),
+        IndexModel([("appointment_date", ASCENDING), ("status", ASCENDING)], name="appointment_date_status"),
+        IndexModel([("patient_id", ASCENDING), ("appointment_date", DESCENDING), ("appointment_id", DESCENDING)],
+                   name="patient_timeline"),
+        # list filter: a doctor's appointments over a range of days
+        IndexModel([("doctor_id", ASCENDING), ("appointment_date", ASCENDING)], name="doctor_id_appointment_date"),
+    ],
+    "medical_records": [
+        IndexModel([("record_id", ASCENDING)], name="record_id_unique", unique=True),
+        # also serves the dashboard's last visit lookup; supersedes patient_id_visit_date
+        IndexModel([("patient_id", ASCENDING), ("visit_date", DESCENDING), ("record_id", DESCENDING)],
+                   name="patient_timeline"),
+        IndexModel([("visit_date", ASCENDING)], name="visit_date"),
+    ],
+    "doctor_schedules": [
+        IndexModel([("doctor_id", ASCENDING), ("date", ASCENDING)], name="doctor_id_date"),
+    ],
+    "billing": [
+        IndexModel([("bill_id", ASCENDING)], name="bill_id_unique", unique=True),
+        IndexModel([("payment_status", ASCENDING), ("billing_date", ASCENDING)], name="payment_status_billing_date"),
+        IndexModel([("billing_date", ASCENDING)], name="billing_date"),
+        IndexModel([("appointment_id", ASCENDING)], name="appointment_id"),  # billing_reports.reattribute_bills
+        IndexModel([("patient_id", ASCENDING), ("billing_date", DESCENDING), ("bill_id", DESCENDING)],
+                   name="patient_timeline"),
+    ],
+    "exports": [
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),  # exports._claim
+    ],
+}
+
+
+def create_client(**kwargs) -> AsyncIOMotorClient:
+    options = {
+        "maxPoolSize": settings.MONGO_MAX_POOL_SIZE,
+        "minPoolSize": settings.MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": settings.MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "readPreference": settings.MONGO_READ_PREFERENCE,
+        # datetimes come back as aware UTC, see dates.py
+        "tz_aware": True,
+        "tzinfo": timezone.utc,
+        "event_listeners": [pool_stats, command_tracer],
+    }
+    if settings.MONGO_COMPRESSORS:
+        options["compressors"] = settings.MONGO_COMPRESSORS
+    options.update(kwargs)
+    return AsyncIOMotorClient(settings.MONGODB_URL, **options)
+
+
+async def warm_pool():
+    """Open min_pool_size connections up front with concurrent pings"""
+    await asyncio.gather(*[client.admin.command("ping") for _ in range(settings.MONGO_MIN_POOL_SIZE)])
+
 
 async def connect_to_mongo():
     global client, db
     try:
-        client = AsyncIOMotorClient(MONGODB_URL, serverSelectionTimeoutMS=5000)
+        client = create_client()
         await client.server_info()  # verify connection
 
-        database = client.get_default_database()
-        db = database if database is not None else client["clinic_db"]
+        db = client[settings.MONGODB_DB_NAME]
+        await warm_pool()
 
         # Create "users" collection only if it does not exist
         existing_collections = await db.list_collection_names()
         if "users" not in existing_collections:
             await db.create_collection("users")
 
-        print(f"Connected to MongoDB. Using database: {db.name}")
+        await ensure_indexes(db)
+
+        # First start against an existing database: build the dashboard counters and billing rollups once
+        import stats
+        if await db[stats.STATS_COLLECTION].find_one({"_id": stats.TOTAL}) is None:
+            await stats.reconcile(db, apply=True)
+        import billing_reports
+        if await db[billing_reports.ROLLUPS_COLLECTION].find_one() is None and await db.billing.find_one():
+            await billing_reports.reconcile(db, apply=True)
+
+        logger.info("Connected to MongoDB. Using database: %s", db.name)
 
     except ServerSelectionTimeoutError:
         raise ConnectionError("Unable to connect to MongoDB at provided URL.")
 
 
+async def ensure_indexes(database) -> dict:
+    """Create every index in INDEXES. Safe to run on each startup, existing indexes are left alone."""
+    created = {}
+    for collection_name, indexes in INDEXES.items():
+        try:
+            created[collection_name] = await database[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            # e.g. a unique index over data that already holds duplicates
+            logger.error("Could not create indexes on %s: %s", collection_name, e)
+            created[collection_name] = []
+    return created
+
+
 async def close_mongo_connection():
-    global client
+    global client, db
     if client:
         client.close()
+    client = None
+    db = None
+
+
+async def check_health() -> dict:
+    """Readiness: can we reach the primary/selected server right now, and how is the pool doing"""
+    status = {"database": "unavailable", "pool": pool_stats.snapshot()}
+    if client is None:
+        return status
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=2)
+        status["database"] = "ok"
+    except Exception as e:
+        status["error"] = str(e)
+    return status
 
 # Helpers
 def object_id_to_str(id: ObjectId) -> str:
@@ -49,13 +229,19 @@ def str_to_object_id(id: str) -> ObjectId:
 def serialize_document(doc) -> dict:
     doc["id"] = str(doc["_id"])
     del doc["_id"]
+    for key, value in doc.items():
+        if isinstance(value, datetime):
+            # stored in UTC, shown in clinic time
+            doc[key] = to_clinic(value)
     return doc
 
 
 # database.py
 async def get_db():
-    global db
+    # normally connected by the app lifespan, this is only the fallback for scripts and tests
     if db is None:
-        await connect_to_mongo()
+        async with _connect_lock:
+            if db is None:
+                await connect_to_mongo()
     return db
 
@@ -0,0 +1,88 @@
+"""
+Date/time policy.
+
+Dates are stored as BSON datetimes in UTC. Input without an offset (a plain
+"2024-05-01" or "2024-05-01T10:00") is clinic local time, and dates go back out
+in clinic time with their offset, e.g. "2024-05-01T10:00:00+05:45".
+"""
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Annotated, Optional
+from zoneinfo import ZoneInfo
+
+from pydantic import BeforeValidator
+
+# zoneinfo rather than pytz: converting and JSON-encoding aware datetimes is several times faster
+CLINIC_TIMEZONE = ZoneInfo('Asia/Kathmandu')
+
+
+def bson_precision(value: datetime) -> datetime:
+    """BSON datetimes hold milliseconds: truncate so a local copy equals what is read back"""
+    return value.replace(microsecond=value.microsecond - value.microsecond % 1000)
+
+
+def to_utc(value) -> Optional[datetime]:
+    """Parse an ISO string, date or datetime into an aware UTC datetime"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        if len(value) == 10:
+            value = date.fromisoformat(value)
+        else:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=CLINIC_TIMEZONE)
+        return bson_precision(value.astimezone(timezone.utc))
+    if isinstance(value, date):
+        return datetime.combine(value, time.min, tzinfo=CLINIC_TIMEZONE).astimezone(timezone.utc)
+    raise ValueError(f"Expected an ISO date or datetime, got {type(value).__name__}")
+
+
+def to_clinic(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        # pymongo hands back naive UTC unless the client is tz_aware
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(CLINIC_TIMEZONE)
+
+
+def local_date(value) -> Optional[date]:
+    """Clinic calendar day of a stored value, legacy strings included; None if unparseable"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return to_clinic(value).date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def day_bounds(day: date):
+    """[start, end) of a clinic day in UTC, for range queries"""
+    start = to_utc(day)
+    return start, to_utc(day + timedelta(days=1))
+
+
+def combine(day, time_text: str) -> datetime:
+    """The UTC instant of `time_text` (HH:MM) on the clinic day of `day`"""
+    hours, minutes = time_text.strip().split(":")[:2]
+    start = datetime.combine(local_date(to_utc(day)), time(int(hours), int(minutes)))
+    return to_utc(start)
+
+
+def clinic_time(value: datetime) -> str:
+    return to_clinic(value).strftime("%H:%M")
+
+
+def _parse(value):
+    try:
+        return to_utc(value)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid date, expected ISO format (YYYY-MM-DD or YYYY-MM-DDTHH:MM[:SS][+HH:MM])")
+
+
+# Field type for models and schemas: accepts ISO strings/dates/datetimes, holds UTC
+UTCDateTime = Annotated[datetime, BeforeValidator(_parse)]
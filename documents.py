@@ -0,0 +1,197 @@
+"""
+Medical record documents (scans, PDFs) live in GridFS, not inside the record.
+
+Uploads are streamed into the bucket chunk by chunk and the record only keeps a
+`document_ref` plus a little metadata. Downloads stream back out with HTTP Range support.
+
+    python documents.py    # move documents still stored inline on records into GridFS
+"""
+import asyncio
+import sys
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from bson import ObjectId
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+DOCUMENTS_BUCKET = "medical_documents"
+CHUNK_SIZE = 255 * 1024  # GridFS default chunk size
+READ_SIZE = 1024 * 1024
+
+
+def get_bucket(db) -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name=DOCUMENTS_BUCKET, chunk_size_bytes=CHUNK_SIZE)
+
+
+def _file_id(document_ref: str) -> ObjectId:
+    if not ObjectId.is_valid(document_ref):
+        raise HTTPException(status_code=404, detail="Document not found")
+    return ObjectId(document_ref)
+
+
+async def store_upload(db, upload: UploadFile, metadata: dict) -> dict:
+    """Stream an upload into GridFS, returns the fields to set on the record"""
+    content_type = upload.content_type or "application/octet-stream"
+    grid_in = get_bucket(db).open_upload_stream(
+        upload.filename or "document",
+        metadata={**metadata, "content_type": content_type},
+    )
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(READ_SIZE)
+            if not chunk:
+                break
+            await grid_in.write(chunk)
+            size += len(chunk)
+    except BaseException:
+        await grid_in.abort()
+        raise
+    await grid_in.close()
+
+    return {
+        "document_ref": str(grid_in._id),
+        "document_name": upload.filename,
+        "document_content_type": content_type,
+        "document_size": size,
+    }
+
+
+async def delete_document(db, document_ref: Optional[str]):
+    if not document_ref or not ObjectId.is_valid(document_ref):
+        return
+    try:
+        await get_bucket(db).delete(ObjectId(document_ref))
+    except NoFile:
+        pass
+
+
+async def drop_replaced_documents(db, collection: str, changes: list):
+    """Repository write hook: remove the GridFS file of every deleted record, or of one given a new file"""
+    for before, after in changes:
+        document_ref = before.get("document_ref") if before else None
+        if document_ref and (after is None or after.get("document_ref") != document_ref):
+            await delete_document(db, document_ref)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes=start-end` range into inclusive offsets, None means the whole file"""
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        # multipart ranges are not supported, send the whole file
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # suffix range: the last N bytes
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, min(end, size - 1)
+
+
+def content_disposition(filename: Optional[str]) -> str:
+    """inline disposition with an ASCII fallback name and the exact name per RFC 6266/5987"""
+    filename = filename or "document"
+    fallback = "".join(c if 32 <= ord(c) < 127 and c not in '"\\' else "_" for c in filename)
+    return f"inline; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+async def stream_document(db, document_ref: str, range_header: Optional[str]) -> StreamingResponse:
+    try:
+        grid_out = await get_bucket(db).open_download_stream(_file_id(document_ref))
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    size = grid_out.length
+    metadata = grid_out.metadata or {}
+    byte_range = parse_range(range_header, size)
+    start, end = byte_range if byte_range else (0, size - 1)
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(max(end - start + 1, 0)),
+        "Content-Disposition": content_disposition(grid_out.filename),
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    async def body():
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await grid_out.read(min(READ_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    return StreamingResponse(
+        body(),
+        status_code=206 if byte_range else 200,
+        media_type=metadata.get("content_type", "application/octet-stream"),
+        headers=headers,
+    )
+
+
+async def migrate_inline_documents(db, batch_size: int = 100) -> int:
+    """Move documents still stored inline on medical records into GridFS"""
+    bucket = get_bucket(db)
+    moved = 0
+    while True:
+        records = await db.medical_records.find(
+            {"document": {"$type": "binData"}}, {"record_id": 1, "document": 1}
+        ).limit(batch_size).to_list(length=batch_size)
+        if not records:
+            return moved
+        for record in records:
+            data = bytes(record["document"])
+            file_id = await bucket.upload_from_stream(
+                f"{record.get('record_id', record['_id'])}",
+                data,
+                metadata={"record_id": record.get("record_id"), "content_type": "application/octet-stream"},
+            )
+            await db.medical_records.update_one(
+                {"_id": record["_id"]},
+                {
+                    "$set": {
+                        "document_ref": str(file_id),
+                        "document_content_type": "application/octet-stream",
+                        "document_size": len(data),
+                    },
+                    "$unset": {"document": ""},
+                },
+            )
+            moved += 1
+
+
+async def main() -> int:
+    import database
+    from database import connect_to_mongo, close_mongo_connection
+
+    await connect_to_mongo()
+    try:
+        moved = await migrate_inline_documents(database.db)
+    finally:
+        await close_mongo_connection()
+    print(f"Moved {moved} inline documents into GridFS")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,315 @@
+"""
+Live change events for front-desk and doctor screens.
+
+Writes to appointments, billing and patients are published on an in-process bus and
+fanned out to every connected client (Server-Sent Events or WebSocket, routers/events.py)
+whose topics match, instead of screens re-polling the list endpoints.
+
+Where the events come from depends on the deployment (EVENTS_SOURCE):
+
+- change_stream: one MongoDB change stream per process watches the three collections,
+  so writes from any process or script show up. Needs a replica set or sharded cluster
+  (a single-node replica set is enough). Event ids are the change stream resume tokens.
+  Pre-images are switched on for the collections at startup (MongoDB 6.0+), so updates
+  and deletes are matched on the document before the change as well as after it.
+- in_process: the repository write hook `publish_changes` publishes the writes made by
+  this process. For a standalone mongod; with several workers each only sees its own.
+- auto (default) picks change_stream when the server is a replica set member or mongos.
+
+The last EVENTS_BUFFER_SIZE events are kept so a client reconnecting with the id of
+the last event it saw (Last-Event-ID, or ?after=) gets what it missed. A change stream
+token older than the buffer is resumed from the oplog. When nothing can be replayed,
+the client gets a `reset` event and should refetch.
+"""
+import asyncio
+import logging
+import uuid
+from collections import deque
+from typing import AsyncIterator, Iterable, List, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from billing_reports import ATTRIBUTION_FIELD
+from config import settings
+from database import serialize_document
+from dates import local_date
+from search import SEARCH_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+# collection -> (business id field, date field)
+EVENT_SOURCES = {
+    "appointments": ("appointment_id", "appointment_date"),
+    "billing": ("bill_id", "billing_date"),
+    "patients": ("patient_id", None),
+}
+# stored-only fields, left out of event documents; updates touching nothing else are not events
+HIDDEN_FIELDS = [*SEARCH_PROJECTION, ATTRIBUTION_FIELD]
+TOPIC_FIELDS = ("doctor_id", "patient_id", "date")
+OPERATIONS = {"insert": "insert", "update": "update", "replace": "update", "delete": "delete"}
+COMMAND_NOT_FOUND = 59
+CHANGE_STREAM_HISTORY_LOST = 286
+RETRY_SECONDS = 5
+
+
+class Event:
+    def __init__(self, event_id: str, collection: str, operation: str, key, document: Optional[dict], match: dict):
+        self.id = event_id
+        self.collection = collection
+        self.operation = operation
+        self.key = key
+        self.document = document
+        self.match = match  # topic field -> values the event can be filtered on
+
+    def payload(self) -> dict:
+        return {"id": self.id, "collection": self.collection, "operation": self.operation, "key": self.key,
+                "topics": {field: sorted(values) for field, values in self.match.items() if values},
+                "document": self.document}
+
+
+# put on a subscriber's queue when it has to start over (overflow, lost history, shutdown)
+RESET = Event("", "", "reset", None, None, {})
+
+
+def build_event(event_id: str, collection: str, operation: str, docs: Iterable[Optional[dict]], key=None) -> Event:
+    """`docs` are the versions of the document (before/after) the event can be matched on, newest last"""
+    id_field, date_field = EVENT_SOURCES[collection]
+    docs = [doc for doc in docs if doc]
+    match = {field: set() for field in TOPIC_FIELDS}
+    for doc in docs:
+        for field in ("doctor_id", "patient_id"):
+            if doc.get(field):
+                match[field].add(doc[field])
+        day = local_date(doc.get(date_field)) if date_field else None
+        if day:
+            match["date"].add(day.isoformat())
+    document = None
+    if operation != "delete" and docs:
+        document = serialize_document({k: v for k, v in docs[-1].items() if k not in HIDDEN_FIELDS})
+    return Event(event_id, collection, operation, docs[-1].get(id_field) if docs else key, document, match)
+
+
+class Topics:
+    """What one client listens to; a filtered client only gets events carrying the value it filters on"""
+
+    def __init__(self, collections: Optional[List[str]] = None, **filters):
+        self.collections = set(collections or EVENT_SOURCES)
+        self.filters = {field: value for field, value in filters.items() if value is not None}
+
+    def matches(self, event: Event) -> bool:
+        if event.collection not in self.collections:
+            return False
+        for field, wanted in self.filters.items():
+            if wanted not in event.match.get(field, ()):
+                return False
+        return True
+
+
+class _Subscriber:
+    def __init__(self, topics: Topics):
+        self.topics = topics
+        self.queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+
+    def push(self, event: Event) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            # a client this far behind refetches instead of holding the backlog in memory
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESET)
+            return False
+
+
+class EventBus:
+    def __init__(self):
+        self.mode: Optional[str] = None  # change_stream or in_process once started
+        self._buffer = deque(maxlen=settings.EVENTS_BUFFER_SIZE)
+        self._subscribers = set()
+        self._sequence = 0
+        self._boot = uuid.uuid4().hex[:8]  # in-process ids from an earlier run never match
+        self._db = None
+        self._task = None
+        self._pre_images = False
+
+    async def start(self, db):
+        self._db = db
+        source = settings.EVENTS_SOURCE
+        if source == "auto":
+            source = "change_stream" if await _is_replicated(db) else "in_process"
+        self.mode = None if source == "none" else source
+        if self.mode == "change_stream":
+            self._pre_images = await _enable_pre_images(db)
+            self._task = asyncio.create_task(self._watch())
+        logger.info("Event bus started", extra={"source": source})
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for subscriber in list(self._subscribers):
+            subscriber.push(RESET)
+        self.mode = None
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "subscribers": len(self._subscribers), "buffered": len(self._buffer)}
+
+    def next_id(self) -> str:
+        self._sequence += 1
+        return f"p:{self._boot}:{self._sequence}"
+
+    def publish(self, event: Event):
+        self._buffer.append(event)
+        for subscriber in list(self._subscribers):
+            if subscriber.topics.matches(event) and not subscriber.push(event):
+                self._subscribers.discard(subscriber)
+
+    def _reset_all(self):
+        self._buffer.clear()
+        for subscriber in list(self._subscribers):
+            subscriber.push(RESET)
+        self._subscribers.clear()
+
+    def _replay(self, after: str) -> Optional[List[Event]]:
+        events = list(self._buffer)
+        for index, event in enumerate(events):
+            if event.id == after:
+                return events[index + 1:]
+        return None
+
+    async def subscribe(self, topics: Topics, after: Optional[str] = None) -> AsyncIterator[Optional[Event]]:
+        """
+        Matching events as they happen, after the missed ones when `after` is given.
+        Yields None every EVENTS_KEEPALIVE_SECONDS without events, and ends after RESET.
+        """
+        subscriber = _Subscriber(topics)
+        # subscribe before replaying so nothing published in between is lost
+        self._subscribers.add(subscriber)
+        try:
+            replayed = set()
+            if after:
+                missed = self._replay(after)
+                if missed is None and self.mode == "change_stream" and after.startswith("c:"):
+                    missed = await self._catch_up(after)
+                if missed is None:
+                    yield RESET
+                    return
+                for event in missed:
+                    if topics.matches(event):
+                        replayed.add(event.id)
+                        yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=settings.EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is RESET:
+                    yield RESET
+                    return
+                if event.id not in replayed:
+                    yield event
+        finally:
+            self._subscribers.discard(subscriber)
+
+    # change streams
+
+    def _pipeline(self) -> list:
+        updated = {"$objectToArray": {"$ifNull": ["$updateDescription.updatedFields", {}]}}
+        visible = {"$filter": {"input": updated, "cond": {"$not": {"$in": ["$$this.k", HIDDEN_FIELDS]}}}}
+        hidden_only = {"$and": [
+            {"$eq": ["$operationType", "update"]},
+            {"$eq": [{"$size": visible}, 0]},
+            {"$eq": [{"$size": {"$ifNull": ["$updateDescription.removedFields", []]}}, 0]},
+        ]}
+        return [{"$match": {"ns.coll": {"$in": list(EVENT_SOURCES)}, "operationType": {"$in": list(OPERATIONS)},
+                            "$expr": {"$not": hidden_only}}}]
+
+    @staticmethod
+    def _from_change(change: dict) -> Event:
+        collection = change["ns"]["coll"]
+        key = change.get("documentKey", {}).get("_id")
+        # the pre-image lets an appointment moved away from a doctor, or a delete, reach that doctor's screens
+        return build_event("c:" + change["_id"]["_data"], collection, OPERATIONS[change["operationType"]],
+                           [change.get("fullDocumentBeforeChange"), change.get("fullDocument")],
+                           key=str(key) if key is not None else None)
+
+    def _stream(self, resume_after):
+        # servers before 6.0 reject the option altogether
+        before_change = {"full_document_before_change": "whenAvailable"} if self._pre_images else {}
+        return self._db.watch(self._pipeline(), full_document="updateLookup", resume_after=resume_after, **before_change)
+
+    async def _watch(self):
+        token = None
+        while True:
+            try:
+                async with self._stream(token) as stream:
+                    logger.info("Watching change streams")
+                    async for change in stream:
+                        token = change["_id"]
+                        self.publish(self._from_change(change))
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    # down longer than the oplog covers: start from now, clients refetch
+                    logger.warning("Change stream history lost, restarting")
+                    token = None
+                    self._reset_all()
+                    continue
+                logger.warning("Change stream failed, retrying: %s", e)
+                await asyncio.sleep(RETRY_SECONDS)
+            except PyMongoError as e:
+                logger.warning("Change stream failed, retrying: %s", e)
+                await asyncio.sleep(RETRY_SECONDS)
+
+    async def _catch_up(self, after: str) -> Optional[List[Event]]:
+        """Events after a resume token from the oplog, None if it is gone or too far behind"""
+        events = []
+        try:
+            async with self._stream({"_data": after[2:]}) as stream:
+                while len(events) <= settings.EVENTS_BUFFER_SIZE:
+                    change = await stream.try_next()
+                    if change is None:
+                        return events
+                    events.append(self._from_change(change))
+        except PyMongoError as e:
+            logger.info("Cannot resume events after %s: %s", after, e)
+        return None
+
+
+async def _enable_pre_images(db) -> bool:
+    """
+    Record pre-images for the watched collections, False when the server cannot.
+    Without them deletes reach no filtered client.
+    """
+    for collection in EVENT_SOURCES:
+        try:
+            await db.command("collMod", collection, changeStreamPreAndPostImages={"enabled": True})
+        except OperationFailure as e:
+            if e.code == COMMAND_NOT_FOUND or "changeStreamPreAndPostImages" in str(e):
+                logger.warning("Change stream pre-images unavailable (MongoDB 6.0+ needed): %s", e)
+                return False
+            logger.warning("Cannot enable change stream pre-images on %s: %s", collection, e)
+    return True
+
+
+async def _is_replicated(db) -> bool:
+    try:
+        hello = await db.command("hello")
+    except Exception:
+        return False
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+
+event_bus = EventBus()
+
+
+async def publish_changes(db, collection: str, changes: list):
+    """Repository write hook, publishes only when change streams are unavailable"""
+    if event_bus.mode != "in_process":
+        return
+    for before, after in changes:
+        operation = "insert" if before is None else "delete" if after is None else "update"
+        event_bus.publish(build_event(event_bus.next_id(), collection, operation, [before, after]))
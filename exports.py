@@ -0,0 +1,387 @@
+"""
+Background exports of whole collections to gzip CSV or Parquet files.
+
+A job is a document in `exports`. Workers claim queued jobs, or running ones whose
+lease has lapsed, and stream the collection in _id order in batches of
+EXPORT_BATCH_SIZE, so memory holds one batch whatever the collection size. Rows go
+into part files of EXPORT_PART_ROWS rows; after each part is closed the job records
+the part count and the last _id written. A worker that dies loses at most one
+part, and whoever picks the job up next resumes from that _id. Finished parts are
+joined into one file: gzip members concatenate as they are, Parquet row groups are
+copied over one at a time.
+
+Parquet needs pyarrow (`pip install pyarrow`).
+"""
+import asyncio
+import csv
+import gzip
+import logging
+import os
+import shutil
+import socket
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from config import settings
+from dates import to_clinic, to_utc
+from pagination import after_filter
+from utils import generate_unique_id, get_current_utc
+
+logger = logging.getLogger(__name__)
+
+EXPORTS_COLLECTION = "exports"
+FORMATS = {"csv": ".csv.gz", "parquet": ".parquet"}
+ACTIVE_STATUSES = ["queued", "running"]
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_wake = asyncio.Event()
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportLeaseLost(Exception):
+    """Another worker took the job over; its files are now theirs"""
+
+
+def export_sources() -> dict:
+    """collection -> QuerySpec of its list endpoint; exports accept the same filters"""
+    from routers.appointments import appointments_query
+    from routers.billing import billing_query
+    from routers.medical_records import medical_records_query
+    return {
+        "appointments": appointments_query,
+        "billing": billing_query,
+        "medical_records": medical_records_query,
+    }
+
+
+def columns_for(spec) -> List[tuple]:
+    """(name, type) per column: _id plus every model field"""
+    from query import _field_type
+    return [("_id", str)] + [(name, _field_type(spec.model, name)) for name in spec.model.model_fields if name != "id"]
+
+
+def export_path(job: dict) -> str:
+    return os.path.join(settings.EXPORT_DIR, job["_id"] + FORMATS[job["format"]])
+
+
+def _parts_dir(job: dict) -> str:
+    return os.path.join(settings.EXPORT_DIR, job["_id"] + ".parts")
+
+
+def _part_path(job: dict, index: int) -> str:
+    return os.path.join(_parts_dir(job), f"part-{index:05d}{FORMATS[job['format']]}")
+
+
+def pyarrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+async def create_export(db, collection: str, fmt: str, filters: list, requested_by: Optional[str]) -> dict:
+    job = {
+        "_id": generate_unique_id("EXP"),
+        "collection": collection,
+        "format": fmt,
+        "filters": [list(pair) for pair in filters],
+        "status": "queued",
+        "total": None,
+        "exported": 0,
+        "parts": 0,
+        "checkpoint_rows": 0,
+        "last_id": None,
+        "size_bytes": None,
+        "error": None,
+        "requested_by": requested_by,
+        "owner": None,
+        "lease_until": None,
+        "created_at": get_current_utc(),
+        "started_at": None,
+        "finished_at": None,
+    }
+    await db[EXPORTS_COLLECTION].insert_one(job)
+    _wake.set()
+    return job
+
+
+async def cancel_export(db, export_id: str) -> Optional[dict]:
+    """Cancel a queued or running job, or delete the file of a finished one; the worker cleans up its parts"""
+    job = await db[EXPORTS_COLLECTION].find_one_and_update(
+        {"_id": export_id, "status": {"$in": ACTIVE_STATUSES}},
+        {"$set": {"status": "cancelled", "finished_at": get_current_utc(), "lease_until": None}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if job is None:
+        job = await db[EXPORTS_COLLECTION].find_one({"_id": export_id})
+    if job:
+        await asyncio.to_thread(_remove_files, job)
+    return job
+
+
+def _remove_files(job: dict):
+    shutil.rmtree(_parts_dir(job), ignore_errors=True)
+    for path in (export_path(job), export_path(job) + ".tmp"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Writers run on a worker thread (asyncio.to_thread) so compression never blocks the loop
+
+class CsvPart:
+    def __init__(self, path: str, columns: List[tuple], header: bool):
+        self.file = gzip.open(path, "wt", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        if header:
+            self.writer.writerow([name for name, _ in columns])
+
+    def write(self, rows: List[list]):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetPart:
+    def __init__(self, path: str, columns: List[tuple], header: bool):
+        import pyarrow.parquet as pq
+        self.names = [name for name, _ in columns]
+        self.schema = parquet_schema(columns)
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows: List[list]):
+        import pyarrow as pa
+        # one row group per batch
+        self.writer.write_table(pa.Table.from_pylist([dict(zip(self.names, row)) for row in rows], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def parquet_schema(columns: List[tuple]):
+    import pyarrow as pa
+    types = {datetime: pa.timestamp("us", tz="UTC"), float: pa.float64(), int: pa.int64(), bool: pa.bool_()}
+    return pa.schema([(name, types.get(kind, pa.string())) for name, kind in columns])
+
+
+def _cell(value, kind, fmt: str):
+    if value is None:
+        return None if fmt == "parquet" else ""
+    if kind is datetime:
+        try:
+            value = to_utc(value)
+        except (TypeError, ValueError):
+            return None if fmt == "parquet" else str(value)
+        return value if fmt == "parquet" else to_clinic(value).isoformat()
+    if kind in (int, float) and not isinstance(value, bool):
+        try:
+            return kind(value)
+        except (TypeError, ValueError):
+            return None if fmt == "parquet" else str(value)
+    if kind is bool:
+        return bool(value)
+    return str(value) if isinstance(value, ObjectId) or kind is str else value
+
+
+def _join_parts(job: dict, parts: int) -> int:
+    """
+    Combine the part files into the export file, returns its size. The parts stay until
+    the job is marked completed, so a worker that dies before that joins them again.
+    """
+    target = export_path(job) + ".tmp"
+    paths = [_part_path(job, i) for i in range(parts)]
+    if parts == 1:
+        shutil.copyfile(paths[0], target)
+    elif job["format"] == "csv":
+        with open(target, "wb") as out:
+            for path in paths:
+                with open(path, "rb") as part:
+                    shutil.copyfileobj(part, out)
+    else:
+        import pyarrow.parquet as pq
+        writer = None
+        for path in paths:
+            part = pq.ParquetFile(path)
+            writer = writer or pq.ParquetWriter(target, part.schema_arrow, compression="zstd")
+            for group in range(part.num_row_groups):
+                writer.write_table(part.read_row_group(group))
+        writer.close()
+    os.replace(target, export_path(job))
+    return os.path.getsize(export_path(job))
+
+
+def _empty_export(job: dict, columns: List[tuple]) -> int:
+    part = (CsvPart if job["format"] == "csv" else ParquetPart)(_part_path(job, 0), columns, header=True)
+    part.close()
+    return _join_parts(job, 1)
+
+
+async def _claim(db) -> Optional[dict]:
+    now = get_current_utc()
+    return await db[EXPORTS_COLLECTION].find_one_and_update(
+        {"status": {"$in": ACTIVE_STATUSES}, "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]},
+        {"$set": {"status": "running", "owner": WORKER_ID, "lease_until": now + timedelta(seconds=settings.EXPORT_LEASE_SECONDS)}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _heartbeat(db, job: dict, update: dict):
+    """Record progress and extend the lease; stops the job if it was cancelled or taken over"""
+    update = {**update, "lease_until": get_current_utc() + timedelta(seconds=settings.EXPORT_LEASE_SECONDS)}
+    result = await db[EXPORTS_COLLECTION].update_one(
+        {"_id": job["_id"], "owner": WORKER_ID, "status": "running"}, {"$set": update},
+    )
+    if result.matched_count == 0:
+        current = await db[EXPORTS_COLLECTION].find_one({"_id": job["_id"]}, {"status": 1})
+        if current is None or current["status"] == "cancelled":
+            raise ExportCancelled()
+        raise ExportLeaseLost()
+
+
+async def _with_lease(db, job: dict, work):
+    """Await `work`, a step with no progress to record, renewing the lease meanwhile"""
+    async def renew():
+        while True:
+            await asyncio.sleep(settings.EXPORT_LEASE_SECONDS / 3)
+            await _heartbeat(db, job, {})
+
+    keeper = asyncio.create_task(renew())
+    try:
+        result = await work
+    finally:
+        keeper.cancel()
+        await asyncio.wait([keeper])
+    if not keeper.cancelled() and keeper.exception():
+        raise keeper.exception()
+    return result
+
+
+async def run_export(db, job: dict):
+    spec = export_sources()[job["collection"]]
+    columns = columns_for(spec)
+    fmt = job["format"]
+    writer_class = CsvPart if fmt == "csv" else ParquetPart
+
+    query, _, _ = spec.compile_filter([tuple(pair) for pair in job["filters"]])
+    if job["total"] is None:
+        collection = db[job["collection"]]
+        total = await _with_lease(db, job, collection.count_documents(query) if query else collection.estimated_document_count())
+        await _heartbeat(db, job, {"total": total, "started_at": get_current_utc()})
+    # resume after the last checkpoint, dropping parts written after it
+    parts, exported, last_id = job["parts"], job["checkpoint_rows"], job["last_id"]
+    os.makedirs(_parts_dir(job), exist_ok=True)
+    for name in os.listdir(_parts_dir(job)):
+        if int(name[5:10]) >= parts:
+            os.remove(os.path.join(_parts_dir(job), name))
+    if last_id is not None:
+        resume = after_filter(last_id)
+        query = {"$and": [query, resume]} if query else resume
+        logger.info("Resuming export %s after %s rows", job["_id"], exported)
+
+    projection = {name: 1 for name, _ in columns}
+    cursor = db[job["collection"]].find(query, projection).sort("_id", 1).batch_size(settings.EXPORT_BATCH_SIZE)
+    part, part_rows, batch = None, 0, []
+
+    async def flush():
+        nonlocal part, part_rows, parts, exported, last_id
+        if part is None:
+            part = await asyncio.to_thread(writer_class, _part_path(job, parts), columns, parts == 0)
+        rows = [[_cell(doc.get(name), kind, fmt) for name, kind in columns] for doc in batch]
+        await asyncio.to_thread(part.write, rows)
+        part_rows += len(batch)
+        exported += len(batch)
+        last_id = batch[-1]["_id"]
+        batch.clear()
+        if part_rows >= settings.EXPORT_PART_ROWS:
+            await asyncio.to_thread(part.close)
+            part, part_rows, parts = None, 0, parts + 1
+            await _heartbeat(db, job, {"parts": parts, "checkpoint_rows": exported, "last_id": last_id, "exported": exported})
+        else:
+            await _heartbeat(db, job, {"exported": exported})
+
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= settings.EXPORT_BATCH_SIZE:
+            await flush()
+    if batch:
+        await flush()
+    if part is not None:
+        await asyncio.to_thread(part.close)
+        parts += 1
+
+    if parts:
+        size = await _with_lease(db, job, asyncio.to_thread(_join_parts, job, parts))
+    else:
+        size = await asyncio.to_thread(_empty_export, job, columns)
+    await _heartbeat(db, job, {
+        "status": "completed", "exported": exported, "parts": parts, "checkpoint_rows": exported,
+        "last_id": last_id, "size_bytes": size, "finished_at": get_current_utc(), "lease_until": None,
+    })
+    await asyncio.to_thread(shutil.rmtree, _parts_dir(job), ignore_errors=True)
+    logger.info("Export %s finished: %s rows, %s bytes", job["_id"], exported, size)
+
+
+async def _run_claimed(db, job: dict):
+    try:
+        await run_export(db, job)
+    except ExportCancelled:
+        logger.info("Export %s cancelled", job["_id"])
+        await asyncio.to_thread(_remove_files, job)
+    except ExportLeaseLost:
+        logger.warning("Export %s was taken over by another worker, leaving its files alone", job["_id"])
+    except asyncio.CancelledError:
+        # shutting down: hand the job back so the next worker resumes it at once
+        await db[EXPORTS_COLLECTION].update_one({"_id": job["_id"], "owner": WORKER_ID}, {"$set": {"lease_until": None}})
+        raise
+    except Exception as e:
+        logger.exception("Export %s failed", job["_id"])
+        await db[EXPORTS_COLLECTION].update_one(
+            {"_id": job["_id"], "owner": WORKER_ID},
+            {"$set": {"status": "failed", "error": str(e), "finished_at": get_current_utc(), "lease_until": None}},
+        )
+
+
+async def worker(db):
+    """Startup task: run up to EXPORT_MAX_CONCURRENT jobs, picking up new and abandoned ones"""
+    running = set()
+    try:
+        while True:
+            _wake.clear()
+            while len(running) < settings.EXPORT_MAX_CONCURRENT:
+                job = await _claim(db)
+                if job is None:
+                    break
+                task = asyncio.create_task(_run_claimed(db, job))
+                running.add(task)
+                task.add_done_callback(lambda t: (running.discard(t), _wake.set()))
+            try:
+                await asyncio.wait_for(_wake.wait(), timeout=settings.EXPORT_LEASE_SECONDS / 2)
+            except asyncio.TimeoutError:
+                pass
+    except asyncio.CancelledError:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        raise
+    except Exception:
+        logger.exception("Export worker stopped")
+
+
+def progress(job: dict) -> dict:
+    total = job.get("total")
+    return {
+        **job,
+        "export_id": job["_id"],
+        "last_id": None if job.get("last_id") is None else str(job["last_id"]),
+        "percent": round(job["exported"] / total * 100, 1) if total else (100.0 if job["status"] == "completed" else 0.0),
+    }
@@ -0,0 +1,185 @@
+"""
+Bulk imports of patients and staff from CSV or NDJSON uploads.
+
+The upload is read READ_SIZE bytes at a time and parsed as it arrives, rows are
+validated against the create schema one by one, and valid rows go to the repository's
+insert_many (unordered, IDs generated per batch) IMPORT_BATCH_SIZE at a time. Memory
+holds one chunk, one batch and the error report (at most IMPORT_MAX_ERRORS entries),
+whatever the size of the file.
+
+CSV needs a header row naming the schema fields; empty cells count as missing.
+NDJSON is one JSON object per line. Rows are numbered from 1, not counting the header.
+A row longer than IMPORT_MAX_ROW_SIZE characters is reported as failed and skipped up to
+the next line, so an unbalanced CSV quote cannot pull the rest of the file into memory.
+"""
+import codecs
+import csv
+from typing import AsyncIterator, List, Optional, Tuple, Type
+
+import orjson
+from fastapi import HTTPException, UploadFile
+from pydantic import BaseModel, ValidationError
+
+from config import settings
+from repository import Repository, validation_message
+
+READ_SIZE = 1024 * 1024
+
+
+def detect_format(upload: UploadFile, requested: Optional[str]) -> str:
+    if requested:
+        return requested
+    name = (upload.filename or "").lower()
+    content_type = (upload.content_type or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in content_type or "jsonl" in content_type:
+        return "ndjson"
+    if name.endswith(".csv") or "csv" in content_type:
+        return "csv"
+    raise HTTPException(status_code=400, detail="Cannot tell the upload format, pass ?format=csv or ?format=ndjson")
+
+
+async def _chunks(upload: UploadFile) -> AsyncIterator[Tuple[str, bool]]:
+    """(decoded text, last chunk)"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    while True:
+        data = await upload.read(READ_SIZE)
+        if not data:
+            break
+        yield decoder.decode(data), False
+    yield decoder.decode(b"", final=True), True
+
+
+def _split_records(buffer: str) -> Tuple[List[Optional[str]], str]:
+    """
+    Complete CSV records in `buffer` and the unfinished rest; quoted cells may span lines.
+    A record still open after IMPORT_MAX_ROW_SIZE characters is given up on as None.
+    """
+    lines = buffer.split("\n")
+    records, current, size, quoted = [], [], 0, False
+    for line in lines[:-1]:
+        current.append(line)
+        size += len(line) + 1
+        if line.count('"') % 2:
+            quoted = not quoted
+        if not quoted:
+            records.append("\n".join(current))
+            current, size = [], 0
+        elif size > settings.IMPORT_MAX_ROW_SIZE:
+            records.append(None)
+            current, size, quoted = [], 0, False
+    return records, "\n".join(current + lines[-1:])
+
+
+def _too_long() -> str:
+    return f"row longer than {settings.IMPORT_MAX_ROW_SIZE} characters (unbalanced quote?), skipped to the next line"
+
+
+async def _bounded(upload: UploadFile, split) -> AsyncIterator[Optional[str]]:
+    """
+    Records of the upload as cut by `split(buffer) -> (records, rest)`, None for each one
+    over IMPORT_MAX_ROW_SIZE. An unfinished rest over the limit is dropped up to its next line.
+    """
+    buffer, skipping = "", False
+    async for text, last in _chunks(upload):
+        if skipping:
+            _, newline, text = text.partition("\n")
+            skipping = not newline
+        records, buffer = split(buffer + text)
+        if len(buffer) > settings.IMPORT_MAX_ROW_SIZE:
+            records, buffer, skipping = records + [None], "", True
+        elif last:
+            # end of the upload: the last line may lack a newline
+            records, buffer = records + [buffer], ""
+        for record in records:
+            yield record
+
+
+def _split_lines(buffer: str) -> Tuple[List[str], str]:
+    lines = buffer.split("\n")
+    return lines[:-1], lines[-1]
+
+
+async def csv_rows(upload: UploadFile) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """(row number, row, parse error) for every data row"""
+    header, row_number = None, 0
+
+    async for record in _bounded(upload, _split_records):
+        if record is None:
+            row_number += 1
+            yield row_number, None, _too_long()
+            continue
+        values = next(csv.reader([record]), [])
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        row_number += 1
+        if len(values) != len(header):
+            yield row_number, None, f"expected {len(header)} columns, got {len(values)}"
+            continue
+        yield row_number, {name: value for name, value in zip(header, values) if value != ""}, None
+
+
+async def ndjson_rows(upload: UploadFile) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    row_number = 0
+    async for line in _bounded(upload, _split_lines):
+        if line is None:
+            row_number += 1
+            yield row_number, None, _too_long()
+            continue
+        if not line.strip():
+            continue
+        row_number += 1
+        yield (row_number, *_parse_json(line))
+
+
+def _parse_json(line: str) -> Tuple[Optional[dict], Optional[str]]:
+    try:
+        row = orjson.loads(line)
+    except orjson.JSONDecodeError as e:
+        return None, f"invalid JSON: {e}"
+    if not isinstance(row, dict):
+        return None, "expected a JSON object"
+    return row, None
+
+
+async def import_upload(db, repository: Repository, schema: Type[BaseModel], upload: UploadFile, fmt: str) -> dict:
+    rows = csv_rows(upload) if fmt == "csv" else ndjson_rows(upload)
+    report = {"rows": 0, "inserted": 0, "failed": 0, "errors": [], "errors_truncated": False}
+    batch: List[dict] = []
+    batch_rows: List[int] = []
+
+    def fail(row_number: int, message: str):
+        report["failed"] += 1
+        if len(report["errors"]) < settings.IMPORT_MAX_ERRORS:
+            report["errors"].append({"row": row_number, "error": message})
+        else:
+            report["errors_truncated"] = True
+
+    async def flush():
+        inserted, errors = await repository.insert_many(db, batch, ordered=False)
+        report["inserted"] += len(inserted)
+        for error in errors:
+            fail(batch_rows[error["index"]], error["error"])
+        batch.clear()
+        batch_rows.clear()
+
+    async for row_number, row, error in rows:
+        report["rows"] += 1
+        if error:
+            fail(row_number, error)
+            continue
+        try:
+            batch.append(schema(**row).model_dump())
+        except ValidationError as e:
+            fail(row_number, validation_message(e))
+            continue
+        batch_rows.append(row_number)
+        if len(batch) >= settings.IMPORT_BATCH_SIZE:
+            await flush()
+    if batch:
+        await flush()
+
+    report["errors"].sort(key=lambda e: e["row"])
+    return report
@@ -0,0 +1,111 @@
+"""
+Explain every query shape the routers issue and flag the ones that fall back to a
+collection scan.
+
+    python index_report.py            # report only
+    python index_report.py --apply    # create the registry indexes first
+"""
+import argparse
+import asyncio
+import sys
+
+import database
+from database import connect_to_mongo, close_mongo_connection, ensure_indexes
+from dates import day_bounds
+from stats import today
+
+_today = today().isoformat()
+_start, _end = day_bounds(today())
+
+# (collection, description, filter, sort) for each query the routers run
+QUERY_SHAPES = [
+    ("users", "auth: user by email", {"email": "user@example.com"}, None),
+    ("patients", "patients: get/update/delete by patient_id", {"patient_id": "PAT_x"}, None),
+    ("staff", "staff: get/update/delete by staff_id", {"staff_id": "STF_x"}, None),
+    ("appointments", "appointments: get/update/delete by appointment_id", {"appointment_id": "APT_x"}, None),
+    ("medical_records", "medical records: get/update/delete by record_id", {"record_id": "REC_x"}, None),
+    ("billing", "billing: get/update/delete by bill_id", {"bill_id": "BILL_x"}, None),
+    ("appointments", "dashboard: appointments today",
+     {"appointment_date": {"$gte": _start, "$lt": _end}}, [("appointment_date", 1)]),
+    ("patients", "search: name prefix", {"name_prefixes": {"$all": ["ram", "s"]}}, None),
+    ("patients", "search: phone suffix", {"phone_rev": {"$regex": "^4321"}}, None),
+    ("patients", "search: email prefix", {"email_lc": {"$regex": "^ram@"}}, None),
+    ("patients", "dashboard: patient name lookup", {"patient_id": "PAT_x"}, None),
+    ("staff", "dashboard: doctor name lookup", {"staff_id": "STF_x"}, None),
+    ("patients", "dashboard: recent patients", {}, [("created_at", -1)]),
+    ("medical_records", "dashboard: last visit of patient", {"patient_id": "PAT_x"}, [("visit_date", -1)]),
+    ("staff", "range: hired between", {"hire_date": {"$gte": _start, "$lt": _end}}, None),
+    ("medical_records", "range: visits between", {"visit_date": {"$gte": _start, "$lt": _end}}, None),
+    ("billing", "range: billed between", {"billing_date": {"$gte": _start, "$lt": _end}}, None),
+    ("doctor_schedules", "appointments: doctor availability",
+     {"doctor_id": "STF_x", "date": {"$gte": _today, "$lte": _today}}, None),
+    ("billing", "billing reports: bills of moved appointments", {"appointment_id": {"$in": ["APT_x"]}}, None),
+    ("billing_rollups", "billing reports: days in range", {"_id": {"$gte": _today, "$lte": _today}}, [("_id", 1)]),
+    ("appointments", "timeline: appointments of patient", {"patient_id": "PAT_x"}, [("appointment_date", -1), ("appointment_id", -1)]),
+    ("medical_records", "timeline: records of patient", {"patient_id": "PAT_x"}, [("visit_date", -1), ("record_id", -1)]),
+    ("billing", "timeline: bills of patient", {"patient_id": "PAT_x"}, [("billing_date", -1), ("bill_id", -1)]),
+    ("appointments", "list filter: doctor's appointments in range",
+     {"doctor_id": "STF_x", "appointment_date": {"$gte": _start, "$lt": _end}, "status": "Scheduled"}, None),
+    ("billing", "list filter: unpaid bills of patient", {"patient_id": "PAT_x", "payment_status": "Pending"}, None),
+    ("stats", "dashboard: counters", {"_id": {"$in": ["total", "day:" + _today]}}, None),
+]
+
+
+def _stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+def winning_stages(explain: dict) -> list:
+    planner = explain.get("queryPlanner", {})
+    return [s for s in _stages(planner.get("winningPlan", {})) if s]
+
+
+async def explain_shape(db, collection: str, query: dict, sort) -> list:
+    command = {"find": collection, "filter": query}
+    if sort:
+        command["sort"] = dict(sort)
+    explain = await db.command("explain", command, verbosity="queryPlanner")
+    return winning_stages(explain)
+
+
+async def build_report(db) -> list:
+    report = []
+    for collection, description, query, sort in QUERY_SHAPES:
+        stages = await explain_shape(db, collection, query, sort)
+        report.append({
+            "collection": collection,
+            "query": description,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
+
+
+async def main(apply: bool) -> int:
+    await connect_to_mongo()
+    try:
+        if apply:
+            await ensure_indexes(database.db)
+        report = await build_report(database.db)
+    finally:
+        await close_mongo_connection()
+
+    for row in report:
+        flag = "COLLSCAN" if row["collscan"] else "ok"
+        print(f"{flag:<9} {row['collection']:<16} {row['query']:<50} {' <- '.join(row['stages'])}")
+
+    scans = sum(1 for row in report if row["collscan"])
+    print(f"\n{scans} of {len(report)} query shapes do a collection scan")
+    return 1 if scans else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="create the registry indexes before explaining")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.apply)))
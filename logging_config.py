@@ -0,0 +1,50 @@
+"""
+Structured JSON logs.
+
+`setup_logging()` loads logging.conf, whose handlers use `JSONFormatter`: one JSON
+object per line with the request id of the request being served, plus anything passed
+as `extra=`.
+"""
+import logging
+import logging.config
+import os
+import traceback
+from datetime import datetime, timezone
+
+import orjson
+
+# attributes every LogRecord has; anything else came in through `extra=`
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        from metrics import current_request_id
+
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = current_request_id()
+        if request_id:
+            entry["request_id"] = request_id
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        # str() anything orjson cannot encode rather than lose the line
+        return orjson.dumps(entry, default=str).decode()
+
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logging.conf")
+
+
+def setup_logging(config_file: str = DEFAULT_CONFIG):
+    if not os.path.exists(config_file):
+        logging.basicConfig(level=logging.INFO)
+        return
+    os.makedirs("logs", exist_ok=True)  # the file handler writes logs/app.log
+    logging.config.fileConfig(config_file, disable_existing_loggers=False)
@@ -1,9 +1,42 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routers import auth, patients, staff, appointments, medical_records, billing, dashboard
-from database import connect_to_mongo, close_mongo_connection
+from fastapi.responses import JSONResponse, PlainTextResponse
+from logging_config import setup_logging
+setup_logging()
+from routers import auth, patients, staff, appointments, medical_records, billing, dashboard, admin, exports, events
+import database
+from database import connect_to_mongo, close_mongo_connection, check_health
+from auth import shutdown_password_executor, password_hash_stats
+from cache import response_cache
+from metrics import RequestMetricsMiddleware, register_collector, render_metrics
+from config import settings
+import migrate_dates
+import exports as export_jobs
+from events import event_bus
 
-app = FastAPI(title="Clinic Management System", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # connect eagerly so the first requests don't race to open the client
+    await connect_to_mongo()
+    migration = None
+    if settings.DATE_MIGRATION_ON_STARTUP:
+        migration = asyncio.create_task(migrate_dates.run_in_background(database.db))
+    export_worker = asyncio.create_task(export_jobs.worker(database.db))
+    await event_bus.start(database.db)
+    yield
+    await event_bus.stop()
+    export_worker.cancel()
+    await asyncio.gather(export_worker, return_exceptions=True)
+    if migration and not migration.done():
+        migration.cancel()
+    shutdown_password_executor()
+    await close_mongo_connection()
+
+
+app = FastAPI(title="Clinic Management System", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -13,6 +46,28 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# outermost, so it times CORS and error handling too
+app.add_middleware(RequestMetricsMiddleware)
+
+
+def _process_metrics() -> dict:
+    pool = database.pool_stats.snapshot()
+    cache = response_cache.stats()
+    hashing = password_hash_stats()
+    return {
+        "mongodb_pool_connections_open": ("gauge", "Open MongoDB connections", pool["open"]),
+        "mongodb_pool_connections_in_use": ("gauge", "Checked-out MongoDB connections", pool["in_use"]),
+        "mongodb_pool_checkout_failed_total": ("counter", "Failed connection checkouts", pool["checkout_failed"]),
+        "response_cache_hits_total": ("counter", "Response cache hits", cache["hits"]),
+        "response_cache_misses_total": ("counter", "Response cache misses", cache["misses"]),
+        "response_cache_not_modified_total": ("counter", "304 responses", cache["not_modified"]),
+        "response_cache_size": ("gauge", "Entries in the response cache", cache["size"]),
+        "password_hash_in_flight": ("gauge", "Password hashes queued or running", hashing["in_flight"]),
+        "password_hash_rejected_total": ("counter", "Logins rejected with 429", hashing["rejected"]),
+    }
+
+
+register_collector(_process_metrics)
 
 
 # Include routers
@@ -23,7 +78,24 @@ app.include_router(staff.router, prefix="/api/staff", tags=["Staff"])
 app.include_router(appointments.router, prefix="/api/appointments", tags=["Appointments"])
 app.include_router(medical_records.router, prefix="/api/medical-records", tags=["Medical Records"])
 app.include_router(billing.router, prefix="/api/billing", tags=["Billing"])
+app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
+app.include_router(exports.router, prefix="/api/exports", tags=["Exports"])
+app.include_router(events.router, prefix="/api/events", tags=["Events"])
 
 @app.get("/")
 def read_root():
-    return {"message": "Clinic Management System API"}
\ No newline at end of file
+    return {"message": "Clinic Management System API"}
+
+@app.get("/health")
+async def health():
+    health_status = await check_health()
+    health_status["password_hashing"] = password_hash_stats()
+    health_status["response_cache"] = response_cache.stats()
+    health_status["events"] = event_bus.stats()
+    ready = health_status["database"] == "ok"
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, **health_status})
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
\ No newline at end of file
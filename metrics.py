@@ -0,0 +1,300 @@
+"""
+Request metrics and per-request database tracing, exposed in Prometheus text format.
+
+`RequestMetricsMiddleware` times every request by route template and opens a trace in a
+context variable. Motor runs PyMongo calls on executor threads with a copy of the
+caller's context, so `CommandTracer` (a PyMongo command listener) sees that trace and
+attributes each command to the request that issued it. A request that repeats the same
+query shape N_PLUS_ONE_THRESHOLD times or more is flagged as an N+1.
+"""
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import Counter as _Tally
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# commands that are part of another operation, never N+1 on their own
+_FOLLOW_UP_COMMANDS = {"getMore", "killCursors", "endSessions"}
+
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series):
+                    cumulative += count
+                    labels = _label_text(self.labels + ("le",), values + (str(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _label_text(self.labels, values)
+                lines.append(f"{self.name}_sum{labels} {series[-1]}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route template", ("method", "route", "status"))
+http_requests_in_flight = [0]
+db_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ("command", "collection"))
+db_commands_per_request = Histogram(
+    "mongodb_commands_per_request", "MongoDB commands issued per request", ("route",), buckets=COUNT_BUCKETS)
+db_documents_returned = Counter(
+    "mongodb_documents_returned_total", "Documents returned or written by MongoDB commands", ("command", "collection"))
+db_command_failures = Counter(
+    "mongodb_command_failures_total", "Failed MongoDB commands", ("command", "collection"))
+n_plus_one_detected = Counter(
+    "mongodb_n_plus_one_total", "Requests that repeated one query shape N_PLUS_ONE_THRESHOLD times or more",
+    ("route", "command", "collection"))
+
+METRICS = [http_request_duration, db_command_duration, db_commands_per_request,
+           db_documents_returned, db_command_failures, n_plus_one_detected]
+
+# unlabelled values kept elsewhere (pool, cache, password hashing),
+# each source returns {metric name: (type, help, value)}
+_collectors: List[Callable[[], Dict[str, Tuple[str, str, float]]]] = []
+
+
+def register_collector(source: Callable[[], Dict[str, Tuple[str, str, float]]]):
+    _collectors.append(source)
+
+
+def render_metrics() -> str:
+    lines = [
+        "# HELP http_requests_in_flight Requests being handled right now",
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {http_requests_in_flight[0]}",
+    ]
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for source in _collectors:
+        for name, (kind, help_text, value) in source().items():
+            if value is None:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+class RequestTrace:
+    """Database work done on behalf of one request"""
+
+    def __init__(self, request_id: str, scope: Optional[dict] = None):
+        self.request_id = request_id
+        self.scope = scope or {}
+        self.commands = 0
+        self.db_seconds = 0.0
+        self.shapes = _Tally()
+
+    @property
+    def route(self) -> str:
+        # the router fills in scope["route"] before the endpoint runs
+        return getattr(self.scope.get("route"), "path", "unmatched")
+
+    def record(self, command: str, collection: str, shape: tuple, seconds: float):
+        self.commands += 1
+        self.db_seconds += seconds
+        if command not in _FOLLOW_UP_COMMANDS:
+            self.shapes[(command, collection, shape)] += 1
+
+    def repeated_shapes(self) -> List[Tuple[tuple, int]]:
+        return [(key, n) for key, n in self.shapes.items() if n >= settings.N_PLUS_ONE_THRESHOLD]
+
+
+current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    trace = current_trace.get()
+    return trace.request_id if trace else None
+
+
+def _collection(event) -> str:
+    command = event.command
+    if event.command_name == "getMore":
+        return str(command.get("collection", ""))
+    value = command.get(event.command_name)
+    return value if isinstance(value, str) else ""
+
+
+def _shape(event) -> tuple:
+    """Field names a command filters on, values left out"""
+    command = event.command
+    query = command.get("filter")
+    if query is None and event.command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or []
+        query = statements[0].get("q") if len(statements) == 1 else None
+    if query is None and event.command_name == "findAndModify":
+        query = command.get("query")
+    return tuple(sorted(query)) if isinstance(query, dict) else ()
+
+
+def _documents(reply: dict) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    n = reply.get("n")
+    return n if isinstance(n, int) else 0
+
+
+class CommandTracer(monitoring.CommandListener):
+    """
+    Times every command and attributes it to the request in context.
+
+    Observers (see profiler.py) get `observe(command, collection, command_doc, seconds, trace)`
+    for each successful command, on the thread that ran it.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[int, int], tuple] = {}
+        self._lock = threading.Lock()
+        self.observers = []
+
+    def started(self, event):
+        pending = (event.command_name, _collection(event), _shape(event), current_trace.get(), event.command)
+        with self._lock:
+            self._pending[(event.request_id, event.operation_id)] = pending
+
+    def _finish(self, event, failed: bool):
+        with self._lock:
+            pending = self._pending.pop((event.request_id, event.operation_id), None)
+        if pending is None:
+            return
+        command, collection, shape, trace, command_doc = pending
+        seconds = event.duration_micros / 1_000_000
+        db_command_duration.observe(seconds, command, collection)
+        if trace is not None:
+            trace.record(command, collection, shape, seconds)
+        if failed:
+            db_command_failures.inc(command, collection)
+            return
+        db_documents_returned.inc(command, collection, amount=_documents(event.reply))
+        for observer in self.observers:
+            observer.observe(command, collection, command_doc, seconds, trace)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+command_tracer = CommandTracer()
+
+
+class RequestMetricsMiddleware:
+    """Pure ASGI middleware so streamed responses are timed until their last chunk"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode() or uuid.uuid4().hex
+        trace = RequestTrace(request_id, scope)
+        token = current_trace.set(trace)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                # event streams stay open for hours, their duration says nothing about latency
+                status["stream"] = any(k == b"content-type" and v.startswith(b"text/event-stream")
+                                       for k, v in message.get("headers", []))
+                message.setdefault("headers", []).append((b"x-request-id", request_id.encode()))
+            await send(message)
+
+        http_requests_in_flight[0] += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight[0] -= 1
+            if not status.get("stream"):
+                self._record(scope, trace, status["code"], elapsed)
+            current_trace.reset(token)
+
+    @staticmethod
+    def _record(scope, trace: RequestTrace, status: int, elapsed: float):
+        method = scope.get("method", "")
+        http_request_duration.observe(elapsed, method, trace.route, str(status))
+        db_commands_per_request.observe(trace.commands, trace.route)
+
+        for (command, collection, shape), count in trace.repeated_shapes():
+            n_plus_one_detected.inc(trace.route, command, collection)
+            logger.warning("possible N+1 query", extra={
+                "route": trace.route, "command": command, "collection": collection,
+                "filter_fields": list(shape), "repeats": count,
+            })
+
+        details = {
+            "method": method, "route": trace.route, "path": scope.get("path"), "status": status,
+            "duration_ms": round(elapsed * 1000, 2), "db_commands": trace.commands,
+            "db_ms": round(trace.db_seconds * 1000, 2),
+        }
+        if elapsed * 1000 >= settings.SLOW_REQUEST_MS:
+            logger.warning("slow request", extra=details)
+        else:
+            logger.debug("request", extra=details)
@@ -0,0 +1,111 @@
+"""
+Convert dates stored as ISO strings into BSON datetimes (UTC, see dates.py).
+
+Documents are converted in batches of DATE_MIGRATION_BATCH_SIZE with one bulk_write
+each. Every update is conditional on the old string still being there, so a write
+racing with the migration always wins. Appointments get appointment_date and
+appointment_time combined into the start instant.
+
+    python migrate_dates.py    # convert everything, report what could not be parsed
+"""
+import asyncio
+import logging
+import sys
+from typing import Optional
+
+from pymongo import UpdateOne
+
+from config import settings
+from dates import clinic_time, combine, to_utc
+
+logger = logging.getLogger(__name__)
+
+# (collection, field) pairs that hold BSON datetimes
+DATE_FIELDS = [
+    ("appointments", "appointment_date"),
+    ("staff", "hire_date"),
+    ("medical_records", "visit_date"),
+    ("billing", "billing_date"),
+]
+
+
+def _converted(collection: str, field: str, doc: dict) -> dict:
+    if collection == "appointments" and doc.get("appointment_time") and "T" not in doc[field]:
+        start = combine(doc[field], doc["appointment_time"])
+        return {field: start, "appointment_time": clinic_time(start)}
+    value = to_utc(doc[field])
+    if collection == "appointments":
+        return {field: value, "appointment_time": clinic_time(value)}
+    return {field: value}
+
+
+async def migrate_field(db, collection: str, field: str, batch_size: int) -> dict:
+    converted = 0
+    failed = []  # _ids whose value cannot be parsed, left as they are
+    projection = {field: 1, "appointment_time": 1} if collection == "appointments" else {field: 1}
+    while True:
+        query = {field: {"$type": "string"}}
+        if failed:
+            query["_id"] = {"$nin": failed}
+        docs = await db[collection].find(query, projection).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            return {"converted": converted, "failed": [str(_id) for _id in failed]}
+
+        operations = []
+        for doc in docs:
+            try:
+                update = _converted(collection, field, doc)
+            except (TypeError, ValueError):
+                failed.append(doc["_id"])
+                continue
+            operations.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": update}))
+        if operations:
+            result = await db[collection].bulk_write(operations, ordered=False)
+            converted += result.modified_count
+        # give request handlers a turn between batches
+        await asyncio.sleep(0)
+
+
+async def migrate(db, batch_size: Optional[int] = None) -> dict:
+    """Convert every DATE_FIELDS value still stored as a string, returns counts per field"""
+    batch_size = batch_size or settings.DATE_MIGRATION_BATCH_SIZE
+    report = {}
+    for collection, field in DATE_FIELDS:
+        report[f"{collection}.{field}"] = await migrate_field(db, collection, field, batch_size)
+    return report
+
+
+async def run_in_background(db):
+    """Startup task: migrate and log the outcome, never take the app down"""
+    try:
+        report = await migrate(db)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.exception("Date migration failed: %s", e)
+        return
+    for name, result in report.items():
+        if result["converted"] or result["failed"]:
+            logger.info("Date migration %s: converted %d, unparseable %d", name, result["converted"], len(result["failed"]),
+                        extra={"field": name, "converted": result["converted"], "unparseable": len(result["failed"])})
+
+
+async def main() -> int:
+    import database
+    from database import connect_to_mongo, close_mongo_connection
+
+    await connect_to_mongo()
+    try:
+        report = await migrate(database.db)
+    finally:
+        await close_mongo_connection()
+
+    for name, result in report.items():
+        print(f"{name:<35} converted={result['converted']} unparseable={len(result['failed'])}")
+        for _id in result["failed"]:
+            print(f"    {_id}")
+    return 1 if any(result["failed"] for result in report.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,7 +1,9 @@
 from typing import Optional, Any
+from datetime import datetime
 from bson import ObjectId
-from pydantic import BaseModel, Field, field_serializer, field_validator
+from pydantic import BaseModel, Field, field_serializer, field_validator, model_validator
 from pydantic_core import core_schema
+from dates import UTCDateTime, clinic_time
 
 
 # Custom ObjectId type for Pydantic v2
@@ -46,6 +48,7 @@ class User(MongoBaseModel):
     email: str
     password: str
     role: str = "admin"
+    token_version: int = 0  # bump to revoke every token issued so far
 
     @field_serializer('id')
     def serialize_id(self, value: PyObjectId, _info):
@@ -62,6 +65,7 @@ class Patient(MongoBaseModel):
     email: Optional[str] = None
     address: str
     emergency_contact: str
+    created_at: Optional[datetime] = None
 
     @field_serializer('id')
     def serialize_id(self, value: Optional[PyObjectId], _info):
@@ -76,7 +80,7 @@ class Staff(MongoBaseModel):
     specialization: Optional[str] = None
     contact_number: str
     email: Optional[str] = None
-    hire_date: str
+    hire_date: UTCDateTime
 
     @field_serializer('id')
     def serialize_id(self, value: Optional[PyObjectId], _info):
@@ -88,13 +92,18 @@ class Appointment(MongoBaseModel):
     appointment_id: Optional[str] = None
     patient_id: str
     doctor_id: str
-    appointment_date: str
-    appointment_time: str
+    appointment_date: UTCDateTime  # start of the appointment
+    appointment_time: Optional[str] = None  # clinic local HH:MM, derived from appointment_date
+    duration_minutes: Optional[int] = None  # defaults to APPOINTMENT_DEFAULT_DURATION_MINUTES
     status: str = "Scheduled"  # Scheduled, Completed, Cancelled, No-Show
     reason_for_visit: str
     room_number: Optional[str] = None
     notes: Optional[str] = None
-    
+
+    @model_validator(mode="after")
+    def derive_time(self):
+        self.appointment_time = clinic_time(self.appointment_date)
+        return self
 
     @field_serializer('id')
     def serialize_id(self, value: Optional[PyObjectId], _info):
@@ -106,12 +115,16 @@ class MedicalRecord(MongoBaseModel):
     record_id: Optional[str] = None
     patient_id: str
     doctor_id: str
-    visit_date: str
+    visit_date: UTCDateTime
     diagnosis: str
     treatment: str
     lab_results: Optional[str] = None
     follow_up_required: bool = False
-    document: Optional[bytes] = None
+    # the file itself lives in GridFS, see documents.py
+    document_ref: Optional[str] = None
+    document_name: Optional[str] = None
+    document_content_type: Optional[str] = None
+    document_size: Optional[int] = None
 
     @field_serializer('id')
     def serialize_id(self, value: Optional[PyObjectId], _info):
@@ -127,7 +140,7 @@ class Billing(MongoBaseModel):
     paid_amount: float
     payment_method: str  # Cash, Card, Online
     payment_status: str = "Pending"  # Pending, Paid, Partial, Cancelled
-    billing_date: str
+    billing_date: UTCDateTime
 
     @field_serializer('id')
     def serialize_id(self, value: Optional[PyObjectId], _info):
@@ -0,0 +1,176 @@
+import base64
+from typing import Optional, Tuple, Type
+
+from bson import ObjectId, json_util
+from fastapi import HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from database import serialize_document
+from query import QuerySpec, check_indexed
+from responses import dumps, standard_response
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+
+class ListParams:
+    """Query parameters shared by every "list all" endpoint"""
+
+    def __init__(
+        self,
+        request: Request,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        after: Optional[str] = Query(None, description="Cursor returned as next_cursor by the previous page"),
+        fields: Optional[str] = Query(None, description="Comma separated list of fields to return"),
+        stream: bool = Query(False, description="Stream every matching document as NDJSON"),
+        sort: Optional[str] = Query(None, description="Field to sort by, prefixed with - for descending"),
+    ):
+        self.limit = limit
+        self.after = after
+        self.fields = fields
+        self.stream = stream
+        self.sort = sort
+        # every other parameter is a filter, see query.py
+        self.filters = request.query_params.multi_items()
+
+
+def parse_cursor(after: Optional[str]):
+    """
+    Decode a cursor into the _id to resume after.
+
+    Documents created through `Model.dict(by_alias=True)` carry their _id as a hex
+    string rather than an ObjectId, so string ids are encoded with an "s:" prefix.
+    """
+    if after is None:
+        return None
+    if after.startswith("s:"):
+        return after[2:]
+    if not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return ObjectId(after)
+
+
+def encode_cursor(_id) -> str:
+    return str(_id) if isinstance(_id, ObjectId) else f"s:{_id}"
+
+
+def after_filter(after, direction: int = 1) -> dict:
+    if after is None:
+        return {}
+    # Mongo sorts strings before ObjectIds and range operators are type bracketed
+    if isinstance(after, ObjectId):
+        if direction == 1:
+            return {"_id": {"$gt": after}}
+        return {"$or": [{"_id": {"$lt": after}}, {"_id": {"$type": "string"}}]}
+    if direction == 1:
+        return {"$or": [{"_id": {"$gt": after}}, {"_id": {"$type": "objectId"}}]}
+    return {"_id": {"$lt": after}}
+
+
+def encode_sort_cursor(doc: dict, field: str) -> str:
+    raw = json_util.dumps([doc.get(field), doc["_id"]])
+    return "k:" + base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def parse_sort_cursor(after: str):
+    """(sort value, _id) of the last document of the previous page"""
+    if not after.startswith("k:"):
+        raise HTTPException(status_code=400, detail="Invalid cursor for this sort")
+    try:
+        value, _id = json_util.loads(base64.urlsafe_b64decode(after[2:]))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value, _id
+
+
+def sorted_after_filter(after: str, sort: Tuple[str, int]) -> dict:
+    """Documents after (value, _id) in `sort` order, with _id breaking ties"""
+    field, direction = sort
+    value, _id = parse_sort_cursor(after)
+    ties = {"$and": [{field: value}, after_filter(_id, direction)]}
+    if value is None:
+        # missing values sort first
+        return {"$or": [ties, {field: {"$ne": None}}]} if direction == 1 else ties
+    beyond = {field: {"$gt" if direction == 1 else "$lt": value}}
+    if direction == -1:
+        beyond = {"$or": [beyond, {field: None}]}
+    return {"$or": [beyond, ties]}
+
+
+def build_projection(fields: Optional[str], model: Type[BaseModel]) -> Optional[dict]:
+    """Turn ?fields=a,b into a Mongo projection, rejecting unknown fields"""
+    if not fields:
+        return None
+
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    allowed = set(model.model_fields) - {"id"}
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    # _id is always returned, it is the pagination key
+    return {f: 1 for f in requested}
+
+
+def _ndjson_stream(cursor):
+    async def generate():
+        async for doc in cursor:
+            yield dumps(serialize_document(doc)) + b"\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+async def paginate(
+    collection, key: str, model: Type[BaseModel], params: ListParams, message: str,
+    default_projection: Optional[dict] = None, spec: Optional[QuerySpec] = None,
+):
+    """
+    Keyset pagination on _id, or on (sort field, _id) with ?sort=.
+
+    Pages hold at most `limit` documents and carry a `next_cursor` to pass back as
+    `after`. With `stream=true` everything after the cursor is streamed as NDJSON
+    straight from the Motor cursor instead, so memory stays flat. `spec` whitelists
+    the filters and sorts the endpoint accepts (query.py).
+    """
+    spec = spec or QuerySpec(model, filters=())
+    query, equality, ranges = spec.compile_filter(params.filters)
+    sort = spec.compile_sort(params.sort)
+    warning = check_indexed(collection.name, equality, ranges, sort)
+
+    if sort:
+        after = sorted_after_filter(params.after, sort) if params.after else {}
+        order = [sort, ("_id", sort[1])]
+    else:
+        after = after_filter(parse_cursor(params.after))
+        order = [("_id", 1)]
+    if after:
+        query = {"$and": [query, after]} if query else after
+
+    projection = build_projection(params.fields, model) or default_projection
+    if sort and projection and any(projection.values()) and sort[0] not in projection:
+        projection = {**projection, sort[0]: 1}  # the cursor needs it
+
+    cursor = collection.find(query, projection).sort(order)
+
+    if params.stream:
+        return _ndjson_stream(cursor.batch_size(STREAM_BATCH_SIZE))
+
+    docs = await cursor.limit(params.limit).to_list(length=params.limit)
+    next_cursor = None
+    if len(docs) == params.limit:
+        next_cursor = encode_sort_cursor(docs[-1], sort[0]) if sort else encode_cursor(docs[-1]["_id"])
+
+    data = {
+        key: [serialize_document(doc) for doc in docs],
+        "next_cursor": next_cursor,
+        "limit": params.limit,
+    }
+    if warning:
+        data["warning"] = warning
+    return standard_response(
+        success=True,
+        message=message,
+        data=data
+    )
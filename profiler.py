@@ -0,0 +1,296 @@
+"""
+Slow-query log and query-shape profiler.
+
+Every command slower than SLOW_QUERY_MS is logged with its normalized shape: filter
+operators and field names are kept, values become "?". While the profiler is on
+(PROFILER_ENABLED, or at runtime through /api/admin/profiler) every read and write is
+also aggregated by shape. The report ranks shapes by total time, runs explain on the
+slow ones and suggests an index when the plan scans the collection or examines far
+more documents than it returns.
+
+The slowest command of each shape is kept in memory, values included, so it can be
+explained; reports only ever contain the normalized shape.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from config import settings
+from index_report import winning_stages
+from metrics import command_tracer
+from responses import dumps
+
+logger = logging.getLogger(__name__)
+
+PROFILED_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete", "insert"}
+# command keys explain needs to rebuild the query
+_EXPLAIN_KEYS = {
+    "find": ("find", "filter", "sort", "projection", "limit", "skip", "hint", "collation"),
+    "aggregate": ("aggregate", "pipeline", "cursor", "hint", "collation"),
+    "count": ("count", "query", "limit", "skip", "hint"),
+    "distinct": ("distinct", "key", "query"),
+}
+_LOGICAL = {"$and", "$or", "$nor"}
+_EQUALITY = {"$eq", "$in"}
+_RANGE = {"$gt", "$gte", "$lt", "$lte", "$regex", "$ne", "$nin", "$exists"}
+# examined/returned ratio above which a plan counts as inefficient
+EXAMINED_RATIO = 10
+
+
+def normalize(value):
+    """A filter with its values replaced by "?", keeping fields and operators"""
+    if isinstance(value, dict):
+        return {key: [normalize(v) for v in item] if key in _LOGICAL and isinstance(item, list) else normalize(item)
+                for key, item in value.items()}
+    return "?"
+
+
+def _pipeline_shape(pipeline) -> list:
+    stages = []
+    for stage in pipeline or []:
+        name = next(iter(stage), "?")
+        if name == "$match":
+            stages.append({name: normalize(stage[name])})
+        elif name in ("$sort", "$group", "$project"):
+            stages.append({name: sorted(stage[name]) if isinstance(stage[name], dict) else "?"})
+        elif name == "$lookup":
+            spec = stage[name]
+            stages.append({name: {"from": spec.get("from"), "localField": spec.get("localField"),
+                                  "foreignField": spec.get("foreignField"), "pipeline": _pipeline_shape(spec.get("pipeline"))}})
+        else:
+            stages.append(name)
+    return stages
+
+
+def query_shape(command: str, collection: str, doc) -> dict:
+    shape = {"command": command, "collection": collection}
+    if command == "find":
+        shape["filter"] = normalize(doc.get("filter") or {})
+        if doc.get("sort"):
+            shape["sort"] = dict(doc["sort"])
+        if doc.get("projection"):
+            shape["projection"] = sorted(doc["projection"])
+    elif command == "aggregate":
+        shape["pipeline"] = _pipeline_shape(doc.get("pipeline"))
+    elif command in ("count", "distinct"):
+        shape["filter"] = normalize(doc.get("query") or {})
+        if command == "distinct":
+            shape["key"] = doc.get("key")
+    elif command == "findAndModify":
+        shape["filter"] = normalize(doc.get("query") or {})
+        if doc.get("sort"):
+            shape["sort"] = dict(doc["sort"])
+    elif command in ("update", "delete"):
+        statements = doc.get("updates") or doc.get("deletes") or []
+        shape["filter"] = [normalize(s.get("q") or {}) for s in statements[:1]]
+        shape["statements"] = "many" if len(statements) > 1 else "one"
+    elif command == "insert":
+        shape["documents"] = "many" if len(doc.get("documents") or []) > 1 else "one"
+    return shape
+
+
+def _shape_key(shape: dict) -> str:
+    return json.dumps(shape, sort_keys=True, default=str)
+
+
+def suggest_index(shape: dict) -> Optional[list]:
+    """Equality fields, then sort, then range fields (the ESR rule)"""
+    query = shape.get("filter")
+    if isinstance(query, list):
+        query = query[0] if query else {}
+    if query is None and shape.get("pipeline"):
+        first = shape["pipeline"][0]
+        query = first.get("$match", {}) if isinstance(first, dict) else {}
+    equality, ranges = [], []
+    for field, condition in (query or {}).items():
+        if field.startswith("$"):
+            continue  # $or/$text etc. need their own analysis
+        operators = set(condition) if isinstance(condition, dict) else {"$eq"}
+        (equality if operators <= _EQUALITY else ranges).append(field)
+    keys = [[field, 1] for field in equality]
+    keys += [[field, direction] for field, direction in (shape.get("sort") or {}).items() if field not in equality]
+    keys += [[field, 1] for field in ranges if field not in dict(keys)]
+    return keys or None
+
+
+def _explain_target(explain: dict) -> dict:
+    """The part of an explain holding queryPlanner/executionStats; aggregate nests it under $cursor"""
+    if "queryPlanner" in explain:
+        return explain
+    for stage in explain.get("stages", []):
+        if "$cursor" in stage:
+            return stage["$cursor"]
+    return explain
+
+
+def _registry_has(collection: str, keys: list) -> bool:
+    from database import INDEXES
+    wanted = [tuple(k) for k in keys]
+    for index in INDEXES.get(collection, []):
+        declared = list(index.document["key"].items())
+        if declared[:len(wanted)] == wanted:
+            return True
+    return False
+
+
+class _ShapeStats:
+    __slots__ = ("shape", "count", "total", "max", "slow", "routes", "sample", "sample_seconds", "explain", "explained_at")
+
+    def __init__(self, shape: dict):
+        self.shape = shape
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.routes = Counter()
+        self.sample = None
+        self.sample_seconds = -1.0
+        self.explain = None
+        self.explained_at = 0.0
+
+
+class QueryProfiler:
+    def __init__(self):
+        self.enabled = settings.PROFILER_ENABLED
+        self.slow_query_ms = settings.SLOW_QUERY_MS
+        self.started_at = time.time() if self.enabled else None
+        self.dropped = 0
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: Optional[bool] = None, slow_query_ms: Optional[int] = None):
+        if enabled is not None and enabled != self.enabled:
+            self.enabled = enabled
+            self.started_at = time.time() if enabled else None
+            logger.warning("query profiler %s", "enabled" if enabled else "disabled")
+        if slow_query_ms is not None:
+            self.slow_query_ms = slow_query_ms
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+            self.dropped = 0
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "slow_query_ms": self.slow_query_ms,
+            "since": self.started_at,
+            "shapes": len(self._shapes),
+            "dropped": self.dropped,
+        }
+
+    def observe(self, command: str, collection: str, doc, seconds: float, trace):
+        """Command listener callback, runs on Motor's executor threads"""
+        if command not in PROFILED_COMMANDS:
+            return
+        slow = seconds * 1000 >= self.slow_query_ms
+        if not (self.enabled or slow):
+            return
+        shape = query_shape(command, collection, doc)
+        route = trace.route if trace is not None else None
+        if slow:
+            logger.warning("slow query", extra={"shape": shape, "duration_ms": round(seconds * 1000, 2), "route": route})
+        if self.enabled:
+            self._record(shape, command, doc, seconds, slow, route)
+
+    def _record(self, shape: dict, command: str, doc, seconds: float, slow: bool, route):
+        key = _shape_key(shape)
+        with self._lock:
+            stats = self._shapes.get(key)
+            if stats is None:
+                if len(self._shapes) >= settings.PROFILER_MAX_SHAPES:
+                    self.dropped += 1
+                    return
+                stats = self._shapes[key] = _ShapeStats(shape)
+            stats.count += 1
+            stats.total += seconds
+            stats.max = max(stats.max, seconds)
+            stats.slow += slow
+            if route:
+                stats.routes[route] += 1
+            if command in _EXPLAIN_KEYS and seconds > stats.sample_seconds:
+                stats.sample = {k: doc[k] for k in _EXPLAIN_KEYS[command] if k in doc}
+                stats.sample_seconds = seconds
+
+    async def _explain(self, db, stats: _ShapeStats):
+        if stats.sample is None or time.time() - stats.explained_at < settings.PROFILER_EXPLAIN_INTERVAL_SECONDS:
+            return
+        pipeline = stats.sample.get("pipeline") or []
+        if any("$out" in stage or "$merge" in stage for stage in pipeline):
+            return
+        stats.explained_at = time.time()
+        try:
+            explain = await db.command("explain", stats.sample, verbosity="executionStats")
+        except Exception as e:
+            stats.explain = {"error": str(e)}
+            return
+        target = _explain_target(explain)
+        execution = target.get("executionStats", {})
+        stages = winning_stages(target)
+        stats.explain = {
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+            "docs_examined": execution.get("totalDocsExamined"),
+            "keys_examined": execution.get("totalKeysExamined"),
+            "returned": execution.get("nReturned"),
+            "execution_ms": execution.get("executionTimeMillis"),
+        }
+
+    def _suggestion(self, stats: _ShapeStats) -> Optional[dict]:
+        explain = stats.explain or {}
+        examined, returned = explain.get("docs_examined"), explain.get("returned")
+        inefficient = examined is not None and examined > EXAMINED_RATIO * max(returned or 0, 1)
+        if not (explain.get("collscan") or inefficient):
+            return None
+        keys = suggest_index(stats.shape)
+        if not keys:
+            return {"reason": "no usable filter fields, consider restructuring the query"}
+        reason = "collection scan" if explain.get("collscan") else f"examines {examined} documents to return {returned}"
+        if _registry_has(stats.shape["collection"], keys):
+            reason += "; declared in database.INDEXES, run `python index_report.py --apply`"
+        return {"collection": stats.shape["collection"], "keys": keys, "reason": reason}
+
+    async def report(self, db, limit: int = 20, explain: bool = True) -> dict:
+        """Shapes ranked by total time; slow ones explained and checked for missing indexes"""
+        with self._lock:
+            ranked = sorted(self._shapes.values(), key=lambda s: s.total, reverse=True)[:limit]
+        rows = []
+        for rank, stats in enumerate(ranked, 1):
+            if explain and stats.max * 1000 >= self.slow_query_ms:
+                await self._explain(db, stats)
+            rows.append({
+                "rank": rank,
+                "shape": stats.shape,
+                "count": stats.count,
+                "total_ms": round(stats.total * 1000, 2),
+                "avg_ms": round(stats.total * 1000 / stats.count, 2),
+                "max_ms": round(stats.max * 1000, 2),
+                "slow": stats.slow,
+                "routes": dict(stats.routes.most_common(5)),
+                "explain": stats.explain,
+                "suggested_index": self._suggestion(stats),
+            })
+        report = {"generated_at": time.time(), **self.status(), "queries": rows}
+        self._write(report)
+        return report
+
+    @staticmethod
+    def _write(report: dict):
+        path = settings.PROFILER_REPORT_PATH
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(dumps(report))
+        except OSError as e:
+            logger.error("Could not write profiler report to %s: %s", path, e)
+
+
+query_profiler = QueryProfiler()
+command_tracer.observers.append(query_profiler)
@@ -0,0 +1,169 @@
+"""
+Filter and sort grammar for list endpoints.
+
+    ?status=Scheduled&doctor_id=STF_x&appointment_date__gte=2024-05-01&sort=-appointment_date
+
+`field=value` is equality, `field__op=value` applies an operator (OPERATORS), and
+`sort=field` / `sort=-field` orders by one field with _id as the tie-breaker. Only the
+fields a resource whitelists in its QuerySpec can be used, and values are parsed by the
+type of the model field (dates go through dates.to_utc, so they are clinic time unless
+an offset is given). A date field equal to a plain day (`appointment_date=2024-05-01`)
+matches that whole clinic day.
+
+Each compiled query is checked against database.INDEXES: if no index leads with one of
+the filtered fields (or with the sort field when nothing is filtered), the query is
+logged and flagged, or refused with UNINDEXED_QUERIES=reject.
+"""
+import logging
+import re
+from datetime import date, datetime
+from typing import Annotated, Iterable, List, Optional, Tuple, Type, Union, get_args, get_origin
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from config import settings
+from dates import day_bounds, to_utc
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = {
+    "eq": "$eq", "ne": "$ne", "gt": "$gt", "gte": "$gte", "lt": "$lt", "lte": "$lte",
+    "in": "$in", "nin": "$nin", "exists": "$exists", "prefix": "$regex",
+}
+EQUALITY_OPERATORS = {"eq", "in"}
+# query parameters that belong to pagination, never filters
+RESERVED = {"limit", "after", "fields", "stream", "sort"}
+MAX_IN_VALUES = 100
+DAY = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+PLAIN_DAY = "a plain day stands for its midnight here; give a time, or use field=YYYY-MM-DD or __gte/__lt for days"
+
+
+def _field_type(model: Type[BaseModel], field: str):
+    annotation = model.model_fields[field].annotation
+    if get_origin(annotation) is Union:  # Optional[X]
+        annotation = next(arg for arg in get_args(annotation) if arg is not type(None))
+    if get_origin(annotation) is Annotated:  # e.g. Optional[UTCDateTime]
+        annotation = get_args(annotation)[0]
+    return annotation
+
+
+def _parse_bool(text: str) -> bool:
+    lowered = text.lower()
+    if lowered not in ("true", "false", "1", "0"):
+        raise ValueError("expected true or false")
+    return lowered in ("true", "1")
+
+
+def _parse(kind, text: str):
+    if kind is datetime:
+        return to_utc(text)
+    if kind is bool:
+        return _parse_bool(text)
+    if kind is int:
+        return int(text)
+    if kind is float:
+        return float(text)
+    return text
+
+
+class QuerySpec:
+    """Fields a list endpoint can be filtered and sorted on"""
+
+    def __init__(self, model: Type[BaseModel], filters: Iterable[str], sorts: Iterable[str] = ()):
+        self.model = model
+        self.filters = {field: _field_type(model, field) for field in filters}
+        self.sorts = set(sorts)
+
+    def compile_filter(self, query_params: Iterable[Tuple[str, str]]) -> Tuple[dict, List[str], List[str]]:
+        """Mongo filter from (name, value) pairs, plus the fields used by equality and by range conditions"""
+        query, equality, ranges, errors = {}, [], [], []
+        for name, text in query_params:
+            if name in RESERVED:
+                continue
+            field, _, op = name.partition("__")
+            op = op or "eq"
+            if field not in self.filters:
+                errors.append(f"'{field}' is not filterable")
+                continue
+            if op not in OPERATORS:
+                errors.append(f"unknown operator '{op}' on {field}")
+                continue
+            try:
+                condition = self._condition(self.filters[field], op, text)
+            except (TypeError, ValueError) as e:
+                errors.append(f"{name}: {e}")
+                continue
+            query.setdefault(field, {}).update(condition)
+            (equality if op in EQUALITY_OPERATORS else ranges).append(field)
+
+        if errors:
+            allowed = ", ".join(sorted(self.filters))
+            raise HTTPException(status_code=400, detail=f"Invalid filter: {'; '.join(errors)} (filterable: {allowed})")
+        # {"$eq": x} alone reads better and plans the same as x
+        query = {f: c["$eq"] if list(c) == ["$eq"] else c for f, c in query.items()}
+        return query, equality, ranges
+
+    @staticmethod
+    def _condition(kind, op: str, text: str) -> dict:
+        if op in ("in", "nin"):
+            values = [value for value in text.split(",") if value != ""]
+            if kind is datetime and any(DAY.match(value) for value in values):
+                raise ValueError(PLAIN_DAY)
+            values = [_parse(kind, value) for value in values]
+            if len(values) > MAX_IN_VALUES:
+                raise ValueError(f"at most {MAX_IN_VALUES} values")
+            return {OPERATORS[op]: values}
+        if op == "exists":
+            return {"$exists": _parse_bool(text)}
+        if op == "prefix":
+            if kind is not str:
+                raise ValueError("prefix only applies to text fields")
+            return {"$regex": f"^{re.escape(text)}"}
+        if kind is datetime and DAY.match(text):
+            if op == "eq":
+                start, end = day_bounds(date.fromisoformat(text))
+                return {"$gte": start, "$lt": end}
+            if op == "ne":
+                raise ValueError(PLAIN_DAY)
+        return {OPERATORS[op]: _parse(kind, text)}
+
+    def compile_sort(self, sort: Optional[str]) -> Optional[Tuple[str, int]]:
+        if not sort:
+            return None
+        field, direction = (sort[1:], -1) if sort.startswith("-") else (sort.lstrip("+"), 1)
+        if field not in self.sorts:
+            allowed = ", ".join(sorted(self.sorts)) or "none"
+            raise HTTPException(status_code=400, detail=f"Cannot sort by '{field}' (sortable: {allowed})")
+        return field, direction
+
+
+def _leading_keys(collection_name: str) -> set:
+    from database import INDEXES
+    leading = {"_id"}
+    for index in INDEXES.get(collection_name, []):
+        field, kind = next(iter(index.document["key"].items()))
+        if kind != "text":  # a text index only serves $text
+            leading.add(field)
+    return leading
+
+
+def check_indexed(collection_name: str, equality: List[str], ranges: List[str], sort: Optional[Tuple[str, int]]) -> Optional[str]:
+    """None when an index can drive the query, otherwise a warning; raises under UNINDEXED_QUERIES=reject"""
+    leading = _leading_keys(collection_name)
+    used = equality + ranges
+    if used:
+        indexed = any(field in leading for field in used)
+    else:
+        indexed = sort is None or sort[0] in leading
+    if indexed:
+        return None
+
+    fields = ", ".join(used) if used else f"sort by {sort[0]}"
+    message = f"No index on {collection_name} for {fields}; add an indexed filter ({', '.join(sorted(leading))})"
+    if settings.UNINDEXED_QUERIES == "reject":
+        raise HTTPException(status_code=400, detail=message)
+    if settings.UNINDEXED_QUERIES == "warn":
+        logger.warning("unindexed list query", extra={"collection": collection_name, "fields": used, "sort": sort and sort[0]})
+        return message
+    return None
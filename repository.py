@@ -0,0 +1,372 @@
+from datetime import datetime
+from typing import Awaitable, Callable, Generic, List, Optional, Sequence, Tuple, Type, TypeVar
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from config import settings
+from dates import bson_precision
+from utils import generate_unique_id, generate_unique_ids
+
+T = TypeVar("T", bound=BaseModel)
+
+# Called after writes with (before, after) document pairs, None on create/delete
+Change = Tuple[Optional[dict], Optional[dict]]
+WriteHook = Callable[[object, str, List[Change]], Awaitable[None]]
+# Called before a write with its (before, after) pair, True if it claimed something; raises HTTPException to refuse it
+Reservation = Callable[[object, Optional[dict], dict], Awaitable[bool]]
+Release = Callable[[object, Optional[dict], dict], Awaitable[None]]
+# Called before a write with the documents and $set data about to go out, may add fields to them
+Preparation = Callable[[object, List[dict]], Awaitable[None]]
+
+BULK_OPS = ("insert", "update", "upsert", "delete")
+
+
+def validation_message(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors())
+    return str(error)
+
+
+class Repository(Generic[T]):
+    """
+    Data access for one collection keyed by a business ID (patient_id, bill_id, ...).
+
+    Every write costs a single round trip: creates return the document built locally,
+    updates and deletes get the document back from find_one_and_update/_delete.
+    Bulk calls go out as one insert_many/bulk_write and one batch of hook updates.
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        id_field: str,
+        id_prefix: str,
+        model: Type[T],
+        not_found: str,
+        create_schema: Optional[Type[BaseModel]] = None,
+        update_schema: Optional[Type[BaseModel]] = None,
+        create_defaults: Optional[Callable[[], dict]] = None,
+        projection: Optional[dict] = None,
+        hooks: Sequence[WriteHook] = (),
+        derive: Optional[Callable[[dict], dict]] = None,
+        prepare: Optional[Preparation] = None,
+        reserve: Optional[Reservation] = None,
+        release: Optional[Release] = None,
+    ):
+        self.collection_name = collection_name
+        self.id_field = id_field
+        self.id_prefix = id_prefix
+        self.model = model
+        self.not_found = not_found
+        self.create_schema = create_schema
+        self.update_schema = update_schema
+        self.create_defaults = create_defaults
+        self.projection = projection  # applied to documents returned by reads and updates
+        self.hooks = list(hooks)
+        self.derive = derive  # computes stored-only fields (e.g. search keys) from the fields being written
+        self.prepare = prepare  # same for stored-only fields that need a lookup, one call per write or batch
+        # claims bulk writes take before writing (e.g. doctor slots), released again if the write fails
+        self.reserve = reserve
+        self.release = release
+
+    def collection(self, db):
+        return db[self.collection_name]
+
+    async def _run_hooks(self, db, changes: List[Change]):
+        if not changes:
+            return
+        for hook in self.hooks:
+            await hook(db, self.collection_name, changes)
+
+    def _with_derived(self, data: dict) -> dict:
+        return {**data, **self.derive(data)} if self.derive else data
+
+    async def _prepare(self, db, items: List[dict]):
+        if self.prepare and items:
+            await self.prepare(db, items)
+
+    def _project(self, doc: dict) -> dict:
+        """Apply an exclusion projection to a document we already hold"""
+        if not self.projection:
+            return doc
+        return {k: v for k, v in doc.items() if self.projection.get(k, 1)}
+
+    def build(self, data: dict, business_id: Optional[str] = None) -> dict:
+        """Turn `data` into a document ready to insert, model defaults included"""
+        fields = dict(self.create_defaults()) if self.create_defaults else {}
+        fields.update(data)
+        fields[self.id_field] = business_id or generate_unique_id(self.id_prefix)
+        if self.create_schema:
+            # callers pass data already validated by create_schema, only fill in the model defaults
+            model = self.model.model_construct(**fields)
+        else:
+            model = self.model(**fields)
+        doc = self._with_derived(model.model_dump(by_alias=True))
+        # the model serializes ids to str, store a real ObjectId
+        doc["_id"] = ObjectId()
+        # defaults like created_at come with microseconds, the stored copy has milliseconds
+        for key, value in doc.items():
+            if isinstance(value, datetime):
+                doc[key] = bson_precision(value)
+        return doc
+
+    async def get(self, db, business_id: str) -> dict:
+        doc = await self.collection(db).find_one({self.id_field: business_id}, self.projection)
+        if doc is None:
+            raise HTTPException(status_code=404, detail=self.not_found)
+        return doc
+
+    async def get_many(self, db, business_ids: List[str]) -> List[dict]:
+        """Fetch several documents in one $in query, missing IDs are simply absent"""
+        if not business_ids:
+            return []
+        query = {self.id_field: {"$in": list(business_ids)}}
+        return await self.collection(db).find(query, self.projection).to_list(length=None)
+
+    async def create(self, db, data: dict) -> dict:
+        return await self.insert(db, self.build(data))
+
+    async def insert(self, db, doc: dict) -> dict:
+        """Insert a document from build(), for callers that need its ID before writing"""
+        await self._prepare(db, [doc])
+        await self.collection(db).insert_one(doc)
+        await self._run_hooks(db, [(None, doc)])
+        return self._project(doc)
+
+    async def update(self, db, business_id: str, data: dict) -> dict:
+        if not data:
+            return await self.get(db, business_id)
+        data = dict(self._with_derived(data))
+        await self._prepare(db, [data])
+
+        if self.hooks:
+            # hooks need both versions: fetch the old one and apply the $set locally
+            before = await self.collection(db).find_one_and_update(
+                {self.id_field: business_id}, {"$set": data}, return_document=ReturnDocument.BEFORE
+            )
+            if before is None:
+                raise HTTPException(status_code=404, detail=self.not_found)
+            after = {**before, **data}
+            await self._run_hooks(db, [(before, after)])
+            return self._project(after)
+
+        after = await self.collection(db).find_one_and_update(
+            {self.id_field: business_id}, {"$set": data},
+            projection=self.projection, return_document=ReturnDocument.AFTER
+        )
+        if after is None:
+            raise HTTPException(status_code=404, detail=self.not_found)
+        return after
+
+    async def delete(self, db, business_id: str) -> dict:
+        before = await self.collection(db).find_one_and_delete({self.id_field: business_id})
+        if before is None:
+            raise HTTPException(status_code=404, detail=self.not_found)
+        await self._run_hooks(db, [(before, None)])
+        return before
+
+    async def _reserve_all(self, db, changes: List[Optional[Change]], ordered: bool) -> Tuple[List[bool], dict]:
+        """Reserve for every (before, after) pair, returns (claimed flags, refusals by position)"""
+        claimed = [False] * len(changes)
+        refused = {}
+        if not self.reserve:
+            return claimed, refused
+        try:
+            for position, change in enumerate(changes):
+                if change is None:
+                    continue
+                try:
+                    claimed[position] = await self.reserve(db, *change)
+                except HTTPException as e:
+                    refused[position] = str(e.detail)
+                    if ordered:
+                        break
+        except Exception:
+            await self._release_all(db, changes, claimed, range(len(changes)))
+            raise
+        return claimed, refused
+
+    async def _release_all(self, db, changes: List[Optional[Change]], claimed: List[bool], positions):
+        for position in positions:
+            if claimed[position] and self.release:
+                await self.release(db, *changes[position])
+
+    async def insert_many(self, db, items: List[dict], ordered: bool = False) -> Tuple[List[dict], List[dict]]:
+        """Insert already validated items, returns (inserted documents, errors by index)"""
+        ids = generate_unique_ids(self.id_prefix, len(items))
+        docs = [self.build(item, business_id=business_id) for item, business_id in zip(items, ids)]
+        if not docs:
+            return [], []
+        await self._prepare(db, docs)
+
+        changes = [(None, doc) for doc in docs]
+        claimed, failed = await self._reserve_all(db, changes, ordered)
+        if ordered and failed:
+            await self._release_all(db, changes, claimed, range(len(docs)))
+            failed.update({i: "not attempted, an earlier document failed" for i in range(min(failed) + 1, len(docs))})
+            return [], [{"index": i, "error": message} for i, message in sorted(failed.items())]
+        positions = [i for i in range(len(docs)) if i not in failed]
+
+        if positions:
+            try:
+                await self.collection(db).insert_many([docs[i] for i in positions], ordered=ordered)
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors", [])
+                failed.update({positions[err["index"]]: err.get("errmsg", "write error") for err in write_errors})
+                if ordered and write_errors:
+                    # an ordered insert stops at the first error
+                    first = min(err["index"] for err in write_errors)
+                    failed.update({i: "not attempted, an earlier document failed" for i in positions[first + 1:]})
+            await self._release_all(db, changes, claimed, [i for i in positions if i in failed])
+
+        inserted = [doc for i, doc in enumerate(docs) if i not in failed]
+        await self._run_hooks(db, [(None, doc) for doc in inserted])
+        return inserted, [{"index": i, "error": message} for i, message in sorted(failed.items())]
+
+    def _validate_operation(self, operation) -> dict:
+        if operation.op not in BULK_OPS:
+            raise ValueError(f"Unknown op '{operation.op}', expected one of {', '.join(BULK_OPS)}")
+        if operation.op != "insert" and not operation.id:
+            raise ValueError(f"'{operation.op}' needs an id")
+        if operation.op == "delete":
+            return {}
+        if operation.data is None:
+            raise ValueError(f"'{operation.op}' needs data")
+        if operation.op == "update":
+            schema = self.update_schema
+            validated = schema(**operation.data).model_dump(exclude_none=True) if schema else operation.data
+            if not validated:
+                raise ValueError("'update' needs at least one field")
+            return validated
+        schema = self.create_schema
+        return schema(**operation.data).model_dump() if schema else operation.data
+
+    async def bulk_write(self, db, operations: list, ordered: bool = False) -> dict:
+        """
+        Apply a mix of insert/update/upsert/delete operations in one bulk_write.
+
+        Ordered batches are rejected up front if any operation is invalid; unordered
+        batches skip invalid operations and report them next to the write errors. Each
+        document can be the target of one operation per batch.
+        """
+        if len(operations) > settings.BULK_MAX_OPERATIONS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"At most {settings.BULK_MAX_OPERATIONS} operations per bulk request"
+            )
+
+        errors = []
+        planned = []  # (request index, operation, validated data)
+        targeted = set()
+        for index, operation in enumerate(operations):
+            try:
+                data = self._validate_operation(operation)
+                if operation.op != "insert":
+                    # hooks diff every operation against the document as it was before the batch
+                    if operation.id in targeted:
+                        raise ValueError(f"'{operation.id}' is already written by an earlier operation in this batch")
+                    targeted.add(operation.id)
+                planned.append((index, operation, data))
+            except (ValidationError, ValueError) as e:
+                errors.append({"index": index, "error": validation_message(e)})
+        if ordered and errors:
+            raise HTTPException(status_code=422, detail={"message": "Invalid bulk operations", "errors": errors})
+
+        # previous versions of every touched document, for the write hooks and reservations
+        before_by_id = {}
+        if self.hooks or self.reserve:
+            touched = [op.id for _, op, _ in planned if op.op != "insert"]
+            before_by_id = {doc[self.id_field]: doc for doc in await self.get_many(db, touched)}
+
+        built = []  # documents a successful request would insert, by request position
+        for position, (index, operation, data) in enumerate(planned):
+            if operation.op in ("update", "upsert"):
+                data = self._with_derived(data)
+                planned[position] = (index, operation, data)
+            if operation.op == "insert":
+                built.append(self.build(data))
+            elif operation.op == "upsert":
+                built.append(self.build(data, business_id=operation.id))
+            else:
+                built.append(None)
+        await self._prepare(db, [doc for doc in built if doc is not None]
+                            + [data for _, operation, data in planned if operation.op in ("update", "upsert")])
+
+        requests = []
+        expected = []  # (before, after) a successful request would make, None for deletes and unknown ids
+        for position, (index, operation, data) in enumerate(planned):
+            before = before_by_id.get(operation.id) if operation.op != "insert" else None
+            doc = built[position]
+            if operation.op == "insert":
+                requests.append(InsertOne(doc))
+                expected.append((None, doc))
+            elif operation.op == "update":
+                requests.append(UpdateOne({self.id_field: operation.id}, {"$set": data}))
+                expected.append((before, {**before, **data}) if before is not None else None)
+            elif operation.op == "upsert":
+                on_insert = {k: v for k, v in doc.items() if k not in data and k != self.id_field}
+                requests.append(UpdateOne(
+                    {self.id_field: operation.id}, {"$set": data, "$setOnInsert": on_insert}, upsert=True
+                ))
+                expected.append((before, {**before, **data}) if before is not None else (None, doc))
+            else:
+                requests.append(DeleteOne({self.id_field: operation.id}))
+                expected.append(None)
+
+        claimed, refused = await self._reserve_all(db, expected, ordered)
+        if refused:
+            for position, message in refused.items():
+                errors.append({"index": planned[position][0], "error": message})
+            if ordered:
+                await self._release_all(db, expected, claimed, range(len(requests)))
+                raise HTTPException(status_code=409, detail={"message": "Conflicting bulk operations", "errors": errors})
+            kept = [position for position in range(len(requests)) if position not in refused]
+            planned, requests, built, expected, claimed = (
+                [items[position] for position in kept] for items in (planned, requests, built, expected, claimed)
+            )
+
+        result = {"inserted": 0, "matched": 0, "modified": 0, "upserted": 0, "deleted": 0}
+        failed = set()
+        if requests:
+            try:
+                write = await self.collection(db).bulk_write(requests, ordered=ordered)
+                details = write.bulk_api_result
+            except BulkWriteError as e:
+                details = e.details
+            for err in details.get("writeErrors", []):
+                failed.add(err["index"])
+                errors.append({"index": planned[err["index"]][0], "error": err.get("errmsg", "write error")})
+            if ordered and failed:
+                failed.update(range(min(failed) + 1, len(requests)))
+            await self._release_all(db, expected, claimed, sorted(failed))
+            result.update({
+                "inserted": details.get("nInserted", 0),
+                "matched": details.get("nMatched", 0),
+                "modified": details.get("nModified", 0),
+                "upserted": details.get("nUpserted", 0),
+                "deleted": details.get("nRemoved", 0),
+            })
+
+        if self.hooks:
+            changes = []
+            for position, (_, operation, data) in enumerate(planned):
+                if position in failed:
+                    continue
+                before = before_by_id.get(operation.id) if operation.op != "insert" else None
+                if operation.op == "insert":
+                    changes.append((None, built[position]))
+                elif operation.op == "delete":
+                    if before is not None:
+                        changes.append((before, None))
+                elif before is not None:
+                    changes.append((before, {**before, **data}))
+                elif operation.op == "upsert":
+                    changes.append((None, built[position]))
+            await self._run_hooks(db, changes)
+
+        result["errors"] = sorted(errors, key=lambda e: e["index"])
+        return result
@@ -0,0 +1,42 @@
+"""
+Fast JSON responses for data that comes straight from the database.
+
+Returning a StandardResponse makes FastAPI validate it against `response_model` and
+walk it through jsonable_encoder before json.dumps. Documents read from Mongo are
+already trusted, so `standard_response` builds the same envelope as a plain dict and
+encodes it once with orjson. `response_model=StandardResponse` stays on the routes for
+the OpenAPI schema; FastAPI skips it for Response objects.
+"""
+from typing import Any, Optional
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+# aware datetimes are encoded natively by orjson, in whatever zone they carry;
+# serialize_document has already moved them to clinic time
+_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """BSON-aware JSON encoding, ObjectId as hex"""
+    return orjson.dumps(content, default=_default, option=_OPTIONS)
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def standard_response(message: str, data: Optional[dict] = None, success: bool = True, status_code: int = 200) -> ORJSONResponse:
+    """A StandardResponse envelope without re-validating `data`"""
+    return ORJSONResponse(
+        status_code=status_code,
+        content={"success": success, "message": message, "data": data},
+    )
@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends, Query
+from schemas import ProfilerSettings, StandardResponse
+from responses import standard_response
+from database import get_db
+from auth import require_admin
+from profiler import query_profiler
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("/profiler", response_model=StandardResponse)
+async def get_profiler():
+    return standard_response(
+        success=True,
+        message="Query profiler status",
+        data=query_profiler.status()
+    )
+
+@router.put("/profiler", response_model=StandardResponse)
+async def configure_profiler(profiler_settings: ProfilerSettings):
+    query_profiler.configure(enabled=profiler_settings.enabled, slow_query_ms=profiler_settings.slow_query_ms)
+    
+    return standard_response(
+        success=True,
+        message="Query profiler updated",
+        data=query_profiler.status()
+    )
+
+@router.delete("/profiler", response_model=StandardResponse)
+async def reset_profiler():
+    query_profiler.reset()
+    
+    return standard_response(
+        success=True,
+        message="Query profiler reset",
+        data=query_profiler.status()
+    )
+
+@router.get("/profiler/report", response_model=StandardResponse)
+async def get_profiler_report(
+    limit: int = Query(20, ge=1, le=200),
+    explain: bool = True,
+    db=Depends(get_db),
+):
+    report = await query_profiler.report(db, limit=limit, explain=explain)
+    
+    return standard_response(
+        success=True,
+        message="Query profiler report",
+        data=report
+    )
@@ -1,38 +1,83 @@
-from fastapi import APIRouter, HTTPException, Depends
+from datetime import date
+from fastapi import APIRouter, Depends, Query
 from models import Appointment
-from schemas import AppointmentCreate, AppointmentUpdate, StandardResponse
-from database import db, serialize_document, get_db
-from utils import generate_unique_id
+from schemas import AppointmentCreate, AppointmentUpdate, StandardResponse, BulkRequest
+from responses import standard_response
+from database import serialize_document, get_db
+from pagination import ListParams, paginate
+from query import QuerySpec
+from repository import Repository
+from cache import invalidation_hook
+from stats import apply_changes
+from events import publish_changes
+from scheduling import availability, reserve, release, reserve_change, release_change, sync_schedules
+from billing_reports import reattribute_bills
 
 router = APIRouter()
 
+appointments_repository = Repository(
+    "appointments", "appointment_id", "APT", Appointment, "Appointment not found",
+    create_schema=AppointmentCreate, update_schema=AppointmentUpdate,
+    hooks=[apply_changes, sync_schedules, reattribute_bills, invalidation_hook("appointment_id"), publish_changes],
+    reserve=reserve_change, release=release_change,
+)
+
+appointments_query = QuerySpec(
+    Appointment,
+    filters=["appointment_id", "patient_id", "doctor_id", "status", "appointment_date", "room_number"],
+    sorts=["appointment_date"],
+)
+
 @router.post("/", response_model=StandardResponse)
 async def create_appointment(appointment: AppointmentCreate, db=Depends(get_db)):
-    appointment_id = generate_unique_id("APT")
-    new_appointment = Appointment(
-        appointment_id=appointment_id,
-        **appointment.dict()
-    )
+    new_appointment = appointments_repository.build(appointment.dict())
     
-    result = await db.appointments.insert_one(new_appointment.dict(by_alias=True))
-    
-    created_appointment = await db.appointments.find_one({"_id": result.inserted_id})
+    # hold the doctor's slots first, a clash is a 409 and nothing is written
+    await reserve(db, new_appointment)
+    try:
+        created_appointment = await appointments_repository.insert(db, new_appointment)
+    except Exception:
+        await release(db, new_appointment)
+        raise
     serialized_appointment = serialize_document(created_appointment)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Appointment created successfully",
         data=serialized_appointment
     )
 
+@router.get("/availability", response_model=StandardResponse)
+async def get_availability(
+    doctor_id: str,
+    date_from: date = Query(..., alias="from"),
+    date_to: date = Query(..., alias="to"),
+    db=Depends(get_db)
+):
+    doctor_availability = await availability(db, doctor_id, date_from, date_to)
+    
+    return standard_response(
+        success=True,
+        message="Availability retrieved successfully",
+        data=doctor_availability
+    )
+
+@router.post("/bulk", response_model=StandardResponse)
+async def bulk_appointments(bulk_request: BulkRequest, db=Depends(get_db)):
+    result = await appointments_repository.bulk_write(db, bulk_request.operations, ordered=bulk_request.ordered)
+    
+    return standard_response(
+        success=not result["errors"],
+        message="Bulk appointments operations completed" if not result["errors"] else "Bulk appointments operations completed with errors",
+        data=result
+    )
+
 @router.get("/{appointment_id}", response_model=StandardResponse)
 async def get_appointment(appointment_id: str, db=Depends(get_db)):
-    appointment = await db.appointments.find_one({"appointment_id": appointment_id})
-    if not appointment:
-        raise HTTPException(status_code=404, detail="Appointment not found")
+    appointment = await appointments_repository.get(db, appointment_id)
     
     serialized_appointment = serialize_document(appointment)
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Appointment retrieved successfully",
         data=serialized_appointment
@@ -42,18 +87,18 @@ async def get_appointment(appointment_id: str, db=Depends(get_db)):
 async def update_appointment(appointment_id: str, appointment_update: AppointmentUpdate, db=Depends(get_db)):
     update_data = {k: v for k, v in appointment_update.dict().items() if v is not None}
     
-    result = await db.appointments.update_one(
-        {"appointment_id": appointment_id},
-        {"$set": update_data}
-    )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Appointment not found")
-    
-    updated_appointment = await db.appointments.find_one({"appointment_id": appointment_id})
+    current_appointment = await appointments_repository.get(db, appointment_id)
+    moved_appointment = {**current_appointment, **update_data}
+    reserved = await reserve_change(db, current_appointment, moved_appointment)
+    try:
+        updated_appointment = await appointments_repository.update(db, appointment_id, update_data)
+    except Exception:
+        if reserved:
+            await release_change(db, current_appointment, moved_appointment)
+        raise
     serialized_appointment = serialize_document(updated_appointment)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Appointment updated successfully",
         data=serialized_appointment
@@ -61,25 +106,14 @@ async def update_appointment(appointment_id: str, appointment_update: Appointmen
 
 @router.delete("/{appointment_id}", response_model=StandardResponse)
 async def delete_appointment(appointment_id: str, db=Depends(get_db)):
-    result = await db.appointments.delete_one({"appointment_id": appointment_id})
-    
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Appointment not found")
+    await appointments_repository.delete(db, appointment_id)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Appointment deleted successfully",
         data=None
     )
 
 @router.get("/", response_model=StandardResponse)
-async def get_all_appointments(db=Depends(get_db)):
-    appointments = []
-    async for appointment in db.appointments.find():
-        appointments.append(serialize_document(appointment))
-    
-    return StandardResponse(
-        success=True,
-        message="Appointments retrieved successfully",
-        data={"appointments": appointments}
-    )
\ No newline at end of file
+async def get_all_appointments(params: ListParams = Depends(), db=Depends(get_db)):
+    return await paginate(db.appointments, "appointments", Appointment, params, "Appointments retrieved successfully", spec=appointments_query)
\ No newline at end of file
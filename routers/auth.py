@@ -3,10 +3,10 @@ from fastapi.security import HTTPBearer
 from datetime import timedelta
 from models import User
 from schemas import RegisterRequest, LoginRequest, StandardResponse, Token
-from auth import authenticate_user, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user
+from auth import authenticate_user, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, user_claims
 from database import get_db
 from utils import generate_unique_id
-from auth import get_password_hash
+from auth import get_password_hash_async
 from config import settings
 
 router = APIRouter()
@@ -23,7 +23,7 @@ async def login(login_request: LoginRequest):
     
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data=user_claims(user), expires_delta=access_token_expires
     )
     
     return StandardResponse(
@@ -51,7 +51,7 @@ async def register(register_request: RegisterRequest, db=Depends(get_db)):
         email=register_request.email,
         phone=register_request.phone,
         role="admin",  # You might want to change this to a default role like "user"
-        password=get_password_hash(register_request.password)
+        password=await get_password_hash_async(register_request.password)
     )
     
     result = await db.users.insert_one(user.dict(by_alias=True))
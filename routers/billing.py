@@ -1,38 +1,76 @@
-from fastapi import APIRouter, HTTPException, Depends
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
 from models import Billing
-from schemas import BillingCreate, BillingUpdate, StandardResponse
-from database import db, serialize_document, get_db
-from utils import generate_unique_id
+from schemas import BillingCreate, BillingUpdate, StandardResponse, BulkRequest
+from responses import standard_response
+from database import serialize_document, get_db
+from pagination import ListParams, paginate
+from query import QuerySpec
+from repository import Repository
+from cache import invalidation_hook
+from stats import apply_changes
+from events import publish_changes
+from billing_reports import ATTRIBUTION_FIELD, attribute_bills, build_report, report_range, update_rollups
 
 router = APIRouter()
 
+billing_repository = Repository(
+    "billing", "bill_id", "BILL", Billing, "Billing record not found",
+    create_schema=BillingCreate, update_schema=BillingUpdate,
+    projection={ATTRIBUTION_FIELD: 0}, prepare=attribute_bills,
+    hooks=[apply_changes, update_rollups, invalidation_hook("bill_id"), publish_changes],
+)
+
+billing_query = QuerySpec(
+    Billing,
+    filters=["bill_id", "patient_id", "appointment_id", "payment_status", "payment_method", "billing_date", "total_amount"],
+    sorts=["billing_date", "total_amount"],
+)
+
 @router.post("/", response_model=StandardResponse)
 async def create_billing(billing: BillingCreate, db=Depends(get_db)):
-    bill_id = generate_unique_id("BILL")
-    new_billing = Billing(
-        bill_id=bill_id,
-        **billing.dict()
-    )
-    
-    result = await db.billing.insert_one(new_billing.dict(by_alias=True))
-    
-    created_billing = await db.billing.find_one({"_id": result.inserted_id})
+    created_billing = await billing_repository.create(db, billing.dict())
     serialized_billing = serialize_document(created_billing)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Billing record created successfully",
         data=serialized_billing
     )
 
+@router.post("/bulk", response_model=StandardResponse)
+async def bulk_billing(bulk_request: BulkRequest, db=Depends(get_db)):
+    result = await billing_repository.bulk_write(db, bulk_request.operations, ordered=bulk_request.ordered)
+    
+    return standard_response(
+        success=not result["errors"],
+        message="Bulk billing records operations completed" if not result["errors"] else "Bulk billing records operations completed with errors",
+        data=result
+    )
+
+@router.get("/reports", response_model=StandardResponse)
+async def get_billing_reports(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    granularity: str = Query("day", pattern="^(day|week|month)$"),
+    db=Depends(get_db)
+):
+    date_from, date_to = report_range(date_from, date_to)
+    report = await build_report(db, date_from, date_to, granularity)
+    
+    return standard_response(
+        success=True,
+        message="Billing report generated successfully",
+        data=report
+    )
+
 @router.get("/{bill_id}", response_model=StandardResponse)
 async def get_billing(bill_id: str, db=Depends(get_db)):
-    billing = await db.billing.find_one({"bill_id": bill_id})
-    if not billing:
-        raise HTTPException(status_code=404, detail="Billing record not found")
+    billing = await billing_repository.get(db, bill_id)
     
     serialized_billing = serialize_document(billing)
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Billing record retrieved successfully",
         data=serialized_billing
@@ -42,18 +80,10 @@ async def get_billing(bill_id: str, db=Depends(get_db)):
 async def update_billing(bill_id: str, billing_update: BillingUpdate, db=Depends(get_db)):
     update_data = {k: v for k, v in billing_update.dict().items() if v is not None}
     
-    result = await db.billing.update_one(
-        {"bill_id": bill_id},
-        {"$set": update_data}
-    )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Billing record not found")
-    
-    updated_billing = await db.billing.find_one({"bill_id": bill_id})
+    updated_billing = await billing_repository.update(db, bill_id, update_data)
     serialized_billing = serialize_document(updated_billing)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Billing record updated successfully",
         data=serialized_billing
@@ -61,25 +91,17 @@ async def update_billing(bill_id: str, billing_update: BillingUpdate, db=Depends
 
 @router.delete("/{bill_id}", response_model=StandardResponse)
 async def delete_billing(bill_id: str, db=Depends(get_db)):
-    result = await db.billing.delete_one({"bill_id": bill_id})
-    
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Billing record not found")
+    await billing_repository.delete(db, bill_id)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Billing record deleted successfully",
         data=None
     )
 
 @router.get("/", response_model=StandardResponse)
-async def get_all_billing(db=Depends(get_db)):
-    billing = []
-    async for bill in db.billing.find():
-        billing.append(serialize_document(bill))
-    
-    return StandardResponse(
-        success=True,
-        message="Billing records retrieved successfully",
-        data={"billing": billing}
+async def get_all_billing(params: ListParams = Depends(), db=Depends(get_db)):
+    return await paginate(
+        db.billing, "billing", Billing, params, "Billing records retrieved successfully",
+        default_projection=billing_repository.projection, spec=billing_query,
     )
\ No newline at end of file
@@ -1,137 +1,148 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Request
 from datetime import datetime, timedelta
 from database import get_db
+from dates import clinic_time, day_bounds, local_date
 from auth import get_current_user
 from schemas import StandardResponse
+from responses import standard_response
+from cache import cached_response, dashboard_key
+import stats
 
 router = APIRouter()
 
-@router.get("/", response_model=StandardResponse)
-async def get_dashboard_data(current_user: dict = Depends(get_current_user), db=Depends(get_db)):
-    """Get comprehensive dashboard data"""
-    
+
+def _format_time(appointment: dict) -> str:
+    appointment_date = appointment.get("appointment_date")
+    if isinstance(appointment_date, datetime):
+        time = clinic_time(appointment_date)
+    elif appointment_date and "T" in appointment_date:
+        time = appointment_date.split('T')[1][:5]
+    else:
+        time = (appointment.get("appointment_time") or "")[:5]
+    if not time:
+        return ""
+    return time + " " + ("AM" if int(time[:2]) < 12 else "PM")
+
+
+async def _today_appointments(db, today):
+    """Today's first appointments with patient and doctor names joined in"""
+    start, end = day_bounds(today)
+    pipeline = [
+        {"$match": {"$or": [
+            {"appointment_date": {"$gte": start, "$lt": end}},
+            # documents not yet converted by migrate_dates.py
+            {"appointment_date": {"$gte": today.isoformat(), "$lte": today.isoformat() + "T23:59:59"}},
+        ]}},
+        {"$sort": {"appointment_date": 1}},
+        {"$limit": 4},
+        {"$lookup": {"from": "patients", "localField": "patient_id", "foreignField": "patient_id", "as": "patient"}},
+        {"$lookup": {"from": "staff", "localField": "doctor_id", "foreignField": "staff_id", "as": "doctor"}},
+        {"$project": {
+            "_id": 0,
+            "appointment_date": 1,
+            "appointment_time": 1,
+            "status": 1,
+            "patient_name": {"$arrayElemAt": ["$patient.full_name", 0]},
+            "doctor_name": {"$arrayElemAt": ["$doctor.full_name", 0]},
+        }},
+    ]
+    return await db.appointments.aggregate(pipeline).to_list(length=4)
+
+
+async def _recent_patients(db):
+    """Last 3 patients with their latest visit joined in"""
+    pipeline = [
+        {"$sort": {"created_at": -1}},
+        {"$limit": 3},
+        {"$lookup": {
+            "from": "medical_records",
+            "let": {"patient_id": "$patient_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$patient_id", "$$patient_id"]}}},
+                {"$sort": {"visit_date": -1}},
+                {"$limit": 1},
+                {"$project": {"_id": 0, "visit_date": 1}},
+            ],
+            "as": "last_visit",
+        }},
+        {"$project": {"_id": 0, "full_name": 1, "contact_number": 1, "last_visit": 1}},
+    ]
+    return await db.patients.aggregate(pipeline).to_list(length=3)
+
+
+async def _render_dashboard(db):
     try:
         # Get today's date
-        today = datetime.now().date()
-        start_of_today = datetime.combine(today, datetime.min.time())
-        end_of_today = datetime.combine(today, datetime.max.time())
-        
+        today = stats.today()
+
         # Calculate dates for comparison
         yesterday = today - timedelta(days=1)
-        start_of_yesterday = datetime.combine(yesterday, datetime.min.time())
-        end_of_yesterday = datetime.combine(yesterday, datetime.max.time())
-        
         last_month = today.replace(day=1) - timedelta(days=1)
-        start_of_last_month = datetime.combine(last_month.replace(day=1), datetime.min.time())
-        end_of_last_month = datetime.combine(last_month.replace(day=last_month.day), datetime.max.time())
-        
-        # Total Patients
-        total_patients = await db.patients.count_documents({})
-        
-        # Patients from last month (for comparison)
-        patients_last_month = await db.patients.count_documents({
-            "created_at": {"$gte": start_of_last_month, "$lte": end_of_last_month}
-        })
-        
-        # Appointments Today
-        appointments_today = await db.appointments.count_documents({
-            "appointment_date": {"$gte": start_of_today.isoformat(), "$lte": end_of_today.isoformat()}
-        })
-        
-        # Appointments Yesterday (for comparison)
-        appointments_yesterday = await db.appointments.count_documents({
-            "appointment_date": {"$gte": start_of_yesterday.isoformat(), "$lte": end_of_yesterday.isoformat()}
-        })
-        
-        # Staff Members
-        staff_members = await db.staff.count_documents({})
-        
-        # Staff this month (for comparison)
-        staff_this_month = await db.staff.count_documents({
-            "hire_date": {"$gte": start_of_today.isoformat()}
-        })
-        
-        # Total Revenue
-        # Sum all paid amounts from billing records
-        total_revenue_cursor = db.billing.aggregate([
-            {"$match": {"payment_status": "Paid"}},
-            {"$group": {"_id": None, "total": {"$sum": "$paid_amount"}}}
-        ])
-        total_revenue_result = await total_revenue_cursor.to_list(length=1)
-        total_revenue = total_revenue_result[0]["total"] if total_revenue_result else 0.0
-        
-        # Revenue from last month (for comparison)
-        revenue_last_month_cursor = db.billing.aggregate([
-            {"$match": {
-                "payment_status": "Paid",
-                "billing_date": {"$gte": start_of_last_month.isoformat(), "$lte": end_of_last_month.isoformat()}
-            }},
-            {"$group": {"_id": None, "total": {"$sum": "$paid_amount"}}}
-        ])
-        revenue_last_month_result = await revenue_last_month_cursor.to_list(length=1)
-        revenue_last_month = revenue_last_month_result[0]["total"] if revenue_last_month_result else 0.0
-        
-        # Today's Appointments (with patient and doctor names)
-        today_appointments_cursor = db.appointments.find({
-            "appointment_date": {"$gte": start_of_today.isoformat(), "$lte": end_of_today.isoformat()}
-        }).sort("appointment_date", 1).limit(4)
-        
-        today_appointments = []
-        async for appointment in today_appointments_cursor:
-            # Get patient name
-            patient = await db.patients.find_one({"patient_id": appointment["patient_id"]})
-            patient_name = f"{patient['first_name']} {patient['last_name']}" if patient else "Unknown Patient"
-            
-            # Get doctor name
-            doctor = await db.staff.find_one({"staff_id": appointment["doctor_id"]})
-            doctor_name = f"Dr. {doctor['first_name']} {doctor['last_name']}" if doctor else "Unknown Doctor"
-            
-            today_appointments.append({
-                "patient_name": patient_name,
-                "doctor_name": doctor_name,
-                "time": appointment["appointment_date"].split('T')[1][:5] + " " + ("AM" if int(appointment["appointment_date"].split('T')[1][:2]) < 12 else "PM"),
-                "status": appointment["status"]
-            })
-        
+
+        # Counters are maintained on every write (see stats.py), so reading them is O(1);
+        # only the short lists need a query, and everything runs concurrently
+        counters, today_appointment_docs, recent_patient_docs = await asyncio.gather(
+            stats.read_stats(db, [
+                stats.TOTAL,
+                stats.day_key(today),
+                stats.day_key(yesterday),
+                stats.month_key(today),
+                stats.month_key(last_month),
+            ]),
+            _today_appointments(db, today),
+            _recent_patients(db),
+        )
+        totals = counters[stats.TOTAL]
+        today_stats = counters[stats.day_key(today)]
+        yesterday_stats = counters[stats.day_key(yesterday)]
+        this_month_stats = counters[stats.month_key(today)]
+        last_month_stats = counters[stats.month_key(last_month)]
+
+        total_patients = totals.get("patients", 0)
+        patients_last_month = last_month_stats.get("patients_created", 0)
+        staff_members = totals.get("staff", 0)
+        staff_this_month = this_month_stats.get("staff_hired", 0)
+
         # Appointment Status Counts
-        confirmed_count = await db.appointments.count_documents({
-            "appointment_date": {"$gte": start_of_today.isoformat(), "$lte": end_of_today.isoformat()},
-            "status": "Confirmed"
-        })
-        
-        pending_count = await db.appointments.count_documents({
-            "appointment_date": {"$gte": start_of_today.isoformat(), "$lte": end_of_today.isoformat()},
-            "status": "Scheduled"
-        })
-        
-        cancelled_count = await db.appointments.count_documents({
-            "appointment_date": {"$gte": start_of_today.isoformat(), "$lte": end_of_today.isoformat()},
-            "status": "Cancelled"
-        })
-        
-        # Recent Patients (last 3 by visit date)
-        recent_patients_cursor = db.patients.find({}).sort("created_at", -1).limit(3)
+        status_counts = today_stats.get("appointments_by_status", {})
+        appointments_today = today_stats.get("appointments", 0)
+        appointments_yesterday = yesterday_stats.get("appointments", 0)
+        confirmed_count = status_counts.get("Confirmed", 0)
+        pending_count = status_counts.get("Scheduled", 0)
+        cancelled_count = status_counts.get("Cancelled", 0)
+
+        # Revenue
+        total_revenue = totals.get("revenue", 0.0)
+        revenue_last_month = last_month_stats.get("revenue", 0.0)
+
+        # Today's Appointments (with patient and doctor names)
+        today_appointments = [
+            {
+                "patient_name": appointment.get("patient_name") or "Unknown Patient",
+                "doctor_name": f"Dr. {appointment['doctor_name']}" if appointment.get("doctor_name") else "Unknown Doctor",
+                "time": _format_time(appointment),
+                "status": appointment.get("status")
+            }
+            for appointment in today_appointment_docs
+        ]
+
+        # Recent Patients (last 3 by creation date)
         recent_patients = []
-        async for patient in recent_patients_cursor:
-            # Get last visit date (from medical records)
-            last_visit_record = await db.medical_records.find_one(
-                {"patient_id": patient["patient_id"]}, 
-                sort=[("visit_date", -1)]
-            )
-            last_visit = last_visit_record["visit_date"] if last_visit_record else "No visits yet"
-            
+        for patient in recent_patient_docs:
+            visit_day = local_date(patient["last_visit"][0]["visit_date"]) if patient["last_visit"] else None
             recent_patients.append({
-                "name": f"{patient['first_name']} {patient['last_name']}",
-                "phone": patient["contact_number"],
-                "last_visit": last_visit.split('T')[0] if last_visit != "No visits yet" else "No visits yet"
+                "name": patient.get("full_name"),
+                "phone": patient.get("contact_number"),
+                "last_visit": visit_day.isoformat() if visit_day else "No visits yet"
             })
-        
+
         # Calculate percentage changes
         patient_change = ((total_patients - patients_last_month) / patients_last_month * 100) if patients_last_month > 0 else 0
         appointment_change = ((appointments_today - appointments_yesterday) / appointments_yesterday * 100) if appointments_yesterday > 0 else 0
         staff_change = staff_this_month
         revenue_change = ((total_revenue - revenue_last_month) / revenue_last_month * 100) if revenue_last_month > 0 else 0
-        
+
         dashboard_data = {
             "stats": {
                 "total_patients": total_patients,
@@ -158,12 +169,18 @@ async def get_dashboard_data(current_user: dict = Depends(get_current_user), db=
                 {"label": "View Billing & Invoices", "icon": "$", "route": "/billing"}
             ]
         }
-        
-        return StandardResponse(
+
+        return standard_response(
             success=True,
             message="Dashboard data retrieved successfully",
             data=dashboard_data
         )
-        
+
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching dashboard data: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error fetching dashboard data: {str(e)}")
+
+
+@router.get("/", response_model=StandardResponse)
+async def get_dashboard_data(request: Request, current_user: dict = Depends(get_current_user), db=Depends(get_db)):
+    """Get comprehensive dashboard data"""
+    return await cached_response(request, dashboard_key(), lambda: _render_dashboard(db))
@@ -0,0 +1,86 @@
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from models import User
+from responses import dumps
+from auth import get_stream_user, user_from_token
+from events import EVENT_SOURCES, RESET, Topics, event_bus
+
+router = APIRouter()
+
+def _topics(collections: Optional[str], doctor_id: Optional[str], patient_id: Optional[str], day: Optional[date]) -> Topics:
+    names = [name.strip() for name in collections.split(",") if name.strip()] if collections else None
+    unknown = [name for name in names or [] if name not in EVENT_SOURCES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collections: {', '.join(unknown)} (available: {', '.join(EVENT_SOURCES)})")
+    return Topics(names, doctor_id=doctor_id, patient_id=patient_id, date=day.isoformat() if day else None)
+
+def _require_bus():
+    if event_bus.mode is None:
+        raise HTTPException(status_code=503, detail="Live events are disabled")
+
+async def _sse(topics: Topics, after: Optional[str]):
+    yield b"retry: 3000\n\n"
+    async for event in event_bus.subscribe(topics, after):
+        if event is None:
+            yield b": keepalive\n\n"
+        elif event is RESET:
+            yield b"event: reset\ndata: {}\n\n"
+        else:
+            yield b"id: " + event.id.encode() + b"\nevent: change\ndata: " + dumps(event.payload()) + b"\n\n"
+
+@router.get("/stream")
+async def stream_events(
+    collections: Optional[str] = Query(None, description="Comma separated, default appointments,billing,patients"),
+    doctor_id: Optional[str] = None,
+    patient_id: Optional[str] = None,
+    day: Optional[date] = Query(None, alias="date", description="Clinic day of the appointment or bill"),
+    after: Optional[str] = Query(None, description="Id of the last event received, same as Last-Event-ID"),
+    last_event_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_stream_user),
+):
+    _require_bus()
+    topics = _topics(collections, doctor_id, patient_id, day)
+
+    return StreamingResponse(
+        _sse(topics, after or last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.websocket("/ws")
+async def events_websocket(
+    websocket: WebSocket,
+    collections: Optional[str] = None,
+    doctor_id: Optional[str] = None,
+    patient_id: Optional[str] = None,
+    day: Optional[date] = Query(None, alias="date"),
+    after: Optional[str] = None,
+    access_token: Optional[str] = None,
+):
+    authorization = websocket.headers.get("authorization", "")
+    token = authorization[7:] if authorization.lower().startswith("bearer ") else access_token
+    try:
+        if not token:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        await user_from_token(token)
+        _require_bus()
+        topics = _topics(collections, doctor_id, patient_id, day)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail)[:120])
+        return
+
+    await websocket.accept()
+    try:
+        async for event in event_bus.subscribe(topics, after):
+            if event is None:
+                await websocket.send_text('{"event":"keepalive"}')
+            elif event is RESET:
+                await websocket.send_text('{"event":"reset"}')
+                await websocket.close()
+                return
+            else:
+                await websocket.send_text(dumps({"event": "change", **event.payload()}).decode())
+    except WebSocketDisconnect:
+        pass
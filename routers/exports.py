@@ -0,0 +1,79 @@
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse
+from schemas import ExportRequest, StandardResponse
+from models import User
+from responses import standard_response
+from database import serialize_document, get_db
+from auth import require_admin
+from exports import (
+    EXPORTS_COLLECTION, cancel_export, create_export, export_path, export_sources, progress, pyarrow_available,
+)
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+MEDIA_TYPES = {"csv": "application/gzip", "parquet": "application/vnd.apache.parquet"}
+
+@router.post("/", response_model=StandardResponse, status_code=202)
+async def start_export(export: ExportRequest, current_user: User = Depends(require_admin), db=Depends(get_db)):
+    if export.format == "parquet" and not pyarrow_available():
+        raise HTTPException(status_code=400, detail="Parquet exports need pyarrow (pip install pyarrow)")
+    # fail now rather than in the worker
+    export_sources()[export.collection].compile_filter(export.filters.items())
+
+    job = await create_export(db, export.collection, export.format, list(export.filters.items()), current_user.email)
+
+    return standard_response(
+        success=True,
+        message="Export queued",
+        data=serialize_document(progress(job)),
+        status_code=202
+    )
+
+@router.get("/", response_model=StandardResponse)
+async def list_exports(limit: int = Query(50, ge=1, le=500), db=Depends(get_db)):
+    jobs = await db[EXPORTS_COLLECTION].find().sort("created_at", -1).limit(limit).to_list(length=limit)
+
+    return standard_response(
+        success=True,
+        message="Exports retrieved successfully",
+        data={"exports": [serialize_document(progress(job)) for job in jobs]}
+    )
+
+@router.get("/{export_id}", response_model=StandardResponse)
+async def get_export(export_id: str, db=Depends(get_db)):
+    job = await db[EXPORTS_COLLECTION].find_one({"_id": export_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export not found")
+
+    return standard_response(
+        success=True,
+        message="Export retrieved successfully",
+        data=serialize_document(progress(job))
+    )
+
+@router.get("/{export_id}/download")
+async def download_export(export_id: str, db=Depends(get_db)):
+    job = await db[EXPORTS_COLLECTION].find_one({"_id": export_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export not found")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Export is {job['status']}")
+    path = export_path(job)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Export file is gone")
+
+    # FileResponse sends the file in chunks, it is never loaded whole
+    return FileResponse(path, media_type=MEDIA_TYPES[job["format"]], filename=f"{job['collection']}-{os.path.basename(path)}")
+
+@router.delete("/{export_id}", response_model=StandardResponse)
+async def delete_export(export_id: str, db=Depends(get_db)):
+    job = await cancel_export(db, export_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export not found")
+
+    return standard_response(
+        success=True,
+        message="Export cancelled and its files removed" if job["status"] == "cancelled" else "Export files removed",
+        data=serialize_document(progress(job))
+    )
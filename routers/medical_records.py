@@ -1,38 +1,59 @@
-from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
+from fastapi import APIRouter, Depends, File, Header, HTTPException, UploadFile
 from models import MedicalRecord
-from schemas import MedicalRecordCreate, MedicalRecordUpdate, StandardResponse
-from database import db, serialize_document, get_db
-from utils import generate_unique_id
+from schemas import MedicalRecordCreate, MedicalRecordUpdate, StandardResponse, BulkRequest
+from responses import standard_response
+from database import serialize_document, get_db
+from pagination import ListParams, paginate
+from query import QuerySpec
+from repository import Repository
+from cache import invalidation_hook
+from documents import store_upload, drop_replaced_documents, stream_document
 
 router = APIRouter()
 
+medical_records_repository = Repository(
+    "medical_records", "record_id", "REC", MedicalRecord, "Medical record not found",
+    create_schema=MedicalRecordCreate, update_schema=MedicalRecordUpdate,
+    # records written before documents moved to GridFS may still carry the file inline
+    projection={"document": 0},
+    # the dashboard shows each recent patient's last visit
+    hooks=[invalidation_hook("record_id"), drop_replaced_documents],
+)
+
+medical_records_query = QuerySpec(
+    MedicalRecord,
+    filters=["record_id", "patient_id", "doctor_id", "visit_date", "follow_up_required"],
+    sorts=["visit_date"],
+)
+
 @router.post("/", response_model=StandardResponse)
 async def create_medical_record(record: MedicalRecordCreate, db=Depends(get_db)):
-    record_id = generate_unique_id("REC")
-    new_record = MedicalRecord(
-        record_id=record_id,
-        **record.dict()
-    )
-    
-    result = await db.medical_records.insert_one(new_record.dict(by_alias=True))
-    
-    created_record = await db.medical_records.find_one({"_id": result.inserted_id})
+    created_record = await medical_records_repository.create(db, record.dict())
     serialized_record = serialize_document(created_record)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Medical record created successfully",
         data=serialized_record
     )
 
+@router.post("/bulk", response_model=StandardResponse)
+async def bulk_medical_records(bulk_request: BulkRequest, db=Depends(get_db)):
+    result = await medical_records_repository.bulk_write(db, bulk_request.operations, ordered=bulk_request.ordered)
+    
+    return standard_response(
+        success=not result["errors"],
+        message="Bulk medical records operations completed" if not result["errors"] else "Bulk medical records operations completed with errors",
+        data=result
+    )
+
 @router.get("/{record_id}", response_model=StandardResponse)
 async def get_medical_record(record_id: str, db=Depends(get_db)):
-    record = await db.medical_records.find_one({"record_id": record_id})
-    if not record:
-        raise HTTPException(status_code=404, detail="Medical record not found")
+    record = await medical_records_repository.get(db, record_id)
     
     serialized_record = serialize_document(record)
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Medical record retrieved successfully",
         data=serialized_record
@@ -42,18 +63,10 @@ async def get_medical_record(record_id: str, db=Depends(get_db)):
 async def update_medical_record(record_id: str, record_update: MedicalRecordUpdate, db=Depends(get_db)):
     update_data = {k: v for k, v in record_update.dict().items() if v is not None}
     
-    result = await db.medical_records.update_one(
-        {"record_id": record_id},
-        {"$set": update_data}
-    )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Medical record not found")
-    
-    updated_record = await db.medical_records.find_one({"record_id": record_id})
+    updated_record = await medical_records_repository.update(db, record_id, update_data)
     serialized_record = serialize_document(updated_record)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Medical record updated successfully",
         data=serialized_record
@@ -61,25 +74,40 @@ async def update_medical_record(record_id: str, record_update: MedicalRecordUpda
 
 @router.delete("/{record_id}", response_model=StandardResponse)
 async def delete_medical_record(record_id: str, db=Depends(get_db)):
-    result = await db.medical_records.delete_one({"record_id": record_id})
+    await medical_records_repository.delete(db, record_id)
     
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Medical record not found")
-    
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Medical record deleted successfully",
         data=None
     )
 
-@router.get("/", response_model=StandardResponse)
-async def get_all_medical_records(db=Depends(get_db)):
-    records = []
-    async for record in db.medical_records.find():
-        records.append(serialize_document(record))
+@router.put("/{record_id}/document", response_model=StandardResponse)
+async def upload_medical_record_document(record_id: str, file: UploadFile = File(...), db=Depends(get_db)):
+    await medical_records_repository.get(db, record_id)
     
-    return StandardResponse(
+    # replacing a document drops the previous file (drop_replaced_documents)
+    document_fields = await store_upload(db, file, {"record_id": record_id})
+    updated_record = await medical_records_repository.update(db, record_id, document_fields)
+    serialized_record = serialize_document(updated_record)
+    
+    return standard_response(
         success=True,
-        message="Medical records retrieved successfully",
-        data={"records": records}
+        message="Medical record document uploaded successfully",
+        data=serialized_record
+    )
+
+@router.get("/{record_id}/document")
+async def download_medical_record_document(record_id: str, range: Optional[str] = Header(None), db=Depends(get_db)):
+    record = await medical_records_repository.get(db, record_id)
+    if not record.get("document_ref"):
+        raise HTTPException(status_code=404, detail="Medical record has no document")
+    
+    return await stream_document(db, record["document_ref"], range)
+
+@router.get("/", response_model=StandardResponse)
+async def get_all_medical_records(params: ListParams = Depends(), db=Depends(get_db)):
+    return await paginate(
+        db.medical_records, "records", MedicalRecord, params, "Medical records retrieved successfully",
+        default_projection=medical_records_repository.projection, spec=medical_records_query,
     )
\ No newline at end of file
@@ -1,60 +1,129 @@
-from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
+from fastapi import APIRouter, Depends, File, Request, Query, UploadFile
 from models import Patient
-from schemas import PatientCreate, PatientUpdate, StandardResponse
-from database import db, serialize_document, get_db
-from utils import generate_unique_id
-from bson import ObjectId
+from schemas import PatientCreate, PatientUpdate, StandardResponse, BulkRequest
+from responses import standard_response
+from database import serialize_document, get_db
+from pagination import ListParams, paginate
+from query import QuerySpec
+from repository import Repository
+from imports import detect_format, import_upload
+from cache import cached_response, invalidation_hook, resource_key
+from search import SEARCH_PROJECTION, derive_search_fields, search_patients
+from stats import apply_changes
+from events import publish_changes
+from timeline import patient_timeline
+from utils import get_current_utc
 
 router = APIRouter()
 
+patients_repository = Repository(
+    "patients", "patient_id", "PAT", Patient, "Patient not found",
+    create_schema=PatientCreate, update_schema=PatientUpdate,
+    create_defaults=lambda: {"created_at": get_current_utc()},
+    projection=SEARCH_PROJECTION,
+    hooks=[apply_changes, invalidation_hook("patient_id"), publish_changes],
+    derive=derive_search_fields,
+)
+
+patients_query = QuerySpec(
+    Patient,
+    filters=["patient_id", "gender", "created_at", "date_of_birth"],
+    sorts=["created_at", "full_name"],
+)
+
 @router.post("/", response_model=StandardResponse)
 async def create_patient(patient: PatientCreate, db=Depends(get_db)):
-    patient_id = generate_unique_id("PAT")
-    new_patient = Patient(
-        patient_id=patient_id,
-        **patient.dict()
-    )
-    
-    result = await db.patients.insert_one(new_patient.dict(by_alias=True))
-    
-    created_patient = await db.patients.find_one({"_id": result.inserted_id})
+    created_patient = await patients_repository.create(db, patient.dict())
     serialized_patient = serialize_document(created_patient)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Patient created successfully",
         data=serialized_patient
     )
 
+@router.post("/bulk", response_model=StandardResponse)
+async def bulk_patients(bulk_request: BulkRequest, db=Depends(get_db)):
+    result = await patients_repository.bulk_write(db, bulk_request.operations, ordered=bulk_request.ordered)
+    
+    return standard_response(
+        success=not result["errors"],
+        message="Bulk patients operations completed" if not result["errors"] else "Bulk patients operations completed with errors",
+        data=result
+    )
+
+@router.post("/import", response_model=StandardResponse)
+async def import_patients(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$", description="Defaults to the file extension"),
+    db=Depends(get_db)
+):
+    report = await import_upload(db, patients_repository, PatientCreate, file, detect_format(file, format))
+    
+    return standard_response(
+        success=not report["failed"],
+        message="Patients imported" if not report["failed"] else "Patients imported with errors",
+        data=report
+    )
+
+@router.get("/search", response_model=StandardResponse)
+async def search(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    db=Depends(get_db)
+):
+    result = await search_patients(db, q, limit)
+    
+    return standard_response(
+        success=True,
+        message="Patients retrieved successfully",
+        data={
+            "patients": [serialize_document(patient) for patient in result["patients"]],
+            "mode": result["mode"],
+            "count": len(result["patients"]),
+        }
+    )
+
 @router.get("/{patient_id}", response_model=StandardResponse)
-async def get_patient(patient_id: str, db=Depends(get_db)):
-    patient = await db.patients.find_one({"patient_id": patient_id})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
+async def get_patient(patient_id: str, request: Request, db=Depends(get_db)):
+    async def render():
+        patient = await patients_repository.get(db, patient_id)
     
-    serialized_patient = serialize_document(patient)
-    return StandardResponse(
+        serialized_patient = serialize_document(patient)
+        return standard_response(
+            success=True,
+            message="Patient retrieved successfully",
+            data=serialized_patient
+        )
+
+    return await cached_response(request, resource_key("patients", patient_id), render)
+
+@router.get("/{patient_id}/timeline", response_model=StandardResponse)
+async def get_timeline(
+    patient_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = Query(None, description="Cursor returned as next_cursor by the previous page"),
+    types: Optional[str] = Query(None, description="Comma separated: appointment, medical_record, bill"),
+    db=Depends(get_db)
+):
+    event_types = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    timeline = await patient_timeline(db, patient_id, limit, after, event_types)
+    
+    return standard_response(
         success=True,
-        message="Patient retrieved successfully",
-        data=serialized_patient
+        message="Patient timeline retrieved successfully",
+        data=timeline
     )
 
 @router.put("/{patient_id}", response_model=StandardResponse)
 async def update_patient(patient_id: str, patient_update: PatientUpdate, db=Depends(get_db)):
     update_data = {k: v for k, v in patient_update.dict().items() if v is not None}
     
-    result = await db.patients.update_one(
-        {"patient_id": patient_id},
-        {"$set": update_data}
-    )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Patient not found")
-    
-    updated_patient = await db.patients.find_one({"patient_id": patient_id})
+    updated_patient = await patients_repository.update(db, patient_id, update_data)
     serialized_patient = serialize_document(updated_patient)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Patient updated successfully",
         data=serialized_patient
@@ -62,25 +131,17 @@ async def update_patient(patient_id: str, patient_update: PatientUpdate, db=Depe
 
 @router.delete("/{patient_id}", response_model=StandardResponse)
 async def delete_patient(patient_id: str, db=Depends(get_db)):
-    result = await db.patients.delete_one({"patient_id": patient_id})
-    
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Patient not found")
+    await patients_repository.delete(db, patient_id)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Patient deleted successfully",
         data=None
     )
 
 @router.get("/", response_model=StandardResponse)
-async def get_all_patients(db=Depends(get_db)):
-    patients = []
-    async for patient in db.patients.find():
-        patients.append(serialize_document(patient))
-    
-    return StandardResponse(
-        success=True,
-        message="Patients retrieved successfully",
-        data={"patients": patients}
+async def get_all_patients(params: ListParams = Depends(), db=Depends(get_db)):
+    return await paginate(
+        db.patients, "patients", Patient, params, "Patients retrieved successfully",
+        default_projection=patients_repository.projection, spec=patients_query,
     )
\ No newline at end of file
@@ -1,59 +1,87 @@
-from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
+from fastapi import APIRouter, Depends, File, Query, Request, UploadFile
 from models import Staff
-from schemas import StaffCreate, StaffUpdate, StandardResponse
-from database import db, serialize_document, get_db
-from utils import generate_unique_id
+from schemas import StaffCreate, StaffUpdate, StandardResponse, BulkRequest
+from responses import standard_response
+from database import serialize_document, get_db
+from pagination import ListParams, paginate
+from query import QuerySpec
+from repository import Repository
+from imports import detect_format, import_upload
+from cache import cached_response, invalidation_hook, resource_key
+from stats import apply_changes
 
 router = APIRouter()
 
+staff_repository = Repository(
+    "staff", "staff_id", "STF", Staff, "Staff member not found",
+    create_schema=StaffCreate, update_schema=StaffUpdate,
+    hooks=[apply_changes, invalidation_hook("staff_id")],
+)
+
+staff_query = QuerySpec(
+    Staff,
+    filters=["staff_id", "role", "specialization", "hire_date"],
+    sorts=["hire_date", "full_name"],
+)
+
 @router.post("/", response_model=StandardResponse)
 async def create_staff(staff: StaffCreate, db=Depends(get_db)):
-    staff_id = generate_unique_id("STF")
-    new_staff = Staff(
-        staff_id=staff_id,
-        **staff.dict()
-    )
-    
-    result = await db.staff.insert_one(new_staff.dict(by_alias=True))
-    
-    created_staff = await db.staff.find_one({"_id": result.inserted_id})
+    created_staff = await staff_repository.create(db, staff.dict())
     serialized_staff = serialize_document(created_staff)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Staff member created successfully",
         data=serialized_staff
     )
 
-@router.get("/{staff_id}", response_model=StandardResponse)
-async def get_staff(staff_id: str, db=Depends(get_db)):
-    staff = await db.staff.find_one({"staff_id": staff_id})
-    if not staff:
-        raise HTTPException(status_code=404, detail="Staff member not found")
+@router.post("/bulk", response_model=StandardResponse)
+async def bulk_staff(bulk_request: BulkRequest, db=Depends(get_db)):
+    result = await staff_repository.bulk_write(db, bulk_request.operations, ordered=bulk_request.ordered)
     
-    serialized_staff = serialize_document(staff)
-    return StandardResponse(
-        success=True,
-        message="Staff member retrieved successfully",
-        data=serialized_staff
+    return standard_response(
+        success=not result["errors"],
+        message="Bulk staff members operations completed" if not result["errors"] else "Bulk staff members operations completed with errors",
+        data=result
     )
 
-@router.put("/{staff_id}", response_model=StandardResponse)
-async def update_staff(staff_id: str, staff_update: StaffUpdate, db=Depends(get_db)):
-    update_data = {k: v for k, v in staff_update.dict().items() if v is not None}
+@router.post("/import", response_model=StandardResponse)
+async def import_staff(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$", description="Defaults to the file extension"),
+    db=Depends(get_db)
+):
+    report = await import_upload(db, staff_repository, StaffCreate, file, detect_format(file, format))
     
-    result = await db.staff.update_one(
-        {"staff_id": staff_id},
-        {"$set": update_data}
+    return standard_response(
+        success=not report["failed"],
+        message="Staff members imported" if not report["failed"] else "Staff members imported with errors",
+        data=report
     )
+
+@router.get("/{staff_id}", response_model=StandardResponse)
+async def get_staff(staff_id: str, request: Request, db=Depends(get_db)):
+    async def render():
+        staff = await staff_repository.get(db, staff_id)
     
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Staff member not found")
+        serialized_staff = serialize_document(staff)
+        return standard_response(
+            success=True,
+            message="Staff member retrieved successfully",
+            data=serialized_staff
+        )
+
+    return await cached_response(request, resource_key("staff", staff_id), render)
+
+@router.put("/{staff_id}", response_model=StandardResponse)
+async def update_staff(staff_id: str, staff_update: StaffUpdate, db=Depends(get_db)):
+    update_data = {k: v for k, v in staff_update.dict().items() if v is not None}
     
-    updated_staff = await db.staff.find_one({"staff_id": staff_id})
+    updated_staff = await staff_repository.update(db, staff_id, update_data)
     serialized_staff = serialize_document(updated_staff)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Staff member updated successfully",
         data=serialized_staff
@@ -61,25 +89,14 @@ async def update_staff(staff_id: str, staff_update: StaffUpdate, db=Depends(get_
 
 @router.delete("/{staff_id}", response_model=StandardResponse)
 async def delete_staff(staff_id: str, db=Depends(get_db)):
-    result = await db.staff.delete_one({"staff_id": staff_id})
-    
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Staff member not found")
+    await staff_repository.delete(db, staff_id)
     
-    return StandardResponse(
+    return standard_response(
         success=True,
         message="Staff member deleted successfully",
         data=None
     )
 
 @router.get("/", response_model=StandardResponse)
-async def get_all_staff(db=Depends(get_db)):
-    staff = []
-    async for s in db.staff.find():
-        staff.append(serialize_document(s))
-    
-    return StandardResponse(
-        success=True,
-        message="Staff members retrieved successfully",
-        data={"staff": staff}
-    )
\ No newline at end of file
+async def get_all_staff(params: ListParams = Depends(), db=Depends(get_db)):
+    return await paginate(db.staff, "staff", Staff, params, "Staff members retrieved successfully", spec=staff_query)
\ No newline at end of file
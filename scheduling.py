@@ -0,0 +1,254 @@
+"""
+Doctor schedules and conflict-free booking.
+
+Each doctor-day has one document in `doctor_schedules` holding the occupied slots:
+
+    {"_id": "STF_x:2024-05-01", "doctor_id": "STF_x", "date": "2024-05-01",
+     "slots": {"0900": "APT_a", "0905": "APT_a", "0910": "APT_a"}}
+
+Booking claims every slot of the appointment with a single conditional upsert, so two
+concurrent bookings for the same slot cannot both succeed. Availability for a date
+range is one indexed query over these documents.
+"""
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from config import settings
+from dates import to_clinic
+
+SCHEDULES_COLLECTION = "doctor_schedules"
+INACTIVE_STATUSES = ("Cancelled", "No-Show")
+MAX_AVAILABILITY_DAYS = 31
+
+
+def schedule_id(doctor_id: str, day: str) -> str:
+    return f"{doctor_id}:{day}"
+
+
+def _minutes(time_text: str) -> int:
+    hours, minutes = time_text.split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def _slot_key(minute: int) -> str:
+    return f"{minute // 60:02d}{minute % 60:02d}"
+
+
+def _slot_time(key: str) -> str:
+    return f"{key[:2]}:{key[2:]}"
+
+
+def appointment_start(appointment: dict) -> Optional[Tuple[str, int]]:
+    """(YYYY-MM-DD, minutes since midnight) of an appointment in clinic time, None if unparseable"""
+    value = appointment.get("appointment_date")
+    time_text = appointment.get("appointment_time")
+    try:
+        if isinstance(value, datetime):
+            # appointment_date holds the start instant, appointment_time is only derived from it
+            local = to_clinic(value)
+            return local.date().isoformat(), local.hour * 60 + local.minute
+        if not value:
+            return None
+        value = str(value)
+        day = date.fromisoformat(value[:10]).isoformat()
+        if time_text:
+            return day, _minutes(time_text)
+        if "T" in value:
+            return day, _minutes(value.split("T")[1])
+    except ValueError:
+        pass
+    return None
+
+
+def occupancy(appointment: Optional[dict]) -> Optional[Tuple[str, str, List[str]]]:
+    """(schedule id, day, slot keys) an appointment occupies, None if it holds no slots"""
+    if not appointment or appointment.get("status") in INACTIVE_STATUSES:
+        return None
+    start = appointment_start(appointment)
+    if start is None or not appointment.get("doctor_id"):
+        return None
+    day, start_minute = start
+    slot = settings.APPOINTMENT_SLOT_MINUTES
+    duration = appointment.get("duration_minutes") or settings.APPOINTMENT_DEFAULT_DURATION_MINUTES
+    first = start_minute - start_minute % slot
+    keys = [_slot_key(m) for m in range(first, min(start_minute + duration, 24 * 60), slot)]
+    return schedule_id(appointment["doctor_id"], day), day, keys
+
+
+async def reserve(db, appointment: dict):
+    """Claim the appointment's slots or raise 409 if any is held by another appointment"""
+    if appointment.get("status") in INACTIVE_STATUSES:
+        return
+    occupied = occupancy(appointment)
+    if occupied is None:
+        raise HTTPException(
+            status_code=422,
+            detail="appointment_date must be YYYY-MM-DD and appointment_time HH:MM"
+        )
+    sid, day, keys = occupied
+    appointment_id = appointment["appointment_id"]
+
+    # each slot must be free or already ours (an appointment being moved)
+    query = {"_id": sid, "$and": [
+        {"$or": [{f"slots.{key}": {"$exists": False}}, {f"slots.{key}": appointment_id}]}
+        for key in keys
+    ]}
+    update = {
+        "$set": {f"slots.{key}": appointment_id for key in keys},
+        "$setOnInsert": {"doctor_id": appointment["doctor_id"], "date": day},
+    }
+    for attempt in range(2):
+        try:
+            # a taken slot makes the filter miss and the upsert collide with the existing _id
+            await db[SCHEDULES_COLLECTION].update_one(query, update, upsert=True)
+            return
+        except DuplicateKeyError:
+            # the first attempt can also lose a race to create the doctor-day document
+            if attempt:
+                raise HTTPException(status_code=409, detail="Doctor is already booked at that time")
+
+
+async def reserve_change(db, before: Optional[dict], after: dict) -> bool:
+    """
+    Claim the slots a write gives the appointment before writing it, True if any were claimed.
+
+    New appointments go through `reserve`; edits only when they move into other slots.
+    """
+    if before is None:
+        await reserve(db, after)
+        return occupancy(after) is not None
+    moved = occupancy(after)
+    if not moved or moved == occupancy(before):
+        return False
+    await reserve(db, after)
+    return True
+
+
+def _unset_slots(appointment_id: str, sid: str, keys) -> List[UpdateOne]:
+    return [UpdateOne({"_id": sid, f"slots.{key}": appointment_id}, {"$unset": {f"slots.{key}": ""}})
+            for key in keys]
+
+
+def _released(before: Optional[dict], after: Optional[dict]) -> List[UpdateOne]:
+    """Unsets for the slots `before` holds that `after` does not"""
+    old = occupancy(before)
+    if not old:
+        return []
+    new = occupancy(after)
+    kept = set(new[2]) if new and new[0] == old[0] else set()
+    return _unset_slots(before["appointment_id"], old[0], [key for key in old[2] if key not in kept])
+
+
+async def release(db, appointment: dict):
+    occupied = occupancy(appointment)
+    if occupied is None:
+        return
+    sid, _, keys = occupied
+    await db[SCHEDULES_COLLECTION].bulk_write(_unset_slots(appointment["appointment_id"], sid, keys), ordered=False)
+
+
+async def release_change(db, before: Optional[dict], after: dict):
+    """Give back what `reserve_change` claimed when the write then failed, keeping `before`'s slots"""
+    operations = _released(after, before)
+    if operations:
+        await db[SCHEDULES_COLLECTION].bulk_write(operations, ordered=False)
+
+
+async def sync_schedules(db, collection: str, changes: list):
+    """
+    Repository write hook: free the slots each appointment no longer holds after the write.
+
+    Slots are only ever claimed by `reserve` before the write, never here, so a write
+    cannot take slots held by another appointment.
+    """
+    operations = []
+    for before, after in changes:
+        operations += _released(before, after)
+    if operations:
+        await db[SCHEDULES_COLLECTION].bulk_write(operations, ordered=False)
+
+
+async def write_slots(db, appointments: List[dict]):
+    """Record the slots of appointments without checking for clashes, only for filling an empty collection"""
+    operations = []
+    for appointment in appointments:
+        occupied = occupancy(appointment)
+        if occupied:
+            sid, day, keys = occupied
+            operations.append(UpdateOne(
+                {"_id": sid},
+                {
+                    "$set": {f"slots.{key}": appointment["appointment_id"] for key in keys},
+                    "$setOnInsert": {"doctor_id": appointment["doctor_id"], "date": day},
+                },
+                upsert=True,
+            ))
+    if operations:
+        await db[SCHEDULES_COLLECTION].bulk_write(operations, ordered=False)
+
+
+def _free_intervals(slots: dict, opening: int, closing: int) -> List[dict]:
+    step = settings.APPOINTMENT_SLOT_MINUTES
+    free = []
+    start = None
+    for minute in range(opening, closing, step):
+        if _slot_key(minute) in slots:
+            if start is not None:
+                free.append({"start": _slot_time(_slot_key(start)), "end": _slot_time(_slot_key(minute))})
+                start = None
+        elif start is None:
+            start = minute
+    if start is not None:
+        free.append({"start": _slot_time(_slot_key(start)), "end": _slot_time(_slot_key(closing))})
+    return free
+
+
+def _booked(slots: dict) -> List[dict]:
+    booked = []
+    for key in sorted(slots):
+        end = _slot_time(_slot_key(_minutes(_slot_time(key)) + settings.APPOINTMENT_SLOT_MINUTES))
+        if booked and booked[-1]["appointment_id"] == slots[key]:
+            booked[-1]["end"] = end
+        else:
+            booked.append({"appointment_id": slots[key], "start": _slot_time(key), "end": end})
+    return booked
+
+
+async def availability(db, doctor_id: str, date_from: date, date_to: date) -> dict:
+    """Free and booked intervals per day within opening hours, from one query"""
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if (date_to - date_from).days >= MAX_AVAILABILITY_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_AVAILABILITY_DAYS} days per request")
+
+    schedules = {
+        doc["date"]: doc.get("slots", {})
+        async for doc in db[SCHEDULES_COLLECTION].find(
+            {"doctor_id": doctor_id, "date": {"$gte": date_from.isoformat(), "$lte": date_to.isoformat()}}
+        )
+    }
+
+    opening = _minutes(settings.CLINIC_OPENING_TIME)
+    closing = _minutes(settings.CLINIC_CLOSING_TIME)
+    days = []
+    day = date_from
+    while day <= date_to:
+        slots = schedules.get(day.isoformat(), {})
+        days.append({
+            "date": day.isoformat(),
+            "free": _free_intervals(slots, opening, closing),
+            "booked": _booked(slots),
+        })
+        day += timedelta(days=1)
+
+    return {
+        "doctor_id": doctor_id,
+        "slot_minutes": settings.APPOINTMENT_SLOT_MINUTES,
+        "opening_time": settings.CLINIC_OPENING_TIME,
+        "closing_time": settings.CLINIC_CLOSING_TIME,
+        "days": days,
+    }
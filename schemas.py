@@ -1,6 +1,7 @@
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, model_validator
+from typing import Dict, Optional, List
 from datetime import datetime
+from dates import UTCDateTime, combine, clinic_time
 
 class Token(BaseModel):
     access_token: str
@@ -24,6 +25,16 @@ class StandardResponse(BaseModel):
     message: str
     data: Optional[dict] = None
 
+# Bulk Schemas
+class BulkOperation(BaseModel):
+    op: str  # insert, update, upsert, delete
+    id: Optional[str] = None  # business ID, required for everything but insert
+    data: Optional[dict] = None
+
+class BulkRequest(BaseModel):
+    ordered: bool = False
+    operations: List[BulkOperation]
+
 # Patient Schemas
 class PatientCreate(BaseModel):
     full_name: str
@@ -50,7 +61,7 @@ class StaffCreate(BaseModel):
     specialization: Optional[str] = None
     contact_number: str
     email: Optional[str] = None
-    hire_date: str
+    hire_date: UTCDateTime
 
 class StaffUpdate(BaseModel):
     full_name: Optional[str] = None
@@ -58,48 +69,69 @@ class StaffUpdate(BaseModel):
     specialization: Optional[str] = None
     contact_number: Optional[str] = None
     email: Optional[str] = None
-    hire_date: Optional[str] = None
+    hire_date: Optional[UTCDateTime] = None
 
 # Appointment Schemas
+def _appointment_start(day: datetime, time_text: str):
+    try:
+        start = combine(day, time_text)
+    except (TypeError, ValueError):
+        raise ValueError("appointment_time must be HH:MM")
+    return start, clinic_time(start)
+
 class AppointmentCreate(BaseModel):
     patient_id: str
     doctor_id: str
-    appointment_date: str
-    appointment_time: str 
+    appointment_date: UTCDateTime
+    appointment_time: str
+    duration_minutes: Optional[int] = Field(None, gt=0, le=480)
     reason_for_visit: str
     room_number: Optional[str] = None
     notes: Optional[str] = None
 
+    @model_validator(mode="after")
+    def combine_start(self):
+        self.appointment_date, self.appointment_time = _appointment_start(self.appointment_date, self.appointment_time)
+        return self
+
 class AppointmentUpdate(BaseModel):
     patient_id: Optional[str] = None
     doctor_id: Optional[str] = None
-    appointment_date: Optional[str] = None
+    appointment_date: Optional[UTCDateTime] = None
     appointment_time: Optional[str] = None
+    duration_minutes: Optional[int] = Field(None, gt=0, le=480)
     status: Optional[str] = None  # Scheduled, Completed, Cancelled, No-Show
     reason_for_visit: Optional[str] = None
     room_number: Optional[str] = None
     notes: Optional[str] = None
 
+    @model_validator(mode="after")
+    def combine_start(self):
+        # date and time are stored as one instant, so a reschedule has to carry both
+        if (self.appointment_date is None) != (self.appointment_time is None):
+            raise ValueError("appointment_date and appointment_time must be updated together")
+        if self.appointment_date is not None:
+            self.appointment_date, self.appointment_time = _appointment_start(self.appointment_date, self.appointment_time)
+        return self
+
 # Medical Record Schemas
 class MedicalRecordCreate(BaseModel):
     patient_id: str
     doctor_id: str
-    visit_date: str
+    visit_date: UTCDateTime
     diagnosis: str
     treatment: str
     lab_results: Optional[str] = None
     follow_up_required: bool = False
-    document: Optional[bytes] = None
 
 class MedicalRecordUpdate(BaseModel):
     patient_id: Optional[str] = None
     doctor_id: Optional[str] = None
-    visit_date: Optional[str] = None
+    visit_date: Optional[UTCDateTime] = None
     diagnosis: Optional[str] = None
     treatment: Optional[str] = None
     lab_results: Optional[str] = None
     follow_up_required: Optional[bool] = None
-    document: Optional[bytes] = None
 
 # Billing Schemas
 class BillingCreate(BaseModel):
@@ -108,7 +140,7 @@ class BillingCreate(BaseModel):
     total_amount: float
     paid_amount: float
     payment_method: str  # Cash, Card, Online
-    billing_date: str
+    billing_date: UTCDateTime
 
 class BillingUpdate(BaseModel):
     patient_id: Optional[str] = None
@@ -117,4 +149,16 @@ class BillingUpdate(BaseModel):
     paid_amount: Optional[float] = None
     payment_method: Optional[str] = None  # Cash, Card, Online
     payment_status: Optional[str] = None  # Pending, Paid, Partial, Cancelled
-    billing_date: Optional[str] = None
\ No newline at end of file
+    billing_date: Optional[UTCDateTime] = None
+
+# Admin Schemas
+class ProfilerSettings(BaseModel):
+    enabled: Optional[bool] = None
+    slow_query_ms: Optional[int] = Field(None, ge=0)
+
+# Export Schemas
+class ExportRequest(BaseModel):
+    collection: str = Field(..., pattern="^(appointments|billing|medical_records)$")
+    format: str = Field("csv", pattern="^(csv|parquet)$")
+    # same grammar as the list endpoints, e.g. {"billing_date__gte": "2024-05-01"}
+    filters: Dict[str, str] = {}
@@ -0,0 +1,161 @@
+"""
+Patient search: name prefix, phone number suffix and email.
+
+Patients carry three derived, indexed fields kept up to date by the repository:
+
+    name_prefixes  every prefix of every normalized name token ("ram" -> r, ra, ram)
+    phone_rev      the digits of contact_number reversed, so a suffix is an indexed prefix
+    email_lc       lower-cased email
+
+A search is one indexed query for a bounded number of candidates which are then ranked
+here. Name searches are topped up from the text index (whole, stemmed words) when the
+prefixes find fewer than `limit` patients.
+
+    python search.py    # backfill the derived fields on existing patients
+"""
+import asyncio
+import re
+import sys
+import unicodedata
+from typing import List
+
+from fastapi import HTTPException
+from pymongo import UpdateOne
+
+MAX_PREFIX_LENGTH = 15
+MIN_PHONE_DIGITS = 3
+CANDIDATES = 200  # ranked per search, bounds the work however common the prefix is
+SEARCH_FIELDS = ("name_prefixes", "phone_rev", "email_lc")
+SEARCH_PROJECTION = {field: 0 for field in SEARCH_FIELDS}
+
+
+def normalize(text: str) -> str:
+    """Lower-case with accents stripped, so "José" matches "jose"."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokens(text: str) -> List[str]:
+    return re.findall(r"[^\W_]+", normalize(text))
+
+
+def name_prefixes(full_name: str) -> List[str]:
+    prefixes = set()
+    for token in tokens(full_name):
+        for length in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1):
+            prefixes.add(token[:length])
+    return sorted(prefixes)
+
+
+def digits(text: str) -> str:
+    return re.sub(r"\D", "", text or "")
+
+
+def derive_search_fields(fields: dict) -> dict:
+    """Derived search fields for whichever source fields are present in `fields`"""
+    derived = {}
+    if "full_name" in fields:
+        derived["name_prefixes"] = name_prefixes(fields["full_name"])
+    if "contact_number" in fields:
+        derived["phone_rev"] = digits(fields["contact_number"])[::-1]
+    if "email" in fields:
+        derived["email_lc"] = fields["email"].strip().lower() if fields["email"] else None
+    return derived
+
+
+def _name_rank(patient: dict, query_tokens: List[str], query: str):
+    name_tokens = tokens(patient.get("full_name"))
+    exact = sum(1 for t in query_tokens if t in name_tokens)
+    starts = normalize(patient.get("full_name")).startswith(normalize(query))
+    return (-exact, not starts, len(patient.get("full_name") or ""), patient.get("full_name") or "")
+
+
+async def _text_matches(collection, query: str, exclude: list, limit: int) -> list:
+    cursor = collection.find(
+        {"$text": {"$search": query}, "_id": {"$nin": exclude}},
+        {**SEARCH_PROJECTION, "score": {"$meta": "textScore"}},
+    ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+    matches = await cursor.to_list(length=limit)
+    for patient in matches:
+        patient.pop("score", None)
+    return matches
+
+
+async def search_patients(db, query: str, limit: int) -> dict:
+    query = query.strip()
+    collection = db.patients
+
+    if "@" in query:
+        mode = "email"
+        email = query.lower()
+        candidates = await collection.find(
+            {"email_lc": {"$regex": "^" + re.escape(email)}}, SEARCH_PROJECTION
+        ).limit(CANDIDATES).to_list(length=CANDIDATES)
+        candidates.sort(key=lambda p: ((p.get("email") or "").lower() != email, p.get("email") or ""))
+    elif len(digits(query)) >= MIN_PHONE_DIGITS and not re.search(r"[^\d\s()+.-]", query):
+        mode = "phone"
+        suffix = digits(query)
+        candidates = await collection.find(
+            {"phone_rev": {"$regex": "^" + suffix[::-1]}}, SEARCH_PROJECTION
+        ).limit(CANDIDATES).to_list(length=CANDIDATES)
+        candidates.sort(key=lambda p: (digits(p.get("contact_number")) != suffix, len(digits(p.get("contact_number")))))
+    else:
+        mode = "name"
+        query_tokens = tokens(query)
+        if not query_tokens:
+            raise HTTPException(status_code=400, detail="Search query must contain letters or digits")
+        # the index only holds prefixes up to MAX_PREFIX_LENGTH, longer tokens are checked here;
+        # longest first, Mongo walks the index with the first $all value
+        indexed = sorted({t[:MAX_PREFIX_LENGTH] for t in query_tokens}, key=len, reverse=True)
+        candidates = await collection.find(
+            {"name_prefixes": {"$all": indexed}}, SEARCH_PROJECTION
+        ).limit(CANDIDATES).to_list(length=CANDIDATES)
+        candidates = [
+            p for p in candidates
+            if all(any(n.startswith(t) for n in tokens(p.get("full_name"))) for t in query_tokens)
+        ]
+        candidates.sort(key=lambda p: _name_rank(p, query_tokens, query))
+        if len(candidates) < limit:
+            candidates += await _text_matches(
+                collection, query, [p["_id"] for p in candidates], limit - len(candidates)
+            )
+
+    return {"mode": mode, "patients": candidates[:limit]}
+
+
+async def backfill(db, batch_size: int = 1000) -> int:
+    """Set the derived fields on patients created before search existed"""
+    updated = 0
+    while True:
+        patients = await db.patients.find(
+            {"name_prefixes": {"$exists": False}}, {"full_name": 1, "contact_number": 1, "email": 1}
+        ).limit(batch_size).to_list(length=batch_size)
+        if not patients:
+            return updated
+        operations = [
+            UpdateOne({"_id": p["_id"]}, {"$set": derive_search_fields({
+                "full_name": p.get("full_name") or "",
+                "contact_number": p.get("contact_number") or "",
+                "email": p.get("email"),
+            })})
+            for p in patients
+        ]
+        result = await db.patients.bulk_write(operations, ordered=False)
+        updated += result.modified_count
+
+
+async def main() -> int:
+    import database
+    from database import connect_to_mongo, close_mongo_connection
+
+    await connect_to_mongo()
+    try:
+        updated = await backfill(database.db)
+    finally:
+        await close_mongo_connection()
+    print(f"Backfilled search fields on {updated} patients")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,253 @@
+"""
+Materialized dashboard counters.
+
+Every write to patients, staff, appointments or billing calls `apply_changes` with the
+documents before and after the write. Each collection maps a document to the counters
+it contributes to, and the difference is applied to the `stats` collection with one
+atomic `$inc` per counter document:
+
+    {"_id": "total",            "patients": 120, "staff": 14, "revenue": 5400.0}
+    {"_id": "day:2024-05-01",   "appointments": 9, "appointments_by_status": {"Scheduled": 7, ...}}
+    {"_id": "month:2024-05",    "patients_created": 31, "staff_hired": 1, "revenue": 800.0}
+
+    python stats.py            # report drift between counters and the collections
+    python stats.py --apply    # rebuild the counters from scratch
+"""
+import argparse
+import asyncio
+import sys
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Optional
+
+from pymongo import ReplaceOne, UpdateOne
+
+from dates import CLINIC_TIMEZONE, local_date
+
+STATS_COLLECTION = "stats"
+TOTAL = "total"
+
+
+def day_key(value) -> Optional[str]:
+    d = local_date(value)
+    return f"day:{d.isoformat()}" if d else None
+
+
+def month_key(value) -> Optional[str]:
+    d = local_date(value)
+    return f"month:{d.strftime('%Y-%m')}" if d else None
+
+
+def today() -> date:
+    return datetime.now(CLINIC_TIMEZONE).date()
+
+
+def _safe(name) -> str:
+    # counter names end up in field paths
+    return str(name).replace(".", "_").replace("$", "_")
+
+
+# Contribution of a single document: {stat_id: {counter: amount}}
+
+def _patient_contributions(doc: dict) -> dict:
+    contributions = {TOTAL: {"patients": 1}}
+    created = month_key(doc.get("created_at"))
+    if created:
+        contributions[created] = {"patients_created": 1}
+    return contributions
+
+
+def _staff_contributions(doc: dict) -> dict:
+    contributions = {TOTAL: {"staff": 1}}
+    hired = month_key(doc.get("hire_date"))
+    if hired:
+        contributions[hired] = {"staff_hired": 1}
+    return contributions
+
+
+def _appointment_contributions(doc: dict) -> dict:
+    day = day_key(doc.get("appointment_date"))
+    if not day:
+        return {}
+    return {day: {
+        "appointments": 1,
+        f"appointments_by_status.{_safe(doc.get('status') or 'Scheduled')}": 1,
+    }}
+
+
+def _billing_contributions(doc: dict) -> dict:
+    if doc.get("payment_status") != "Paid":
+        return {}
+    paid = doc.get("paid_amount") or 0.0
+    contributions = {TOTAL: {"revenue": paid}}
+    month = month_key(doc.get("billing_date"))
+    if month:
+        contributions[month] = {"revenue": paid}
+    return contributions
+
+
+CONTRIBUTIONS = {
+    "patients": _patient_contributions,
+    "staff": _staff_contributions,
+    "appointments": _appointment_contributions,
+    "billing": _billing_contributions,
+}
+
+# Fields each contribution function reads, used to keep reconciliation scans narrow
+CONTRIBUTION_FIELDS = {
+    "patients": ["created_at"],
+    "staff": ["hire_date"],
+    "appointments": ["appointment_date", "status"],
+    "billing": ["payment_status", "paid_amount", "billing_date"],
+}
+
+
+def diff(collection: str, before: Optional[dict], after: Optional[dict]) -> dict:
+    """Counter deltas for a document going from `before` to `after` (None for create/delete)"""
+    contribute = CONTRIBUTIONS[collection]
+    deltas = defaultdict(lambda: defaultdict(float))
+    if after is not None:
+        for stat_id, counters in contribute(after).items():
+            for name, amount in counters.items():
+                deltas[stat_id][name] += amount
+    if before is not None:
+        for stat_id, counters in contribute(before).items():
+            for name, amount in counters.items():
+                deltas[stat_id][name] -= amount
+
+    result = {}
+    for stat_id, counters in deltas.items():
+        changed = {name: _number(amount) for name, amount in counters.items() if amount}
+        if changed:
+            result[stat_id] = changed
+    return result
+
+
+def _number(amount: float):
+    return int(amount) if float(amount).is_integer() else amount
+
+
+async def apply_change(db, collection: str, before: Optional[dict], after: Optional[dict]):
+    await apply_changes(db, collection, [(before, after)])
+
+
+async def apply_changes(db, collection: str, changes: list):
+    """Repository write hook: merge the deltas of many (before, after) pairs into one bulk_write"""
+    merged = defaultdict(lambda: defaultdict(float))
+    for before, after in changes:
+        for stat_id, counters in diff(collection, before, after).items():
+            for name, amount in counters.items():
+                merged[stat_id][name] += amount
+    deltas = {}
+    for stat_id, counters in merged.items():
+        changed = {name: _number(amount) for name, amount in counters.items() if amount}
+        if changed:
+            deltas[stat_id] = changed
+    await apply_deltas(db, deltas)
+
+
+async def apply_deltas(db, deltas: dict):
+    if not deltas:
+        return
+    await db[STATS_COLLECTION].bulk_write(
+        [UpdateOne({"_id": stat_id}, {"$inc": counters}, upsert=True) for stat_id, counters in deltas.items()],
+        ordered=False,
+    )
+
+
+async def read_stats(db, stat_ids: list) -> dict:
+    """Fetch several counter documents in one query, missing ones come back empty"""
+    docs = {stat_id: {} for stat_id in stat_ids}
+    async for doc in db[STATS_COLLECTION].find({"_id": {"$in": stat_ids}}):
+        docs[doc["_id"]] = doc
+    return docs
+
+
+def _flatten(doc: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in doc.items():
+        if key == "_id":
+            continue
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path + "."))
+        else:
+            flat[path] = value
+    return flat
+
+
+def _unflatten(flat: dict) -> dict:
+    doc = {}
+    for path, value in flat.items():
+        target = doc
+        *parents, leaf = path.split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[leaf] = value
+    return doc
+
+
+async def reconcile(db, apply: bool = False) -> dict:
+    """
+    Recompute every counter from the source collections and compare with `stats`.
+
+    Returns {stat_id: {counter: (stored, expected)}} for every counter that drifted.
+    With apply=True the stats collection is rewritten with the expected values.
+    """
+    expected = defaultdict(lambda: defaultdict(float))
+    for collection, fields in CONTRIBUTION_FIELDS.items():
+        async for doc in db[collection].find({}, {field: 1 for field in fields}):
+            for stat_id, counters in CONTRIBUTIONS[collection](doc).items():
+                for name, amount in counters.items():
+                    expected[stat_id][name] += amount
+
+    stored = {doc["_id"]: _flatten(doc) async for doc in db[STATS_COLLECTION].find()}
+
+    drift = {}
+    for stat_id in set(expected) | set(stored):
+        want = {name: _number(amount) for name, amount in expected.get(stat_id, {}).items() if amount}
+        have = {name: value for name, value in stored.get(stat_id, {}).items() if value}
+        changed = {
+            name: (have.get(name, 0), want.get(name, 0))
+            for name in set(want) | set(have)
+            if abs(have.get(name, 0) - want.get(name, 0)) > 1e-6
+        }
+        if changed:
+            drift[stat_id] = changed
+
+    if apply:
+        operations = [
+            ReplaceOne({"_id": stat_id}, _unflatten({n: _number(a) for n, a in counters.items() if a}), upsert=True)
+            for stat_id, counters in expected.items()
+        ]
+        if operations:
+            await db[STATS_COLLECTION].bulk_write(operations, ordered=False)
+        stale = [stat_id for stat_id in stored if stat_id not in expected]
+        if stale:
+            await db[STATS_COLLECTION].delete_many({"_id": {"$in": stale}})
+
+    return drift
+
+
+async def main(apply: bool) -> int:
+    import database
+    from database import connect_to_mongo, close_mongo_connection
+
+    await connect_to_mongo()
+    try:
+        drift = await reconcile(database.db, apply=apply)
+    finally:
+        await close_mongo_connection()
+
+    for stat_id in sorted(drift):
+        for name, (have, want) in sorted(drift[stat_id].items()):
+            print(f"{stat_id:<20} {name:<40} stored={have} expected={want}")
+    print(f"\n{len(drift)} counter documents drifted" + (", rebuilt" if apply and drift else ""))
+    return 1 if drift and not apply else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="rewrite the counters with the recomputed values")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.apply)))
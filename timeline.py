@@ -0,0 +1,127 @@
+"""
+Patient timeline: a patient with their appointments, medical records and bills,
+newest first, in one aggregation.
+
+The pipeline starts on `patients` and pulls each event collection in with
+`$unionWith`. Every branch matches, sorts and limits on its own
+(patient_id, date, id) index before the merge, so a page costs `limit + 1`
+index entries per collection however long the history is. Pages continue from a
+cursor of the last event's (date, type, id).
+"""
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import HTTPException
+
+from billing_reports import ATTRIBUTION_FIELD
+from database import serialize_document
+from dates import to_clinic, to_utc
+from search import SEARCH_PROJECTION
+
+# type -> (collection, date field, id field)
+TIMELINE_SOURCES = {
+    "appointment": ("appointments", "appointment_date", "appointment_id"),
+    "medical_record": ("medical_records", "visit_date", "record_id"),
+    "bill": ("billing", "billing_date", "bill_id"),
+}
+# fields left out of an event's item, as the collection's own endpoints do
+TIMELINE_PROJECTIONS = {
+    # records written before documents moved to GridFS may still carry the file inline
+    "medical_record": {"document": 0},
+    "bill": {ATTRIBUTION_FIELD: 0},
+}
+
+
+def encode_cursor(event: dict) -> str:
+    date = event.get("date")
+    if isinstance(date, datetime):
+        raw = [to_clinic(date).isoformat(), event["type"], event["id"]]
+    else:
+        # a legacy string date is compared as stored, flagged so it is not parsed back
+        raw = [date, event["type"], event["id"], "raw"]
+    return base64.urlsafe_b64encode(json.dumps(raw).encode()).decode().rstrip("=")
+
+
+def decode_cursor(after: str):
+    try:
+        raw = base64.urlsafe_b64decode(after + "=" * (-len(after) % 4))
+        date_text, event_type, event_id, *flags = json.loads(raw)
+        return (date_text if flags == ["raw"] else to_utc(date_text)), event_type, event_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _after_filter(event_type: str, date_field: str, id_field: str, after) -> dict:
+    """Events ordered after the cursor in (date desc, type desc, id desc)"""
+    date, cursor_type, cursor_id = after
+    if event_type < cursor_type:
+        clauses = [{date_field: {"$lte": date}}]
+    elif event_type > cursor_type:
+        clauses = [{date_field: {"$lt": date}}]
+    else:
+        clauses = [{date_field: {"$lt": date}}, {date_field: date, id_field: {"$lt": cursor_id}}]
+    if isinstance(date, datetime):
+        # $lt on a datetime only matches datetimes, legacy string dates sort below all of them
+        clauses.append({date_field: {"$type": "string"}})
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def _branch(patient_id: str, event_type: str, limit: int, after) -> list:
+    _, date_field, id_field = TIMELINE_SOURCES[event_type]
+    match = {"patient_id": patient_id}
+    if after:
+        match.update(_after_filter(event_type, date_field, id_field, after))
+    stages = [
+        {"$match": match},
+        {"$sort": {date_field: -1, id_field: -1}},
+        {"$limit": limit},
+    ]
+    if event_type in TIMELINE_PROJECTIONS:
+        stages.append({"$project": TIMELINE_PROJECTIONS[event_type]})
+    return stages + [
+        {"$replaceRoot": {"newRoot": {"rank": 1, "type": {"$literal": event_type}, "date": f"${date_field}",
+                                      "id": f"${id_field}", "item": "$$ROOT"}}},
+    ]
+
+
+def timeline_pipeline(patient_id: str, types: List[str], limit: int, after=None) -> list:
+    pipeline = [
+        {"$match": {"patient_id": patient_id}},
+        {"$project": SEARCH_PROJECTION},
+        {"$replaceRoot": {"newRoot": {"rank": 0, "type": "patient", "item": "$$ROOT"}}},
+    ]
+    for event_type in types:
+        collection = TIMELINE_SOURCES[event_type][0]
+        pipeline.append({"$unionWith": {"coll": collection, "pipeline": _branch(patient_id, event_type, limit + 1, after)}})
+    pipeline += [
+        {"$sort": {"rank": 1, "date": -1, "type": -1, "id": -1}},
+        {"$limit": limit + 2},  # the patient, the page and one more to know if there is a next page
+    ]
+    return pipeline
+
+
+async def patient_timeline(db, patient_id: str, limit: int = 50, after: Optional[str] = None,
+                           types: Optional[List[str]] = None) -> dict:
+    types = types or list(TIMELINE_SOURCES)
+    unknown = [t for t in types if t not in TIMELINE_SOURCES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown timeline types: {', '.join(unknown)}")
+
+    rows = await db.patients.aggregate(timeline_pipeline(patient_id, types, limit, decode_cursor(after) if after else None)).to_list(length=None)
+    if not rows or rows[0]["type"] != "patient":
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    events = rows[1:]
+    next_cursor = encode_cursor(events[limit - 1]) if len(events) > limit else None
+    return {
+        "patient": serialize_document(rows[0]["item"]),
+        "events": [
+            {"type": event["type"], "id": event["id"], "data": serialize_document(event["item"]),
+             "date": to_clinic(event["date"]) if isinstance(event.get("date"), datetime) else event.get("date")}
+            for event in events[:limit]
+        ],
+        "next_cursor": next_cursor,
+        "limit": limit,
+    }
@@ -1,13 +1,66 @@
-import uuid
+import base64
+import os
+import threading
+import time
+from collections import OrderedDict
 from database import serialize_document
 from datetime import datetime, timezone
 from typing import Optional
-import pytz
 from zoneinfo import ZoneInfo
+from dates import CLINIC_TIMEZONE
+
+# Business IDs are ULIDs: 48 bits of milliseconds then 80 random bits, as 26 Crockford
+# base32 characters, so they sort by creation time and new keys land at the right edge of
+# the index instead of all over it. Within one millisecond a process increments the random
+# part, so its IDs are strictly increasing; across processes 80 random bits make a clash
+# practically impossible (the unique indexes still guard against it).
+CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+RANDOM_BITS = 80
+_id_lock = threading.Lock()
+_last_ms = 0
+_last_random = 0
+
+_TO_CROCKFORD = bytes.maketrans(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ234567", CROCKFORD.encode())
+
+def _encode_ulid(value: int) -> str:
+    # 20 bytes are exactly 32 base32 characters, the last 26 hold the 128 bit value
+    return base64.b32encode(value.to_bytes(20, "big"))[6:].translate(_TO_CROCKFORD).decode()
+
+def _next_ulids(count: int) -> list:
+    global _last_ms, _last_random
+    with _id_lock:
+        now = time.time_ns() // 1_000_000
+        if now > _last_ms:
+            _last_ms, _last_random = now, int.from_bytes(os.urandom(10), "big")
+        else:
+            # same millisecond, or the clock stepped back: keep counting from the last ID
+            _last_random += 1
+        values = []
+        for _ in range(count):
+            if _last_random >> RANDOM_BITS:
+                _last_ms, _last_random = _last_ms + 1, 0
+            values.append((_last_ms << RANDOM_BITS) | _last_random)
+            _last_random += 1
+        _last_random -= 1
+    return [_encode_ulid(value) for value in values]
 
 def generate_unique_id(prefix: str) -> str:
-    """Generate a unique ID with a prefix"""
-    return f"{prefix}_{str(uuid.uuid4())[:8]}"
+    """Generate a unique, time ordered ID with a prefix, e.g. PAT_01J9Z3M4QK8W5V6X7Y8Z9A0B1C"""
+    return f"{prefix}_{_next_ulids(1)[0]}"
+
+def generate_unique_ids(prefix: str, count: int) -> list:
+    """`count` consecutive IDs for a batch insert, taken under one lock"""
+    return [f"{prefix}_{ulid}" for ulid in _next_ulids(count)]
+
+def id_timestamp(business_id: str) -> Optional[datetime]:
+    """Creation time encoded in an ID from generate_unique_id, None for legacy IDs"""
+    ulid = business_id.rpartition("_")[2]
+    if len(ulid) != 26 or any(c not in CROCKFORD for c in ulid):
+        return None
+    ms = 0
+    for c in ulid[:10]:
+        ms = ms * 32 + CROCKFORD.index(c)
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
 
 def format_datetime(dt_str: str) -> str:
     """Validate and format datetime string"""
@@ -25,6 +78,41 @@ def get_current_utc():
     return datetime.now(timezone.utc)
 
 def get_datetime() -> str:
-    """Get current UTC+5:45 time in ISO format (string)."""
-    nepal_timezone = pytz.timezone('Asia/Kathmandu')
-    return datetime.now(nepal_timezone).isoformat()
\ No newline at end of file
+    """Get current clinic (UTC+5:45) time in ISO format (string)."""
+    return datetime.now(CLINIC_TIMEZONE).isoformat()
+
+
+class TTLCache:
+    """Small in-process LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)